@@ -1,33 +1,41 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 import pymysql
 from datetime import datetime
 
+from app.core.cache import catalog_cache, catalog_response
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
 from app.models.schemas.adicional import AdicionalCreate, AdicionalUpdate
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+CACHE_KEY = "adicionales"
+
+def _cargar_adicionales():
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT 
+                    a.id,
+                    a.codigo,
+                    a.nombre,
+                    a.descripcion,
+                    a.activo,
+                    t.precio_base as precio
+                FROM adicional a
+                LEFT JOIN tarifa t ON a.tarifa_id = t.id
+                WHERE a.activo = 1
+                ORDER BY a.nombre
+            """)
+            adicionales = cursor.fetchall()
+            return {"adicionales": adicionales}
 
 @router.get("/", response_model=dict)
-def get_adicionales():
+def get_adicionales(request: Request, response: Response):
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        a.id,
-                        a.codigo,
-                        a.nombre,
-                        a.descripcion,
-                        a.activo,
-                        t.precio_base as precio
-                    FROM adicional a
-                    LEFT JOIN tarifa t ON a.tarifa_id = t.id
-                    WHERE a.activo = 1
-                    ORDER BY a.nombre
-                """)
-                adicionales = cursor.fetchall()
-                return {"adicionales": adicionales}
+        entry = catalog_cache.get_or_load(CACHE_KEY, _cargar_adicionales)
+        return catalog_response(request, response, entry)
     except Exception as e:
         error_msg = str(e)
         if "adicional" in error_msg.lower():
@@ -93,6 +101,7 @@ def create_adicional(adicional: AdicionalCreate):
                 ))
                 adicional_id = cursor.lastrowid
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -150,6 +159,7 @@ def update_adicional(adicional_id: int, adicional: AdicionalUpdate):
                     cursor.execute(query, values)
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -178,6 +188,7 @@ def delete_adicional(adicional_id: int):
                     cursor.execute("DELETE FROM tarifa WHERE id = %s", (adicional_info['tarifa_id'],))
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
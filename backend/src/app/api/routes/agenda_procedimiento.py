@@ -3,13 +3,48 @@ from datetime import datetime, timedelta, date
 from typing import Optional, Union
 import traceback
 
+from app.core.config import settings
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
 from app.models.schemas.agenda_procedimientos import (
     AgendaProcedimientoCreate, AgendaProcedimientoUpdate,
     AgendaProcedimientoResponse, EstadoProcedimiento
 )
+from app.services.agenda_indice import indice_agenda
+from app.services.calendario_agenda import calendario_cache
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+def _etiquetar_conflictos(cursor, conflictos: list) -> list:
+    """Nombre de paciente y procedimiento sólo para las filas en conflicto"""
+    if not conflictos:
+        return []
+    ids = [c['id'] for c in conflictos]
+    cursor.execute(f"""
+        SELECT 
+            ap.id,
+            p.nombre as paciente_nombre,
+            p.apellido as paciente_apellido,
+            proc.nombre as procedimiento_nombre
+        FROM agenda_procedimientos ap
+        LEFT JOIN paciente p ON ap.numero_documento = p.numero_documento
+        LEFT JOIN procedimiento proc ON ap.procedimiento_id = proc.id
+        WHERE ap.id IN ({', '.join(['%s'] * len(ids))})
+    """, ids)
+    etiquetas = {fila['id']: fila for fila in cursor.fetchall()}
+    return [
+        {
+            "id": c['id'],
+            "fecha": c['fecha'],
+            "hora": c['hora'],
+            "duracion": c['duracion'],
+            "estado": c['estado'],
+            "paciente_nombre": etiquetas.get(c['id'], {}).get('paciente_nombre'),
+            "paciente_apellido": etiquetas.get(c['id'], {}).get('paciente_apellido'),
+            "procedimiento_nombre": etiquetas.get(c['id'], {}).get('procedimiento_nombre'),
+        }
+        for c in conflictos
+    ]
 
 @router.get("/disponibilidad", response_model=dict)
 def verificar_disponibilidad(
@@ -23,77 +58,41 @@ def verificar_disponibilidad(
     Verifica disponibilidad de horario para procedimientos.
     """
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                # Asegurar formato de hora
-                hora_inicio = hora
-                if hora_inicio.count(":") == 1:
-                    hora_inicio += ":00"  
-                hora_fin = (datetime.strptime(hora_inicio, '%H:%M:%S') + 
-                           timedelta(minutes=duracion)).strftime('%H:%M:%S')
-                
-                # Normalizar procedimiento_id
-                proc_id_int = None
-                if procedimiento_id is not None and procedimiento_id != "":
-                    try:
-                        proc_id_int = int(procedimiento_id)
-                    except ValueError:
-                        raise HTTPException(
-                            status_code=422,
-                            detail="procedimiento_id debe ser un entero válido"
-                        )
-                
-                # Query base
-                query = """
-                    SELECT 
-                        ap.id,
-                        ap.fecha,
-                        ap.hora,
-                        ap.duracion,
-                        ap.estado,
-                        p.nombre as paciente_nombre,
-                        p.apellido as paciente_apellido,
-                        proc.nombre as procedimiento_nombre
-                    FROM agenda_procedimientos ap
-                    JOIN paciente p ON ap.numero_documento = p.numero_documento
-                    JOIN procedimiento proc ON ap.procedimiento_id = proc.id
-                    WHERE ap.fecha = %s 
-                    AND ap.estado NOT IN ('Cancelado', 'Operado')
-                """
-                params = [fecha]
-                
-                # Agregar condiciones opcionales
-                if exclude_id:
-                    query += " AND ap.id != %s"
-                    params.append(exclude_id)
-                
-                if proc_id_int is not None:
-                    query += " AND ap.procedimiento_id = %s"
-                    params.append(proc_id_int)
-                
-                # Condición de solapamiento de horarios
-                query += """
-                    AND (
-                        (TIME(%s) >= TIME(ap.hora) AND TIME(%s) < ADDTIME(TIME(ap.hora), SEC_TO_TIME(ap.duracion * 60)))
-                        OR
-                        (TIME(ap.hora) >= TIME(%s) AND TIME(ap.hora) < TIME(%s))
-                    )
-                    ORDER BY ap.hora
-                """
-                params.extend([hora_inicio, hora_inicio, hora_inicio, hora_fin])
-                cursor.execute(query, params)
-                conflictos = cursor.fetchall()
-                
-                disponible = len(conflictos) == 0
-                
-                return {
-                    "success": True,
-                    "disponible": disponible,
-                    "conflictos": conflictos,
-                    "total_conflictos": len(conflictos),
-                    "mensaje": "Horario disponible" if disponible else "Horario no disponible",
-                }
+        # Normalizar procedimiento_id
+        proc_id_int = None
+        if procedimiento_id is not None and procedimiento_id != "":
+            try:
+                proc_id_int = int(procedimiento_id)
+            except ValueError:
+                raise HTTPException(
+                    status_code=422,
+                    detail="procedimiento_id debe ser un entero válido"
+                )
+        
+        try:
+            conflictos = indice_agenda.conflictos(
+                fecha, hora, duracion,
+                exclude_id=exclude_id,
+                procedimiento_id=proc_id_int
+            )
+        except ValueError as ve:
+            raise HTTPException(status_code=422, detail=f"Fecha u hora inválida: {ve}")
+        
+        if conflictos:
+            conn = get_connection()
+            with conn:
+                with conn.cursor() as cursor:
+                    conflictos = _etiquetar_conflictos(cursor, conflictos)
+        
+        disponible = len(conflictos) == 0
+        
+        return {
+            "success": True,
+            "disponible": disponible,
+            "conflictos": conflictos,
+            "total_conflictos": len(conflictos),
+            "mensaje": "Horario disponible" if disponible else "Horario no disponible",
+        }
                 
     except HTTPException:
         raise
@@ -107,6 +106,47 @@ def verificar_disponibilidad(
             "conflictos": []
         }
 
+@router.get("/disponibilidad/huecos", response_model=dict)
+def buscar_huecos_disponibles(
+    fecha: str,
+    duracion: int = Query(60, ge=1, le=24 * 60, description="Duración en minutos"),
+    cantidad: int = Query(5, ge=1, le=100, description="Cuántos horarios libres devolver"),
+    desde: Optional[str] = Query(None, description="Hora desde la que buscar (HH:MM). Por defecto inicio de jornada"),
+    hasta: Optional[str] = Query(None, description="Hora límite (HH:MM). Por defecto fin de jornada"),
+    paso: int = Query(30, ge=5, le=240, description="Granularidad en minutos de los horarios propuestos")
+):
+    """
+    Próximos horarios libres de `duracion` minutos en el día `fecha`, para el
+    selector de horario del agendador.
+    """
+    try:
+        try:
+            huecos = indice_agenda.huecos(
+                fecha, duracion, cantidad,
+                desde=desde or settings.AGENDA_HORA_INICIO,
+                hasta=hasta or settings.AGENDA_HORA_FIN,
+                paso=paso
+            )
+        except ValueError as ve:
+            raise HTTPException(status_code=422, detail=f"Fecha u hora inválida: {ve}")
+        
+        return {
+            "success": True,
+            "fecha": fecha,
+            "duracion": duracion,
+            "huecos": huecos,
+            "total": len(huecos)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail={
+            "error": "Error buscando horarios disponibles",
+            "message": str(e)
+        })
+
 @router.get("/", response_model=dict)
 def get_agenda_procedimientos(
     limit: int = Query(100, description="Límite de resultados"),
@@ -258,29 +298,16 @@ def create_agenda_procedimiento(procedimiento: AgendaProcedimientoCreate):
                         detail=f"Procedimiento con ID {procedimiento.procedimiento_id} no encontrado"
                     )
                 
-                # Verificar disponibilidad
-                duracion = procedimiento.duracion or 60
-                hora_inicio = procedimiento.hora
-                hora_fin = (datetime.strptime(hora_inicio, '%H:%M:%S') + 
-                           timedelta(minutes=duracion)).strftime('%H:%M:%S')
-
-                cursor.execute("""
-                    SELECT id, fecha, hora, duracion, estado 
-                    FROM agenda_procedimientos 
-                    WHERE fecha = %s 
-                    AND estado NOT IN ('Cancelado', 'Operado')
-                    AND (
-                        (TIME(%s) >= TIME(hora) AND TIME(%s) < ADDTIME(TIME(hora), SEC_TO_TIME(duracion * 60)))
-                        OR
-                        (TIME(hora) >= TIME(%s) AND TIME(hora) < TIME(%s))
+                # Verificar disponibilidad contra el día recién leído de la base de datos
+                indice_agenda.invalidar(procedimiento.fecha)
+                try:
+                    conflictos = indice_agenda.conflictos(
+                        procedimiento.fecha, procedimiento.hora,
+                        procedimiento.duracion or 60, cursor=cursor
                     )
-                """, (
-                    procedimiento.fecha,
-                    hora_inicio, hora_inicio,
-                    hora_inicio, hora_fin
-                ))
+                except ValueError as ve:
+                    raise HTTPException(status_code=422, detail=f"Hora inválida: {ve}")
                 
-                conflictos = cursor.fetchall()
                 if conflictos:
                     conflicto_info = conflictos[0]
                     raise HTTPException(
@@ -307,6 +334,8 @@ def create_agenda_procedimiento(procedimiento: AgendaProcedimientoCreate):
                 
                 procedimiento_id = cursor.lastrowid
                 conn.commit()
+                indice_agenda.invalidar(procedimiento.fecha)
+                calendario_cache.refrescar_fila(procedimiento_id, cursor)
                 
                 return {
                     "success": True,
@@ -346,29 +375,15 @@ def update_agenda_procedimiento(procedimiento_id: int, procedimiento: AgendaProc
                 
                 # Verificar disponibilidad si se cambia fecha/hora/duración
                 if procedimiento.fecha or procedimiento.hora or procedimiento.duracion is not None:
-                    hora_inicio = hora
-                    hora_fin = (datetime.strptime(hora_inicio, '%H:%M:%S') + 
-                               timedelta(minutes=duracion)).strftime('%H:%M:%S')
-                    
-                    cursor.execute("""
-                        SELECT id, fecha, hora, duracion, estado 
-                        FROM agenda_procedimientos 
-                        WHERE fecha = %s 
-                        AND id != %s
-                        AND estado NOT IN ('Cancelado', 'Operado')
-                        AND (
-                            (TIME(%s) >= TIME(hora) AND TIME(%s) < ADDTIME(TIME(hora), SEC_TO_TIME(duracion * 60)))
-                            OR
-                            (TIME(hora) >= TIME(%s) AND TIME(hora) < TIME(%s))
+                    indice_agenda.invalidar(fecha)
+                    try:
+                        conflictos = indice_agenda.conflictos(
+                            fecha, hora, duracion,
+                            exclude_id=procedimiento_id, cursor=cursor
                         )
-                    """, (
-                        fecha,
-                        procedimiento_id,
-                        hora_inicio, hora_inicio,
-                        hora_inicio, hora_fin
-                    ))
+                    except ValueError as ve:
+                        raise HTTPException(status_code=422, detail=f"Hora inválida: {ve}")
                     
-                    conflictos = cursor.fetchall()
                     if conflictos:
                         conflicto_info = conflictos[0]
                         raise HTTPException(
@@ -419,6 +434,8 @@ def update_agenda_procedimiento(procedimiento_id: int, procedimiento: AgendaProc
                 query = f"UPDATE agenda_procedimientos SET {', '.join(update_fields)} WHERE id = %s"
                 cursor.execute(query, values)
                 conn.commit()
+                indice_agenda.invalidar(procedimiento_existente['fecha'], fecha)
+                calendario_cache.refrescar_fila(procedimiento_id, cursor)
                 
                 return {
                     "success": True,
@@ -441,13 +458,15 @@ def delete_agenda_procedimiento(procedimiento_id: int):
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("SELECT id FROM agenda_procedimientos WHERE id = %s", (procedimiento_id,))
+                cursor.execute("SELECT id, fecha FROM agenda_procedimientos WHERE id = %s", (procedimiento_id,))
                 procedimiento_existente = cursor.fetchone()
                 if not procedimiento_existente:
                     raise HTTPException(status_code=404, detail="Procedimiento agendado no encontrado")
                 
                 cursor.execute("DELETE FROM agenda_procedimientos WHERE id = %s", (procedimiento_id,))
                 conn.commit()
+                indice_agenda.invalidar(procedimiento_existente['fecha'])
+                calendario_cache.quitar(procedimiento_id)
                 
                 return {
                     "success": True,
@@ -478,59 +497,25 @@ def get_estados_procedimiento():
     }
 
 @router.get("/calendario/{year}/{month}", response_model=dict)
-def get_calendario_procedimientos(year: int, month: int):
+def get_calendario_procedimientos(
+    year: int,
+    month: int,
+    desde_version: Optional[int] = Query(None, description="Versión que ya tiene el cliente: devuelve sólo los cambios")
+):
+    """
+    Procedimientos del mes agrupados por fecha, servidos desde el calendario
+    materializado. Con `desde_version` responde `delta: true` con las filas
+    actualizadas y los ids eliminados desde esa versión (o el mes completo si
+    ya no se puede armar el delta).
+    """
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="El mes debe estar entre 1 y 12")
+    if not 1900 <= year <= 2200:
+        raise HTTPException(status_code=400, detail="El año debe estar entre 1900 y 2200")
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                fecha_inicio = f"{year}-{month:02d}-01"
-                if month == 12:
-                    fecha_fin = f"{year+1}-01-01"
-                else:
-                    fecha_fin = f"{year}-{month+1:02d}-01"
-                
-                cursor.execute("""
-                    SELECT 
-                        ap.id,
-                        ap.fecha,
-                        ap.hora,
-                        ap.estado,
-                        ap.duracion,
-                        p.nombre as paciente_nombre,
-                        p.apellido as paciente_apellido,
-                        proc.nombre as procedimiento_nombre,
-                        proc.precio as procedimiento_precio
-                    FROM agenda_procedimientos ap
-                    JOIN paciente p ON ap.numero_documento = p.numero_documento
-                    JOIN procedimiento proc ON ap.procedimiento_id = proc.id
-                    WHERE ap.fecha >= %s AND ap.fecha < %s
-                    ORDER BY ap.fecha, ap.hora
-                """, (fecha_inicio, fecha_fin))
-                
-                procedimientos = cursor.fetchall()
-                
-                calendario = {}
-                for proc in procedimientos:
-                    fecha_str = str(proc['fecha'])
-                    if fecha_str not in calendario:
-                        calendario[fecha_str] = []
-                    
-                    calendario[fecha_str].append({
-                        "id": proc['id'],
-                        "hora": proc['hora'][:5],
-                        "estado": proc['estado'],
-                        "duracion": proc['duracion'],
-                        "paciente": f"{proc['paciente_nombre']} {proc['paciente_apellido']}",
-                        "procedimiento": proc['procedimiento_nombre'],
-                        "precio": proc['procedimiento_precio']
-                    })
-                
-                return {
-                    "year": year,
-                    "month": month,
-                    "procedimientos": calendario,
-                    "total": len(procedimientos)
-                }
+        if desde_version is not None:
+            return calendario_cache.cambios_desde(year, month, desde_version)
+        return calendario_cache.calendario(year, month)
                 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
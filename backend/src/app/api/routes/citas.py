@@ -1,27 +1,40 @@
 from fastapi import APIRouter, HTTPException, Query
 import pymysql
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Optional
 
+from app.core.config import settings
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.agenda_indice import a_minutos
+from app.services.contadores import contadores_dashboard
+from app.services.exportacion import filtro_fechas, respuesta_exportacion
+from app.services.huecos_citas import buscar_huecos, intervalos_ocupados
+from app.utils.pagination import decode_cursor, keyset_condition, paginate_keyset, approximate_count
 from app.models.schemas.cita import CitaCreate, CitaUpdate, CitaInDB
 from app.models.schemas.paciente import MessageResponse
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 @router.get("/", response_model=dict)
 def get_citas(
-    limit: int = Query(50, description="Número máximo de resultados"),
-    offset: int = Query(0, description="Desplazamiento para paginación")
+    limit: int = Query(50, ge=1, le=1000, description="Número máximo de resultados"),
+    offset: int = Query(0, ge=0, description="Desplazamiento para paginación"),
+    paginacion: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' o 'cursor' (paginación por llave)"),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Valor de next_cursor de la página anterior"),
+    incluir_total: bool = Query(False, description="En modo cursor, calcular el total exacto")
 ):
     """
     Obtiene lista de citas con información de paciente y doctor
+    
+    En modo cursor se ordena por (fecha_hora, id) y la página siguiente se
+    busca con `WHERE (c.fecha_hora, c.id) < cursor`.
     """
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                query = """
                     SELECT c.*, 
                            p.nombre as paciente_nombre, 
                            p.apellido as paciente_apellido,
@@ -32,15 +45,183 @@ def get_citas(
                     JOIN paciente p ON c.paciente_id = p.id
                     JOIN usuario u ON c.usuario_id = u.id
                     JOIN estado_cita ec ON c.estado_id = ec.id
-                    ORDER BY c.fecha_hora DESC
-                    LIMIT %s OFFSET %s
-                """, (limit, offset))
+                """
+                
+                if paginacion == "cursor" or cursor_token:
+                    params = []
+                    if cursor_token:
+                        try:
+                            valores = decode_cursor(cursor_token, 2)
+                        except ValueError as ve:
+                            raise HTTPException(status_code=400, detail=str(ve))
+                        condicion, params = keyset_condition(["c.fecha_hora", "c.id"], valores)
+                        query += f" WHERE {condicion}"
+                    query += " ORDER BY c.fecha_hora DESC, c.id DESC LIMIT %s"
+                    params.append(limit + 1)
+                    
+                    cursor.execute(query, params)
+                    citas, next_cursor = paginate_keyset(cursor.fetchall(), ["fecha_hora", "id"], limit)
+                    
+                    respuesta = {"citas": citas, "limit": limit, "next_cursor": next_cursor}
+                    if incluir_total:
+                        cursor.execute("SELECT COUNT(*) as total FROM cita")
+                        respuesta["total"] = cursor.fetchone()['total']
+                    else:
+                        respuesta["total_aproximado"] = approximate_count(cursor, "cita")
+                    return respuesta
+                
+                query += " ORDER BY c.fecha_hora DESC LIMIT %s OFFSET %s"
+                cursor.execute(query, (limit, offset))
                 citas = cursor.fetchall()
                 
                 return {"citas": citas}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/huecos-disponibles", response_model=dict)
+def buscar_huecos_citas(
+    fecha_desde: date = Query(..., description="Primer día a buscar (YYYY-MM-DD)"),
+    fecha_hasta: Optional[date] = Query(None, description="Último día a buscar, inclusive. Por defecto fecha_desde"),
+    duracion: int = Query(30, ge=5, le=480, description="Duración de la cita en minutos"),
+    usuario_id: Optional[str] = Query(None, description="ID del doctor o varios separados por coma. Vacío = todos los usuarios activos"),
+    hora_inicio: Optional[str] = Query(None, description="Inicio de la jornada (HH:MM)"),
+    hora_fin: Optional[str] = Query(None, description="Fin de la jornada (HH:MM)"),
+    paso: int = Query(15, ge=5, le=240, description="Granularidad en minutos de los horarios propuestos"),
+    cantidad: int = Query(20, ge=1, le=500, description="Máximo de horarios por doctor")
+):
+    """
+    Horarios libres por doctor donde cabe una cita de `duracion` minutos.
+    
+    Carga las citas no canceladas del rango en una sola consulta, las fusiona
+    en intervalos ocupados usando `duracion_minutos` y busca los huecos de
+    todos los días a la vez (ver app/services/huecos_citas.py).
+    """
+    try:
+        fecha_hasta = fecha_hasta or fecha_desde
+        if fecha_hasta < fecha_desde:
+            raise HTTPException(status_code=400, detail="fecha_hasta no puede ser anterior a fecha_desde")
+        if (fecha_hasta - fecha_desde).days + 1 > settings.CITAS_BUSQUEDA_MAX_DIAS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"El rango no puede superar {settings.CITAS_BUSQUEDA_MAX_DIAS} días"
+            )
+        
+        try:
+            inicio_jornada = a_minutos(hora_inicio or settings.CITAS_HORA_INICIO)
+            fin_jornada = a_minutos(hora_fin or settings.CITAS_HORA_FIN)
+            ids = [int(i) for i in usuario_id.split(",") if i.strip()] if usuario_id else []
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=f"Parámetro inválido: {ve}")
+        if fin_jornada <= inicio_jornada:
+            raise HTTPException(status_code=400, detail="hora_fin debe ser posterior a hora_inicio")
+        
+        desde = datetime.combine(fecha_desde, datetime.min.time())
+        hasta = datetime.combine(fecha_hasta + timedelta(days=1), datetime.min.time())
+        
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                if ids:
+                    cursor.execute(
+                        f"SELECT id, nombre FROM usuario WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                        ids
+                    )
+                else:
+                    cursor.execute("SELECT id, nombre FROM usuario WHERE activo = 1")
+                doctores = cursor.fetchall()
+                if ids and len(doctores) != len(set(ids)):
+                    encontrados = {d['id'] for d in doctores}
+                    faltantes = [str(i) for i in ids if i not in encontrados]
+                    raise HTTPException(status_code=404, detail=f"Usuario(s) no encontrado(s): {', '.join(faltantes)}")
+                if not doctores:
+                    return {"success": True, "duracion": duracion, "doctores": []}
+                
+                doctor_ids = [d['id'] for d in doctores]
+                cursor.execute(f"""
+                    SELECT c.usuario_id, c.fecha_hora, c.duracion_minutos
+                    FROM cita c
+                    LEFT JOIN estado_cita ec ON c.estado_id = ec.id
+                    WHERE c.usuario_id IN ({', '.join(['%s'] * len(doctor_ids))})
+                    AND c.fecha_hora >= %s AND c.fecha_hora < %s
+                    AND (ec.nombre IS NULL OR ec.nombre NOT LIKE %s)
+                    ORDER BY c.usuario_id, c.fecha_hora
+                """, (*doctor_ids, desde, hasta, "%cancel%"))
+                citas = cursor.fetchall()
+        
+        citas_por_doctor = {}
+        for cita in citas:
+            citas_por_doctor.setdefault(cita['usuario_id'], []).append(cita)
+        
+        ahora = datetime.now()
+        resultado = []
+        for doctor in doctores:
+            ocupados = intervalos_ocupados(citas_por_doctor.get(doctor['id'], []), desde)
+            huecos = buscar_huecos(
+                ocupados, fecha_desde, fecha_hasta, duracion,
+                inicio_jornada, fin_jornada, settings.CITAS_DIAS_LABORALES,
+                paso=paso, cantidad=cantidad, no_antes_de=ahora
+            )
+            resultado.append({
+                "usuario_id": doctor['id'],
+                "doctor_nombre": doctor['nombre'],
+                "citas_en_rango": len(citas_por_doctor.get(doctor['id'], [])),
+                "huecos": huecos,
+                "total": len(huecos)
+            })
+        
+        return {
+            "success": True,
+            "fecha_desde": fecha_desde.isoformat(),
+            "fecha_hasta": fecha_hasta.isoformat(),
+            "duracion": duracion,
+            "doctores": resultado
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error buscando horarios disponibles: {str(e)}")
+
+@router.get("/exportar")
+def exportar_citas(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' o 'csv'"),
+    fecha_desde: Optional[date] = Query(None, description="Citas desde esta fecha (inclusive)"),
+    fecha_hasta: Optional[date] = Query(None, description="Citas hasta esta fecha (inclusive)")
+):
+    """Exporta citas en streaming (NDJSON o CSV), ordenadas por fecha"""
+    try:
+        filtro, params = filtro_fechas("c.fecha_hora", fecha_desde, fecha_hasta)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    try:
+        return respuesta_exportacion(f"""
+            SELECT c.id,
+                   c.paciente_id,
+                   p.nombre as paciente_nombre,
+                   p.apellido as paciente_apellido,
+                   p.numero_documento as paciente_documento,
+                   c.usuario_id,
+                   u.nombre as doctor_nombre,
+                   c.fecha_hora,
+                   c.duracion_minutos,
+                   c.tipo,
+                   c.estado_id,
+                   ec.nombre as estado_nombre,
+                   c.notas
+            FROM cita c
+            JOIN paciente p ON c.paciente_id = p.id
+            JOIN usuario u ON c.usuario_id = u.id
+            JOIN estado_cita ec ON c.estado_id = ec.id
+            {filtro}
+            ORDER BY c.fecha_hora, c.id
+        """, params, formato, "citas")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exportando citas: {str(e)}")
+
 @router.get("/{cita_id}", response_model=dict)
 def get_cita(cita_id: int):
     """
@@ -152,6 +333,7 @@ def create_cita(cita: CitaCreate):
                 
                 cita_id = cursor.lastrowid
                 conn.commit()
+                contadores_dashboard.refrescar_cita(cursor, cita_id)
                 
                 return {
                     "success": True,
@@ -224,6 +406,7 @@ def update_cita(cita_id: int, cita: CitaUpdate):
                 
                 cursor.execute(query, values)
                 conn.commit()
+                contadores_dashboard.refrescar_cita(cursor, cita_id)
                 
                 return {
                     "success": True,
@@ -252,6 +435,7 @@ def delete_cita(cita_id: int):
                 # Eliminar cita
                 cursor.execute("DELETE FROM cita WHERE id = %s", (cita_id,))
                 conn.commit()
+                contadores_dashboard.refrescar_cita(cursor, cita_id)
                 
                 return MessageResponse(message="Cita eliminada exitosamente")
                 
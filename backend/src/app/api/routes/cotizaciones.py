@@ -1,24 +1,113 @@
-from fastapi import APIRouter, HTTPException, Query
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from datetime import date, datetime, timedelta
+from typing import Optional
 import traceback
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.archivos import en_hilo
+from app.services.exportacion import filtro_fechas, respuesta_exportacion
+from app.services.pdf_cotizaciones import datos_pdf, pdf_cotizaciones
+from app.utils.pagination import (
+    decode_cursor, keyset_condition, paginate_keyset, approximate_count
+)
 from app.models.schemas.cotizacion import (
     CotizacionCreate, CotizacionUpdate, CotizacionInDB
 )
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+SERVICIOS_INCLUIDOS_BASE = [
+    {"servicio_nombre": "CIRUJANO PLASTICO, AYUDANTE Y PERSONAL CLINICO", "requiere": False},
+    {"servicio_nombre": "ANESTESIOLOGO", "requiere": False},
+    {"servicio_nombre": "CONTROLES CON MEDICO Y ENFERMERA", "requiere": False},
+    {"servicio_nombre": "VALORACION CON ANESTESIOLOGO", "requiere": False},
+    {"servicio_nombre": "HEMOGRAMA DE CONTROL", "requiere": False},
+    {"servicio_nombre": "UNA NOCHE DE HOSPITALIZACION CON UN ACOMPAÑANTES", "requiere": False},
+    {"servicio_nombre": "IMPLANTES", "requiere": False},
+]
+
+SUBTOTAL_POR_TIPO = {
+    'procedimiento': 'subtotal_procedimientos',
+    'adicional': 'subtotal_adicionales',
+    'otro_adicional': 'subtotal_otros_adicionales',
+}
+
+def cargar_detalles_cotizaciones(cursor, cotizaciones):
+    """
+    Carga items y servicios incluidos de varias cotizaciones en lote.
+
+    Hace una sola consulta `IN (...)` por tabla para toda la página (en lugar
+    de dos consultas por cotización), agrupa en Python y calcula los
+    subtotales por tipo en la misma pasada. Modifica `cotizaciones` in situ.
+    """
+    if not cotizaciones:
+        return cotizaciones
+
+    ids = [c['id'] for c in cotizaciones]
+    placeholders = ", ".join(["%s"] * len(ids))
+
+    items_por_cotizacion = {cid: [] for cid in ids}
+    subtotales = {cid: dict.fromkeys(SUBTOTAL_POR_TIPO.values(), 0.0) for cid in ids}
+
+    cursor.execute(f"""
+        SELECT 
+            id,
+            cotizacion_id,
+            tipo,
+            COALESCE(item_id, procedimiento_id, 0) as item_id,
+            descripcion as nombre,
+            cantidad,
+            precio_unitario,
+            subtotal
+        FROM cotizacion_item
+        WHERE cotizacion_id IN ({placeholders})
+        ORDER BY cotizacion_id, tipo, descripcion
+    """, ids)
+    for item in cursor.fetchall():
+        cid = item.pop('cotizacion_id')
+        items_por_cotizacion[cid].append(item)
+        campo = SUBTOTAL_POR_TIPO.get(item['tipo'])
+        if campo and item['subtotal'] is not None:
+            subtotales[cid][campo] += float(item['subtotal'])
+
+    servicios_por_cotizacion = {cid: [] for cid in ids}
+    cursor.execute(f"""
+        SELECT 
+            cotizacion_id,
+            servicio_nombre,
+            requiere
+        FROM cotizacion_servicio_incluido
+        WHERE cotizacion_id IN ({placeholders})
+    """, ids)
+    for servicio in cursor.fetchall():
+        servicios_por_cotizacion[servicio.pop('cotizacion_id')].append(servicio)
+
+    for cotizacion in cotizaciones:
+        cid = cotizacion['id']
+        cotizacion['items'] = items_por_cotizacion[cid]
+        cotizacion['servicios_incluidos'] = (
+            servicios_por_cotizacion[cid] or [dict(s) for s in SERVICIOS_INCLUIDOS_BASE]
+        )
+        cotizacion.update(subtotales[cid])
+
+    return cotizaciones
 
 @router.get("/", response_model=dict)
 def get_cotizaciones(
-    limit: int = Query(50, description="Límite de resultados"),
-    offset: int = Query(0, description="Offset para paginación")
+    limit: int = Query(50, ge=1, le=1000, description="Límite de resultados"),
+    offset: int = Query(0, ge=0, description="Offset para paginación"),
+    paginacion: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' o 'cursor' (paginación por llave)"),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Valor de next_cursor de la página anterior"),
+    incluir_total: bool = Query(False, description="En modo cursor, calcular el total exacto")
 ):
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                usar_cursor = paginacion == "cursor" or bool(cursor_token)
+                query = """
                     SELECT 
                         c.id,
                         c.paciente_id,
@@ -28,6 +117,7 @@ def get_cotizaciones(
                         ec.nombre as estado_nombre,
                         c.total,
                         c.notas as observaciones,
+                        c.fecha_emision,
                         DATE(c.fecha_emision) as fecha_creacion,
                         DATE(c.fecha_vencimiento) as fecha_vencimiento,
                         p.nombre as paciente_nombre,
@@ -38,65 +128,31 @@ def get_cotizaciones(
                     JOIN paciente p ON c.paciente_id = p.id
                     JOIN usuario u ON c.usuario_id = u.id
                     JOIN estado_cotizacion ec ON c.estado_id = ec.id
-                    ORDER BY c.fecha_emision DESC
-                    LIMIT %s OFFSET %s
-                """, (limit, offset))
-                cotizaciones = cursor.fetchall()
+                """
+                
+                if usar_cursor:
+                    params = []
+                    if cursor_token:
+                        try:
+                            valores = decode_cursor(cursor_token, 2)
+                        except ValueError as ve:
+                            raise HTTPException(status_code=400, detail=str(ve))
+                        condicion, params = keyset_condition(["c.fecha_emision", "c.id"], valores)
+                        query += f" WHERE {condicion}"
+                    query += " ORDER BY c.fecha_emision DESC, c.id DESC LIMIT %s"
+                    params.append(limit + 1)
+                    cursor.execute(query, params)
+                    cotizaciones, next_cursor = paginate_keyset(
+                        cursor.fetchall(), ["fecha_emision", "id"], limit
+                    )
+                else:
+                    query += " ORDER BY c.fecha_emision DESC LIMIT %s OFFSET %s"
+                    cursor.execute(query, (limit, offset))
+                    cotizaciones = cursor.fetchall()
+                
+                cargar_detalles_cotizaciones(cursor, cotizaciones)
                 
                 for cotizacion in cotizaciones:
-                    cursor.execute("""
-                        SELECT 
-                            id,
-                            tipo,
-                            COALESCE(procedimiento_id, 0) as item_id,
-                            descripcion as nombre,
-                            cantidad,
-                            precio_unitario,
-                            subtotal
-                        FROM cotizacion_item
-                        WHERE cotizacion_id = %s
-                        ORDER BY tipo, descripcion
-                    """, (cotizacion['id'],))
-                    items = cursor.fetchall()
-                    
-                    cursor.execute("""
-                        SELECT 
-                            servicio_nombre,
-                            requiere
-                        FROM cotizacion_servicio_incluido
-                        WHERE cotizacion_id = %s
-                    """, (cotizacion['id'],))
-                    servicios_incluidos = cursor.fetchall()
-                    
-                    if not servicios_incluidos:
-                        servicios_incluidos = [
-                            {"servicio_nombre": "CIRUJANO PLASTICO, AYUDANTE Y PERSONAL CLINICO", "requiere": False},
-                            {"servicio_nombre": "ANESTESIOLOGO", "requiere": False},
-                            {"servicio_nombre": "CONTROLES CON MEDICO Y ENFERMERA", "requiere": False},
-                            {"servicio_nombre": "VALORACION CON ANESTESIOLOGO", "requiere": False},
-                            {"servicio_nombre": "HEMOGRAMA DE CONTROL", "requiere": False},
-                            {"servicio_nombre": "UNA NOCHE DE HOSPITALIZACION CON UN ACOMPAÑANTES", "requiere": False},
-                            {"servicio_nombre": "IMPLANTES", "requiere": False},
-                        ]
-                    
-                    subtotal_procedimientos = 0
-                    subtotal_adicionales = 0
-                    subtotal_otros_adicionales = 0
-                    
-                    for item in items:
-                        if item['tipo'] == 'procedimiento':
-                            subtotal_procedimientos += float(item['subtotal'])
-                        elif item['tipo'] == 'adicional':
-                            subtotal_adicionales += float(item['subtotal'])
-                        elif item['tipo'] == 'otro_adicional':
-                            subtotal_otros_adicionales += float(item['subtotal'])
-                    
-                    cotizacion['items'] = items
-                    cotizacion['servicios_incluidos'] = servicios_incluidos
-                    cotizacion['subtotal_procedimientos'] = subtotal_procedimientos
-                    cotizacion['subtotal_adicionales'] = subtotal_adicionales
-                    cotizacion['subtotal_otros_adicionales'] = subtotal_otros_adicionales
-                    
                     if cotizacion['fecha_vencimiento'] and cotizacion['fecha_creacion']:
                         try:
                             fecha_creacion = datetime.strptime(str(cotizacion['fecha_creacion']), '%Y-%m-%d')
@@ -108,6 +164,19 @@ def get_cotizaciones(
                     else:
                         cotizacion['validez_dias'] = 7
                 
+                if usar_cursor:
+                    respuesta = {
+                        "cotizaciones": cotizaciones,
+                        "limit": limit,
+                        "next_cursor": next_cursor
+                    }
+                    if incluir_total:
+                        cursor.execute("SELECT COUNT(*) as total FROM cotizacion")
+                        respuesta["total"] = cursor.fetchone()['total']
+                    else:
+                        respuesta["total_aproximado"] = approximate_count(cursor, "cotizacion")
+                    return respuesta
+                
                 cursor.execute("SELECT COUNT(*) as total FROM cotizacion")
                 total = cursor.fetchone()['total']
                 
@@ -117,104 +186,159 @@ def get_cotizaciones(
                     "limit": limit,
                     "offset": offset
                 }
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         if "cotizacion" in error_msg.lower():
             return {"cotizaciones": [], "total": 0}
         raise HTTPException(status_code=500, detail=error_msg)
         
+def _cargar_detalles_lote(cotizaciones):
+    """Items y servicios de un lote exportado, con su propia conexión"""
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cargar_detalles_cotizaciones(cursor, cotizaciones)
+
+@router.get("/exportar")
+def exportar_cotizaciones(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' o 'csv'"),
+    fecha_desde: Optional[date] = Query(None, description="Emitidas desde esta fecha (inclusive)"),
+    fecha_hasta: Optional[date] = Query(None, description="Emitidas hasta esta fecha (inclusive)"),
+    incluir_items: bool = Query(False, description="Sólo NDJSON: agregar items y servicios incluidos")
+):
+    """
+    Exporta cotizaciones en streaming (NDJSON o CSV). Con `incluir_items`
+    los detalles se cargan con una consulta `IN (...)` por lote.
+    """
+    if incluir_items and formato != "ndjson":
+        raise HTTPException(status_code=400, detail="incluir_items sólo está disponible en formato ndjson")
+    try:
+        filtro, params = filtro_fechas("c.fecha_emision", fecha_desde, fecha_hasta)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    try:
+        return respuesta_exportacion(f"""
+            SELECT 
+                c.id,
+                c.paciente_id,
+                p.nombre as paciente_nombre,
+                p.apellido as paciente_apellido,
+                p.numero_documento as paciente_documento,
+                c.usuario_id,
+                u.nombre as usuario_nombre,
+                c.plan_id,
+                c.estado_id,
+                ec.nombre as estado_nombre,
+                c.subtotal_procedimientos,
+                c.subtotal_adicionales,
+                c.subtotal_otros_adicionales,
+                c.total,
+                c.notas as observaciones,
+                c.fecha_emision,
+                c.fecha_vencimiento
+            FROM cotizacion c
+            JOIN paciente p ON c.paciente_id = p.id
+            JOIN usuario u ON c.usuario_id = u.id
+            JOIN estado_cotizacion ec ON c.estado_id = ec.id
+            {filtro}
+            ORDER BY c.fecha_emision, c.id
+        """, params, formato, "cotizaciones", detalles=_cargar_detalles_lote if incluir_items else None)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail={
+            "error": "Error exportando cotizaciones",
+            "message": str(e)
+        })
+
+def leer_cotizacion(cursor, cotizacion_id: int):
+    """Cotización con paciente, usuario, items, servicios y `validez_dias` (None si no existe)"""
+    cursor.execute("""
+        SELECT 
+            c.*,
+            c.notas as observaciones,
+            ec.nombre as estado_nombre,
+            p.nombre as paciente_nombre,
+            p.apellido as paciente_apellido,
+            p.numero_documento as paciente_documento,
+            p.telefono as paciente_telefono,
+            p.email as paciente_email,
+            u.nombre as usuario_nombre
+        FROM cotizacion c
+        JOIN estado_cotizacion ec ON c.estado_id = ec.id
+        JOIN paciente p ON c.paciente_id = p.id
+        JOIN usuario u ON c.usuario_id = u.id
+        WHERE c.id = %s
+    """, (cotizacion_id,))
+    cotizacion = cursor.fetchone()
+    
+    if not cotizacion:
+        return None
+    
+    cargar_detalles_cotizaciones(cursor, [cotizacion])
+    
+    if cotizacion['fecha_vencimiento'] and cotizacion['fecha_emision']:
+        try:
+            fecha_creacion = datetime.strptime(str(cotizacion['fecha_emision']), '%Y-%m-%d %H:%M:%S')
+            fecha_vencimiento = datetime.strptime(str(cotizacion['fecha_vencimiento']), '%Y-%m-%d')
+            validez_dias = (fecha_vencimiento - fecha_creacion.date()).days
+            cotizacion['validez_dias'] = validez_dias if validez_dias > 0 else 7
+        except:
+            cotizacion['validez_dias'] = 7
+    else:
+        cotizacion['validez_dias'] = 7
+    
+    return cotizacion
+
+def _leer_cotizacion_pdf(cotizacion_id: int):
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            return leer_cotizacion(cursor, cotizacion_id)
+
+@router.get("/{cotizacion_id}/pdf")
+async def get_cotizacion_pdf(cotizacion_id: int, request: Request, descargar: bool = False):
+    """
+    PDF de la cotización generado en el servidor. Se cachea en disco por
+    cotización y contenido: las reimpresiones sin cambios no vuelven a
+    dibujarse, y con `If-None-Match` responden 304.
+    """
+    try:
+        cotizacion = await en_hilo(_leer_cotizacion_pdf, cotizacion_id)
+        if not cotizacion:
+            raise HTTPException(status_code=404, detail="Cotización no encontrada")
+        
+        contenido, huella = await pdf_cotizaciones.obtener(datos_pdf(cotizacion))
+        etag = f'"{huella[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        
+        nombre = f"cotizacion-{cotizacion['paciente_documento']}-CZ{cotizacion_id}.pdf"
+        headers["Content-Disposition"] = f'{"attachment" if descargar else "inline"}; filename="{nombre}"'
+        return Response(content=contenido, media_type="application/pdf", headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail={
+            "error": "Error generando PDF de la cotización",
+            "message": str(e)
+        })
+
 @router.get("/{cotizacion_id}", response_model=dict)
 def get_cotizacion(cotizacion_id: int):
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        c.*,
-                        c.notas as observaciones,
-                        ec.nombre as estado_nombre,
-                        p.nombre as paciente_nombre,
-                        p.apellido as paciente_apellido,
-                        p.numero_documento as paciente_documento,
-                        p.telefono as paciente_telefono,
-                        p.email as paciente_email,
-                        u.nombre as usuario_nombre
-                    FROM cotizacion c
-                    JOIN estado_cotizacion ec ON c.estado_id = ec.id
-                    JOIN paciente p ON c.paciente_id = p.id
-                    JOIN usuario u ON c.usuario_id = u.id
-                    WHERE c.id = %s
-                """, (cotizacion_id,))
-                cotizacion = cursor.fetchone()
+                cotizacion = leer_cotizacion(cursor, cotizacion_id)
                 
                 if not cotizacion:
                     raise HTTPException(status_code=404, detail="Cotización no encontrada")
                 
-                cursor.execute("""
-                    SELECT 
-                        id,
-                        tipo,
-                        item_id,
-                        descripcion as nombre,
-                        cantidad,
-                        precio_unitario,
-                        subtotal
-                    FROM cotizacion_item
-                    WHERE cotizacion_id = %s
-                    ORDER BY tipo, descripcion
-                """, (cotizacion_id,))
-                items = cursor.fetchall()
-                
-                cursor.execute("""
-                    SELECT 
-                        servicio_nombre,
-                        requiere
-                    FROM cotizacion_servicio_incluido
-                    WHERE cotizacion_id = %s
-                """, (cotizacion_id,))
-                servicios_incluidos = cursor.fetchall()
-                
-                if not servicios_incluidos:
-                    servicios_incluidos = [
-                        {"servicio_nombre": "CIRUJANO PLASTICO, AYUDANTE Y PERSONAL CLINICO", "requiere": False},
-                        {"servicio_nombre": "ANESTESIOLOGO", "requiere": False},
-                        {"servicio_nombre": "CONTROLES CON MEDICO Y ENFERMERA", "requiere": False},
-                        {"servicio_nombre": "VALORACION CON ANESTESIOLOGO", "requiere": False},
-                        {"servicio_nombre": "HEMOGRAMA DE CONTROL", "requiere": False},
-                        {"servicio_nombre": "UNA NOCHE DE HOSPITALIZACION CON UN ACOMPAÑANTES", "requiere": False},
-                        {"servicio_nombre": "IMPLANTES", "requiere": False},
-                    ]
-                
-                subtotal_procedimientos = 0
-                subtotal_adicionales = 0
-                subtotal_otros_adicionales = 0
-                
-                for item in items:
-                    if item['tipo'] == 'procedimiento':
-                        subtotal_procedimientos += float(item['subtotal'])
-                    elif item['tipo'] == 'adicional':
-                        subtotal_adicionales += float(item['subtotal'])
-                    elif item['tipo'] == 'otro_adicional':
-                        subtotal_otros_adicionales += float(item['subtotal'])
-                
-                cotizacion['items'] = items
-                cotizacion['servicios_incluidos'] = servicios_incluidos
-                cotizacion['subtotal_procedimientos'] = subtotal_procedimientos
-                cotizacion['subtotal_adicionales'] = subtotal_adicionales
-                cotizacion['subtotal_otros_adicionales'] = subtotal_otros_adicionales
-                
-                if cotizacion['fecha_vencimiento'] and cotizacion['fecha_emision']:
-                    try:
-                        fecha_creacion = datetime.strptime(str(cotizacion['fecha_emision']), '%Y-%m-%d %H:%M:%S')
-                        fecha_vencimiento = datetime.strptime(str(cotizacion['fecha_vencimiento']), '%Y-%m-%d')
-                        validez_dias = (fecha_vencimiento - fecha_creacion.date()).days
-                        cotizacion['validez_dias'] = validez_dias if validez_dias > 0 else 7
-                    except:
-                        cotizacion['validez_dias'] = 7
-                else:
-                    cotizacion['validez_dias'] = 7
-                
                 return cotizacion
     except HTTPException:
         raise
@@ -452,6 +576,8 @@ def update_cotizacion(cotizacion_id: int, cotizacion: CotizacionUpdate):
                     except Exception as table_error:
                         print(f"⚠️ Tabla de servicios no disponible: {table_error}")
                 
+                pdf_cotizaciones.invalidar(cotizacion_id)
+                
                 return {
                     "success": True,
                     "message": "Cotización actualizada exitosamente",
@@ -483,6 +609,7 @@ def delete_cotizacion(cotizacion_id: int):
                 cursor.execute("DELETE FROM cotizacion WHERE id = %s", (cotizacion_id,))
                 
                 conn.commit()
+                pdf_cotizaciones.invalidar(cotizacion_id)
                 
                 return {
                     "success": True,
@@ -502,13 +629,5 @@ def delete_cotizacion(cotizacion_id: int):
 
 @router.get("/plantilla-servicios", response_model=dict)
 def get_plantilla_servicios():
-    servicios_base = [
-        {"servicio_nombre": "CIRUJANO PLASTICO, AYUDANTE Y PERSONAL CLINICO", "requiere": False},
-        {"servicio_nombre": "ANESTESIOLOGO", "requiere": False},
-        {"servicio_nombre": "CONTROLES CON MEDICO Y ENFERMERA", "requiere": False},
-        {"servicio_nombre": "VALORACION CON ANESTESIOLOGO", "requiere": False},
-        {"servicio_nombre": "HEMOGRAMA DE CONTROL", "requiere": False},
-        {"servicio_nombre": "UNA NOCHE DE HOSPITALIZACION CON UN ACOMPAÑANTES", "requiere": False},
-        {"servicio_nombre": "IMPLANTES", "requiere": False},
-    ]
+    servicios_base = [dict(s) for s in SERVICIOS_INCLUIDOS_BASE]
     return {"servicios": servicios_base}
\ No newline at end of file
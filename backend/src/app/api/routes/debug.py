@@ -4,8 +4,10 @@ import os
 
 from app.core.database import get_connection
 from app.core.config import settings
+from app.core.respuestas import RutaJSON
+from app.utils.helpers import rango_dia
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 @router.get("/upload-dir", response_model=dict)
 def debug_upload_dir():
@@ -42,10 +44,11 @@ def debug_sala_espera():
                 cursor.execute("SHOW TABLES LIKE '%sala%'")
                 tablas_sala = cursor.fetchall()
                 
+                inicio_dia, fin_dia = rango_dia()
                 cursor.execute("""
                     SELECT COUNT(*) as total FROM sala_espera 
-                    WHERE DATE(fecha_hora_ingreso) = %s
-                """, (hoy,))
+                    WHERE fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s
+                """, (inicio_dia, fin_dia))
                 registros_hoy = cursor.fetchone()
                 
                 cursor.execute("""
@@ -1,59 +1,60 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.core.cache import catalog_cache, catalog_response
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
-@router.get("/citas")
-def get_estados_citas():
-    """
-    Obtiene todos los estados de citas
-    """
-    try:
+def _cargar_estados(tabla: str, orden: str):
+    """Loader para el cache de catálogos: `tabla` y `orden` son constantes internas"""
+    def cargar():
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM estado_cita 
-                    ORDER BY id
+                cursor.execute(f"""
+                    SELECT * FROM {tabla} 
+                    ORDER BY {orden}
                 """)
                 estados = cursor.fetchall()
                 return {"estados": estados}
+    return cargar
+
+@router.get("/citas")
+def get_estados_citas(request: Request, response: Response):
+    """
+    Obtiene todos los estados de citas
+    """
+    try:
+        entry = catalog_cache.get_or_load(
+            "estados_citas", _cargar_estados("estado_cita", "id")
+        )
+        return catalog_response(request, response, entry)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/quirurgicos")
-def get_estados_quirurgicos():
+def get_estados_quirurgicos(request: Request, response: Response):
     """
     Obtiene todos los estados quirúrgicos
     """
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM estado_Quirurgico 
-                    ORDER BY id
-                """)
-                estados = cursor.fetchall()
-                return {"estados": estados}
+        entry = catalog_cache.get_or_load(
+            "estados_quirurgicos", _cargar_estados("estado_Quirurgico", "id")
+        )
+        return catalog_response(request, response, entry)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/cotizaciones")
-def get_estados_cotizaciones():
+def get_estados_cotizaciones(request: Request, response: Response):
     """
     Obtiene todos los estados de cotizaciones
     """
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM estado_cotizacion 
-                    ORDER BY orden
-                """)
-                estados = cursor.fetchall()
-                return {"estados": estados}
+        entry = catalog_cache.get_or_load(
+            "estados_cotizaciones", _cargar_estados("estado_cotizacion", "orden")
+        )
+        return catalog_response(request, response, entry)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1,17 +1,28 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
 import pymysql
 import os
 from datetime import datetime
+from typing import Optional
 import cloudinary
 import cloudinary.uploader
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.archivos import (
+    ArchivoDemasiadoGrande, en_hilo, ingerir_upload, subir_a_storage
+)
+from app.services.media_store import media_store
+from app.services.miniaturas import eliminar_derivados, programar_derivados, urls_derivados
+from app.utils.fieldsets import columnas_tabla, proyeccion, resolver_campos
+from app.utils.pagination import (
+    decode_cursor, keyset_condition, paginate_keyset, approximate_count
+)
 from app.models.schemas.historial_clinico import (
     HistorialClinicoCreate, HistorialClinicoUpdate, 
     HistorialClinicoInDB, FileUploadResponse
 )
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 # Configurar Cloudinary
 cloudinary.config(
@@ -34,20 +45,71 @@ HISTORIAS_DIR = os.path.join(UPLOAD_DIR, "historias")
 if not USE_CLOUDINARY:
     os.makedirs(HISTORIAS_DIR, exist_ok=True)
 
+# Campos para `fields=` en el listado
+CAMPOS_HISTORIA_PRESETS = {
+    "compacto": ("id", "paciente_id", "fecha_creacion", "motivo_consulta", "diagnostico"),
+}
+
 @router.get("/", response_model=dict)
-def get_historias_clinicas(limit: int = 100, offset: int = 0):
+def get_historias_clinicas(
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de resultados"),
+    offset: int = Query(0, ge=0, description="Desplazamiento para paginación"),
+    paginacion: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' o 'cursor' (paginación por llave)"),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Valor de next_cursor de la página anterior"),
+    incluir_total: bool = Query(False, description="En modo cursor, calcular el total exacto"),
+    fields: Optional[str] = Query(None, description="Campos separados por coma, o 'compacto' para listados. Vacío = todos")
+):
     """Obtener todas las historias clínicas con paginación"""
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM historial_clinico 
+                try:
+                    campos = resolver_campos(
+                        fields,
+                        columnas_tabla(cursor, "historial_clinico"),
+                        CAMPOS_HISTORIA_PRESETS,
+                        obligatorios=("id", "fecha_creacion")
+                    )
+                except ValueError as ve:
+                    raise HTTPException(status_code=400, detail=str(ve))
+                select = f"SELECT {proyeccion(campos)} FROM historial_clinico"
+                
+                if paginacion == "cursor" or cursor_token:
+                    query = select
+                    params = []
+                    if cursor_token:
+                        try:
+                            valores = decode_cursor(cursor_token, 2)
+                        except ValueError as ve:
+                            raise HTTPException(status_code=400, detail=str(ve))
+                        condicion, params = keyset_condition(["fecha_creacion", "id"], valores)
+                        query += f" WHERE {condicion}"
+                    query += " ORDER BY fecha_creacion DESC, id DESC LIMIT %s"
+                    params.append(limit + 1)
+                    
+                    cursor.execute(query, params)
+                    historias, next_cursor = paginate_keyset(
+                        cursor.fetchall(), ["fecha_creacion", "id"], limit
+                    )
+                    
+                    respuesta = {"historias": historias, "limit": limit, "next_cursor": next_cursor}
+                    if incluir_total:
+                        cursor.execute("SELECT COUNT(*) as total FROM historial_clinico")
+                        respuesta["total"] = cursor.fetchone()['total']
+                    else:
+                        respuesta["total_aproximado"] = approximate_count(cursor, "historial_clinico")
+                    return respuesta
+                
+                cursor.execute(f"""
+                    {select}
                     ORDER BY fecha_creacion DESC 
                     LIMIT %s OFFSET %s
                 """, (limit, offset))
                 historias = cursor.fetchall()
                 return {"historias": historias}
+    except HTTPException:
+        raise
     except Exception as e:
         if "Table 'u997398721_consultorio_db.historial_clinico' doesn't exist" in str(e):
             return {"historias": []}
@@ -220,41 +282,16 @@ def delete_historia_clinica(historia_id: int):
                 if not historia:
                     raise HTTPException(status_code=404, detail="Historia clínica no encontrada")
                 
-                # Eliminar archivos
-                if historia['fotos']:
-                    fotos = historia['fotos'].split(',')
-                    for foto_url in fotos:
-                        foto_url = foto_url.strip()
-                        
-                        if USE_CLOUDINARY and 'cloudinary.com' in foto_url:
-                            # Eliminar de Cloudinary
-                            try:
-                                # Extraer public_id de la URL
-                                parts = foto_url.split('/')
-                                if 'historias' in parts:
-                                    idx = parts.index('historias')
-                                    if idx + 1 < len(parts):
-                                        filename = parts[idx + 1].split('.')[0]
-                                        public_id = f"historias/{filename}"
-                                        cloudinary.uploader.destroy(public_id)
-                                        print(f"🗑️ Eliminado de Cloudinary: {public_id}")
-                            except Exception as e:
-                                print(f"⚠️ Error eliminando de Cloudinary: {e}")
-                        
-                        elif foto_url.startswith('/uploads/'):
-                            # Eliminar archivo local
-                            file_path = foto_url[1:]  # Remover '/' inicial
-                            if os.path.exists(file_path):
-                                try:
-                                    os.remove(file_path)
-                                    print(f"🗑️ Eliminado archivo local: {file_path}")
-                                except Exception as e:
-                                    print(f"⚠️ Error eliminando archivo local: {e}")
+                # Quitar referencias: sólo se borran las fotos que nadie más usa
+                fotos = [f.strip() for f in (historia['fotos'] or '').split(',') if f.strip()]
+                fotos_a_eliminar = media_store.liberar(cursor, fotos)
                 
                 # Eliminar registro de la base de datos
                 cursor.execute("DELETE FROM historial_clinico WHERE id = %s", (historia_id,))
                 conn.commit()
                 
+                media_store.eliminar_blobs(fotos_a_eliminar, "historias")
+                
                 return {
                     "success": True,
                     "message": "Historia clínica eliminada exitosamente",
@@ -278,13 +315,9 @@ async def upload_historia_foto(
     Usa Cloudinary si está configurado, sino almacenamiento local.
     """
     try:
-        # Verificar que la historia existe
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id FROM historial_clinico WHERE id = %s", (historia_id,))
-            if not cursor.fetchone():
-                raise HTTPException(status_code=404, detail="Historia clínica no encontrada")
-        conn.close()
+        # Verificar que la historia existe (pymysql es bloqueante: va al pool de hilos)
+        if not await en_hilo(_existe_historia, historia_id):
+            raise HTTPException(status_code=404, detail="Historia clínica no encontrada")
         
         # Validar tipo de archivo
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
@@ -295,74 +328,36 @@ async def upload_historia_foto(
                 detail="Tipo de archivo no permitido. Use JPG, PNG, GIF, BMP o WebP."
             )
         
-        # Validar tamaño
         max_size = 10 * 1024 * 1024  # 10MB
-        content = await file.read()
-        if len(content) > max_size:
+        original_name = os.path.splitext(file.filename or "")[0]
+        try:
+            if original_name.startswith("esquema_"):
+                # Los esquemas conservan su nombre original y se reemplazan en el
+                # mismo lugar, así que no pasan por el almacén por contenido
+                file_url = await _guardar_esquema(file, original_name, file_ext, max_size)
+                filename = f"{original_name}{file_ext}"
+            else:
+                # La referencia se cuenta aquí, aunque la URL recién queda en
+                # `fotos` con el PUT posterior (ver media_store)
+                blob = await media_store.almacenar(
+                    file, "historias", file_ext, max_size, resource_type="image"
+                )
+                file_url = blob.url
+                filename = blob.filename
+        except ArchivoDemasiadoGrande:
             raise HTTPException(
                 status_code=400, 
                 detail="El archivo es demasiado grande. Máximo 10MB."
             )
         
-        # Generar nombre: si es esquema, usar nombre original exacto; si no, agregar timestamp
-        original_name = os.path.splitext(file.filename or "")[0]
-        if original_name.startswith("esquema_"):
-            filename = original_name
-        else:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-            filename = f"historia_{historia_id}_{timestamp}"
-        
-        if USE_CLOUDINARY:
-            # ========== CLOUDINARY ==========
-            print(f"☁️ Subiendo a Cloudinary: {filename}")
-            
-            import tempfile
-            # Crear archivo temporal
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-                tmp_file.write(content)
-                tmp_path = tmp_file.name
-            
-            try:
-                # Subir a Cloudinary
-                upload_result = cloudinary.uploader.upload(
-                    tmp_path,
-                    folder="historias",
-                    public_id=filename,
-                    resource_type="image"
-                )
-                
-                file_url = upload_result['secure_url']
-                print(f"✅ Subido a Cloudinary: {file_url}")
-                
-            finally:
-                # Limpiar archivo temporal
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-        
-        else:
-            # ========== ALMACENAMIENTO LOCAL ==========
-            print(f"💾 Guardando localmente: {filename}{file_ext}")
-            file_path = os.path.join(HISTORIAS_DIR, f"{filename}{file_ext}")
-            
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
-            
-            if not os.path.exists(file_path):
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Error al guardar el archivo en el servidor"
-                )
-            
-            file_url = f"/uploads/historias/{filename}{file_ext}"
-            print(f"✅ Guardado localmente: {file_path}")
-        
         print(f"🔗 URL final: {file_url}")
         
         return FileUploadResponse(
             success=True,
             message="Foto subida exitosamente",
             url=file_url,
-            filename=f"{filename}{file_ext}"
+            filename=filename,
+            miniaturas=urls_derivados(file_url)
         )
         
     except HTTPException:
@@ -370,4 +365,33 @@ async def upload_historia_foto(
     except Exception as e:
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error subiendo archivo: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error subiendo archivo: {str(e)}")
+
+def _existe_historia(historia_id: int) -> bool:
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM historial_clinico WHERE id = %s", (historia_id,))
+            return cursor.fetchone() is not None
+
+async def _guardar_esquema(file: UploadFile, filename: str, file_ext: str, max_size: int) -> str:
+    if USE_CLOUDINARY:
+        print(f"☁️ Subiendo a Cloudinary: {filename}")
+        await ingerir_upload(file, max_size)
+        upload_result = await subir_a_storage(
+            cloudinary.uploader.upload,
+            file.file,
+            folder="historias",
+            public_id=filename,
+            filename=f"{filename}{file_ext}",
+            resource_type="image"
+        )
+        return upload_result['secure_url']
+    
+    file_path = os.path.join(HISTORIAS_DIR, f"{filename}{file_ext}")
+    await ingerir_upload(file, max_size, file_path)
+    # El esquema se sobrescribe en el mismo nombre: regenerar sus derivados
+    await en_hilo(eliminar_derivados, file_path)
+    programar_derivados(file_path)
+    print(f"✅ Guardado localmente: {file_path}")
+    return f"/uploads/historias/{filename}{file_ext}"
@@ -1,34 +1,42 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 import pymysql
 import os
 from datetime import datetime
 
+from app.core.cache import catalog_cache, catalog_response
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
 from app.models.schemas.otro_adicional import OtroAdicionalCreate, OtroAdicionalUpdate
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+CACHE_KEY = "otros_adicionales"
+
+def _cargar_otros_adicionales():
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT 
+                    oa.id,
+                    oa.codigo,
+                    oa.nombre,
+                    oa.descripcion,
+                    oa.activo,
+                    t.precio_base as precio
+                FROM otro_adicional oa
+                LEFT JOIN tarifa t ON oa.tarifa_id = t.id
+                WHERE oa.activo = 1
+                ORDER BY oa.nombre
+            """)
+            otros_adicionales = cursor.fetchall()
+            return {"otros_adicionales": otros_adicionales}
 
 @router.get("/", response_model=dict)
-def get_otros_adicionales():
+def get_otros_adicionales(request: Request, response: Response):
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        oa.id,
-                        oa.codigo,
-                        oa.nombre,
-                        oa.descripcion,
-                        oa.activo,
-                        t.precio_base as precio
-                    FROM otro_adicional oa
-                    LEFT JOIN tarifa t ON oa.tarifa_id = t.id
-                    WHERE oa.activo = 1
-                    ORDER BY oa.nombre
-                """)
-                otros_adicionales = cursor.fetchall()
-                return {"otros_adicionales": otros_adicionales}
+        entry = catalog_cache.get_or_load(CACHE_KEY, _cargar_otros_adicionales)
+        return catalog_response(request, response, entry)
     except Exception as e:
         error_msg = str(e)
         if "otro_adicional" in error_msg.lower():
@@ -94,6 +102,7 @@ def create_otro_adicional(otro_adicional: OtroAdicionalCreate):
                 ))
                 otro_adicional_id = cursor.lastrowid
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -151,6 +160,7 @@ def update_otro_adicional(otro_adicional_id: int, otro_adicional: OtroAdicionalU
                     cursor.execute(query, values)
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -179,6 +189,7 @@ def delete_otro_adicional(otro_adicional_id: int):
                     cursor.execute("DELETE FROM tarifa WHERE id = %s", (otro_adicional_info['tarifa_id'],))
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
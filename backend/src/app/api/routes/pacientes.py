@@ -1,28 +1,73 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, UploadFile, File
 import pymysql
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.busqueda_pacientes import indice_pacientes
+from app.services.calendario_agenda import calendario_cache
+from app.services.contadores import contadores_dashboard
+from app.services.exportacion import filtro_fechas, respuesta_exportacion
+from app.services.importacion_pacientes import (
+    ArchivoInvalido, detectar_formato, importar_pacientes as importar_archivo_pacientes
+)
+from app.utils.pagination import (
+    decode_cursor, keyset_condition, paginate_keyset, approximate_count
+)
 from app.models.schemas.paciente import (
     PacienteCreate, PacienteUpdate, PacienteInDB, 
     PacienteBusqueda, MessageResponse
 )
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 @router.get("/", response_model=dict)
 def get_pacientes(
-    limit: int = Query(100, description="Número máximo de resultados"),
-    offset: int = Query(0, description="Desplazamiento para paginación")
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de resultados"),
+    offset: int = Query(0, ge=0, description="Desplazamiento para paginación"),
+    paginacion: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' o 'cursor' (paginación por llave)"),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Valor de next_cursor de la página anterior"),
+    incluir_total: bool = Query(False, description="En modo cursor, calcular el total exacto")
 ):
     """
     Obtiene lista de pacientes con paginación
+    
+    En modo cursor la página se busca con `WHERE id < cursor` sobre la llave
+    primaria, así que cualquier página cuesta lo mismo que la primera.
     """
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
+                if paginacion == "cursor" or cursor_token:
+                    query = "SELECT * FROM paciente"
+                    params = []
+                    if cursor_token:
+                        try:
+                            valores = decode_cursor(cursor_token, 1)
+                        except ValueError as ve:
+                            raise HTTPException(status_code=400, detail=str(ve))
+                        condicion, params = keyset_condition(["id"], valores)
+                        query += f" WHERE {condicion}"
+                    query += " ORDER BY id DESC LIMIT %s"
+                    params.append(limit + 1)
+                    
+                    cursor.execute(query, params)
+                    pacientes, next_cursor = paginate_keyset(cursor.fetchall(), ["id"], limit)
+                    
+                    respuesta = {
+                        "limit": limit,
+                        "next_cursor": next_cursor,
+                        "pacientes": pacientes
+                    }
+                    if incluir_total:
+                        cursor.execute("SELECT COUNT(*) as total FROM paciente")
+                        respuesta["total"] = cursor.fetchone()['total']
+                    else:
+                        respuesta["total_aproximado"] = approximate_count(cursor, "paciente")
+                    return respuesta
+                
                 # Obtener total
                 cursor.execute("SELECT COUNT(*) as total FROM paciente")
                 total = cursor.fetchone()['total']
@@ -41,9 +86,154 @@ def get_pacientes(
                     "offset": offset,
                     "pacientes": pacientes
                 }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/todos", response_model=dict)
+def get_todos_pacientes():
+    """
+    Obtiene todos los pacientes para selección en formularios
+    """
+    try:
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT 
+                        id,
+                        nombre,
+                        apellido,
+                        CONCAT(nombre, ' ', apellido) as nombre_completo,
+                        numero_documento,
+                        tipo_documento,
+                        fecha_nacimiento,
+                        genero,
+                        telefono,
+                        email,
+                        direccion,
+                        ciudad,
+                        TIMESTAMPDIFF(YEAR, fecha_nacimiento, CURDATE()) as edad,
+                        fecha_registro
+                    FROM paciente
+                    ORDER BY apellido, nombre
+                """)
+                pacientes = cursor.fetchall()
+                
+                return {
+                    "success": True,
+                    "total": len(pacientes),
+                    "pacientes": pacientes
+                }
+                
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "error": "Error obteniendo pacientes",
+            "message": str(e)
+        })
+
+@router.get("/buscar", response_model=dict)
+def buscar_pacientes(
+    q: str = Query("", description="Texto para buscar por nombre, apellido o documento"),
+    limit: int = Query(10, description="Límite de resultados")
+):
+    """
+    Busca pacientes para autocompletar en formularios
+    
+    Usa el índice en memoria (prefijos sin tildes de nombre/apellido y de
+    documento); sólo consulta MySQL si el índice no se pudo construir.
+    """
+    try:
+        if not indice_pacientes.listo:
+            try:
+                indice_pacientes.construir()
+            except Exception as e:
+                print(f"⚠️ Índice de pacientes no disponible, usando SQL: {e}")
+        
+        if indice_pacientes.listo:
+            pacientes = indice_pacientes.buscar(q, limit)
+            return {
+                "pacientes": pacientes,
+                "total": len(pacientes)
+            }
+        
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                query = """
+                    SELECT 
+                        id,
+                        CONCAT(nombre, ' ', apellido) as nombre_completo,
+                        numero_documento as documento,
+                        telefono,
+                        email,
+                        fecha_nacimiento,
+                        TIMESTAMPDIFF(YEAR, fecha_nacimiento, CURDATE()) as edad
+                    FROM paciente
+                    WHERE 
+                        nombre LIKE %s OR 
+                        apellido LIKE %s OR 
+                        numero_documento LIKE %s
+                    ORDER BY nombre, apellido
+                    LIMIT %s
+                """
+                search_term = f"%{q}%"
+                
+                cursor.execute(query, (search_term, search_term, search_term, limit))
+                pacientes = cursor.fetchall()
+                
+                return {
+                    "pacientes": pacientes,
+                    "total": len(pacientes)
+                }
+                
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "error": "Error buscando pacientes",
+            "message": str(e)
+        })
+
+@router.get("/exportar")
+def exportar_pacientes(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' o 'csv'"),
+    fecha_desde: Optional[date] = Query(None, description="Registrados desde esta fecha (inclusive)"),
+    fecha_hasta: Optional[date] = Query(None, description="Registrados hasta esta fecha (inclusive)")
+):
+    """
+    Exporta pacientes en streaming (NDJSON o CSV), leyendo por lotes con un
+    cursor sin buffer: la memoria no crece con el tamaño de la tabla.
+    """
+    try:
+        filtro, params = filtro_fechas("fecha_registro", fecha_desde, fecha_hasta)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    try:
+        return respuesta_exportacion(f"""
+            SELECT 
+                id,
+                nombre,
+                apellido,
+                numero_documento,
+                tipo_documento,
+                fecha_nacimiento,
+                genero,
+                telefono,
+                email,
+                direccion,
+                ciudad,
+                fecha_registro
+            FROM paciente
+            {filtro}
+            ORDER BY id
+        """, params, formato, "pacientes")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "error": "Error exportando pacientes",
+            "message": str(e)
+        })
+
 @router.get("/{paciente_id}", response_model=dict)
 def get_paciente(paciente_id: int):
     """
@@ -110,6 +300,9 @@ def create_paciente(paciente: PacienteCreate):
                 paciente_id = cursor.lastrowid
                 conn.commit()
                 
+                indice_pacientes.upsert({"id": paciente_id, **paciente.dict()})
+                contadores_dashboard.paciente_creado()
+                
                 return {
                     "success": True,
                     "message": "Paciente creado exitosamente",
@@ -127,6 +320,48 @@ def create_paciente(paciente: PacienteCreate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/importar", response_model=dict)
+def importar_pacientes(
+    archivo: UploadFile = File(..., description="CSV con encabezado o NDJSON (un paciente por línea)"),
+    formato: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="Si se omite, se deduce de la extensión"),
+    validar_solo: bool = Query(False, description="Sólo valida y reporta, sin insertar")
+):
+    """
+    Importa pacientes en lote desde un archivo CSV o NDJSON.
+    
+    Las filas se validan con las mismas reglas que al crear un paciente y se
+    insertan por lotes; las que tienen errores o un documento ya registrado
+    (o repetido en el archivo) se omiten y se informan con su número de fila.
+    """
+    formato = formato or detectar_formato(archivo.filename, archivo.content_type)
+    if formato is None:
+        raise HTTPException(
+            status_code=400,
+            detail="No se pudo determinar el formato; use archivos .csv o .ndjson, o indique 'formato'"
+        )
+    
+    try:
+        conn = get_connection()
+        with conn:
+            reporte = importar_archivo_pacientes(conn, archivo.file, formato, validar_solo)
+        
+        if validar_solo:
+            message = f"{reporte['validos']} de {reporte['total_filas']} filas son válidas"
+        else:
+            message = f"{reporte['insertados']} de {reporte['total_filas']} pacientes importados"
+        return {
+            "success": reporte["interrumpido"] is None,
+            "message": message,
+            **reporte
+        }
+    except ArchivoInvalido as ai:
+        raise HTTPException(status_code=400, detail=str(ai))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "error": "Error importando pacientes",
+            "message": str(e)
+        })
+
 @router.put("/{paciente_id}", response_model=dict)
 def update_paciente(paciente_id: int, paciente: PacienteUpdate):
     """
@@ -190,6 +425,10 @@ def update_paciente(paciente_id: int, paciente: PacienteUpdate):
                 cursor.execute(query, values)
                 conn.commit()
                 
+                indice_pacientes.actualizar(paciente_id, field_mapping)
+                if any(field_mapping.get(campo) is not None for campo in ("nombre", "apellido", "numero_documento")):
+                    calendario_cache.vencer()
+                
                 return {
                     "success": True,
                     "message": "Paciente actualizado exitosamente",
@@ -251,6 +490,9 @@ def delete_paciente(paciente_id: int):
                 cursor.execute("DELETE FROM paciente WHERE id = %s", (paciente_id,))
                 conn.commit()
                 
+                indice_pacientes.eliminar(paciente_id)
+                contadores_dashboard.paciente_eliminado(paciente_id)
+                
                 return {
                     "success": True,
                     "message": "Paciente y registros relacionados eliminados exitosamente",
@@ -264,90 +506,3 @@ def delete_paciente(paciente_id: int):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/todos", response_model=dict)
-def get_todos_pacientes():
-    """
-    Obtiene todos los pacientes para selección en formularios
-    """
-    try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        id,
-                        nombre,
-                        apellido,
-                        CONCAT(nombre, ' ', apellido) as nombre_completo,
-                        numero_documento,
-                        tipo_documento,
-                        fecha_nacimiento,
-                        genero,
-                        telefono,
-                        email,
-                        direccion,
-                        ciudad,
-                        TIMESTAMPDIFF(YEAR, fecha_nacimiento, CURDATE()) as edad,
-                        fecha_registro
-                    FROM paciente
-                    ORDER BY apellido, nombre
-                """)
-                pacientes = cursor.fetchall()
-                
-                return {
-                    "success": True,
-                    "total": len(pacientes),
-                    "pacientes": pacientes
-                }
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail={
-            "error": "Error obteniendo pacientes",
-            "message": str(e)
-        })
-
-@router.get("/buscar", response_model=dict)
-def buscar_pacientes(
-    q: str = Query("", description="Texto para buscar por nombre, apellido o documento"),
-    limit: int = Query(10, description="Límite de resultados")
-):
-    """
-    Busca pacientes para autocompletar en formularios
-    """
-    try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                query = """
-                    SELECT 
-                        id,
-                        CONCAT(nombre, ' ', apellido) as nombre_completo,
-                        numero_documento as documento,
-                        telefono,
-                        email,
-                        fecha_nacimiento,
-                        TIMESTAMPDIFF(YEAR, fecha_nacimiento, CURDATE()) as edad
-                    FROM paciente
-                    WHERE 
-                        nombre LIKE %s OR 
-                        apellido LIKE %s OR 
-                        numero_documento LIKE %s
-                    ORDER BY nombre, apellido
-                    LIMIT %s
-                """
-                search_term = f"%{q}%"
-                
-                cursor.execute(query, (search_term, search_term, search_term, limit))
-                pacientes = cursor.fetchall()
-                
-                return {
-                    "pacientes": pacientes,
-                    "total": len(pacientes)
-                }
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail={
-            "error": "Error buscando pacientes",
-            "message": str(e)
-        })
\ No newline at end of file
@@ -1,14 +1,23 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
 from fastapi.responses import FileResponse
 import pymysql
 import os
 from datetime import datetime
+from typing import Optional
 import cloudinary
 import cloudinary.uploader
-import json
-import tempfile
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.archivos import ArchivoDemasiadoGrande, en_hilo
+from app.services.media_store import media_store
+from app.services.miniaturas import urls_derivados
+from app.utils import json_codec
+from app.utils.plan_codec import codificar_json, decodificar_archivos, decodificar_plan
+from app.utils.fieldsets import columnas_tabla, proyeccion, resolver_campos
+from app.utils.pagination import (
+    decode_cursor, keyset_condition, paginate_keyset, approximate_count
+)
 from app.models.schemas.plan_quirurgico import (
     PlanQuirurgicoCreate, 
     PlanQuirurgicoUpdate, 
@@ -16,7 +25,7 @@ from app.models.schemas.plan_quirurgico import (
     DescargarArchivoRequest
 )
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 # Configurar Cloudinary
 cloudinary.config(
@@ -39,75 +48,106 @@ PLANES_DIR = os.path.join(UPLOAD_DIR, "planes")
 if not USE_CLOUDINARY:
     os.makedirs(PLANES_DIR, exist_ok=True)
 
-# ==================== FUNCIONES AUXILIARES ====================
-
-def json_to_str(field):
-    """Convertir dict/list a JSON string, o retornar None si es None/vacío"""
-    if field is None:
-        return None
-    if isinstance(field, (dict, list)):
-        if not field:  # Si es dict/list vacío
-            return None
-        return json.dumps(field, ensure_ascii=False)
-    return field
-
-def str_to_json(field):
-    """Convertir JSON string a dict/list, o retornar None si es None/vacío"""
-    if field is None or field == '' or field == 'null':
-        return None
-    if isinstance(field, str):
-        try:
-            parsed = json.loads(field)
-            return parsed if parsed else None
-        except:
-            return None
-    return field
+# Campos para `fields=` en el listado
+CAMPOS_PLAN_CALCULADOS = {
+    "nombre_completo_paciente": "CONCAT(p.nombre, ' ', p.apellido)",
+    "paciente_documento": "p.numero_documento",
+}
+CAMPOS_PLAN_PRESETS = {
+    "compacto": (
+        "id", "paciente_id", "usuario_id", "estado_id", "fecha_creacion",
+        "nombre_completo", "nombre_completo_paciente", "paciente_documento",
+        "identificacion", "procedimiento_desc", "fecha_programada", "hora",
+        "fecha_consulta", "hora_consulta", "duracion_estimada", "tipo_anestesia",
+        "celular", "email", "entidad",
+    ),
+}
 
 # ==================== ENDPOINTS ====================
 
 @router.get("/", response_model=dict)
-def get_planes_quirurgicos(limit: int = 100, offset: int = 0):
+def get_planes_quirurgicos(
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de resultados"),
+    offset: int = Query(0, ge=0, description="Desplazamiento para paginación"),
+    paginacion: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' o 'cursor' (paginación por llave)"),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Valor de next_cursor de la página anterior"),
+    incluir_total: bool = Query(False, description="En modo cursor, calcular el total exacto"),
+    fields: Optional[str] = Query(None, description="Campos separados por coma, o 'compacto' para listados. Vacío = todos")
+):
     """Obtener todos los planes quirúrgicos con paginación"""
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                # Obtener total de planes
-                cursor.execute("SELECT COUNT(*) as total FROM plan_quirurgico")
-                total = cursor.fetchone()['total']
+                usar_cursor = paginacion == "cursor" or bool(cursor_token)
+                try:
+                    campos = resolver_campos(
+                        fields,
+                        columnas_tabla(cursor, "plan_quirurgico"),
+                        CAMPOS_PLAN_PRESETS,
+                        calculados=CAMPOS_PLAN_CALCULADOS,
+                        obligatorios=("id", "fecha_creacion")
+                    )
+                except ValueError as ve:
+                    raise HTTPException(status_code=400, detail=str(ve))
                 
-                # Obtener planes con JOIN a paciente para nombre completo
-                cursor.execute("""
+                # El JOIN a paciente sólo hace falta para los campos calculados
+                con_paciente = campos is None or any(c in CAMPOS_PLAN_CALCULADOS for c in campos)
+                query = f"""
                     SELECT 
-                        pq.*,
-                        CONCAT(p.nombre, ' ', p.apellido) as nombre_completo_paciente,
-                        p.numero_documento as paciente_documento
+                        {proyeccion(campos, "pq", CAMPOS_PLAN_CALCULADOS)}
                     FROM plan_quirurgico pq
-                    LEFT JOIN paciente p ON pq.paciente_id = p.id
-                    ORDER BY pq.fecha_creacion DESC 
-                    LIMIT %s OFFSET %s
-                """, (limit, offset))
-                planes = cursor.fetchall()
+                """
+                if con_paciente:
+                    query += " LEFT JOIN paciente p ON pq.paciente_id = p.id"
                 
-                # Procesar campos JSON
-                for plan in planes:
-                    plan['enfermedad_actual'] = str_to_json(plan.get('enfermedad_actual'))
-                    plan['antecedentes'] = str_to_json(plan.get('antecedentes'))
-                    plan['notas_corporales'] = str_to_json(plan.get('notas_corporales'))
-                    plan['esquema_mejorado'] = str_to_json(plan.get('esquema_mejorado'))
-                    
-                    # Procesar imagen_procedimiento como array
-                    if plan.get('imagen_procedimiento'):
+                if usar_cursor:
+                    params = []
+                    if cursor_token:
                         try:
-                            plan['imagen_procedimiento'] = json.loads(plan['imagen_procedimiento'])
-                        except:
-                            # Si no es JSON, convertir string separado por comas a array
-                            if isinstance(plan['imagen_procedimiento'], str):
-                                plan['imagen_procedimiento'] = [
-                                    img.strip() 
-                                    for img in plan['imagen_procedimiento'].split(',') 
-                                    if img.strip()
-                                ]
+                            valores = decode_cursor(cursor_token, 2)
+                        except ValueError as ve:
+                            raise HTTPException(status_code=400, detail=str(ve))
+                        condicion, params = keyset_condition(["pq.fecha_creacion", "pq.id"], valores)
+                        query += f" WHERE {condicion}"
+                    query += " ORDER BY pq.fecha_creacion DESC, pq.id DESC LIMIT %s"
+                    params.append(limit + 1)
+                    cursor.execute(query, params)
+                    planes, next_cursor = paginate_keyset(
+                        cursor.fetchall(), ["fecha_creacion", "id"], limit
+                    )
+                    
+                    if incluir_total:
+                        cursor.execute("SELECT COUNT(*) as total FROM plan_quirurgico")
+                        total = cursor.fetchone()['total']
+                    else:
+                        total = None
+                else:
+                    # Obtener total de planes
+                    cursor.execute("SELECT COUNT(*) as total FROM plan_quirurgico")
+                    total = cursor.fetchone()['total']
+                    
+                    # Obtener planes con JOIN a paciente para nombre completo
+                    query += " ORDER BY pq.fecha_creacion DESC LIMIT %s OFFSET %s"
+                    cursor.execute(query, (limit, offset))
+                    planes = cursor.fetchall()
+                
+                # Procesar campos JSON e imagen_procedimiento como array
+                for plan in planes:
+                    decodificar_plan(plan)
+                
+                if usar_cursor:
+                    respuesta = {
+                        "success": True,
+                        "limit": limit,
+                        "next_cursor": next_cursor,
+                        "planes": planes
+                    }
+                    if total is not None:
+                        respuesta["total"] = total
+                    else:
+                        respuesta["total_aproximado"] = approximate_count(cursor, "plan_quirurgico")
+                    return respuesta
                 
                 return {
                     "success": True,
@@ -116,6 +156,8 @@ def get_planes_quirurgicos(limit: int = 100, offset: int = 0):
                     "offset": offset,
                     "planes": planes
                 }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error obteniendo planes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -141,23 +183,8 @@ def get_plan_quirurgico(plan_id: int):
                 if not plan:
                     raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
                 
-                # Procesar campos JSON
-                plan['enfermedad_actual'] = str_to_json(plan.get('enfermedad_actual'))
-                plan['antecedentes'] = str_to_json(plan.get('antecedentes'))
-                plan['notas_corporales'] = str_to_json(plan.get('notas_corporales'))
-                plan['esquema_mejorado'] = str_to_json(plan.get('esquema_mejorado'))
-                
-                # Procesar imagen_procedimiento como array
-                if plan.get('imagen_procedimiento'):
-                    try:
-                        plan['imagen_procedimiento'] = json.loads(plan['imagen_procedimiento'])
-                    except:
-                        if isinstance(plan['imagen_procedimiento'], str):
-                            plan['imagen_procedimiento'] = [
-                                img.strip() 
-                                for img in plan['imagen_procedimiento'].split(',') 
-                                if img.strip()
-                            ]
+                # Procesar campos JSON e imagen_procedimiento como array
+                decodificar_plan(plan)
                 
                 return {
                     "success": True,
@@ -182,10 +209,10 @@ def create_plan_quirurgico(plan: PlanQuirurgicoCreate):
                     raise HTTPException(status_code=404, detail="Paciente no encontrado")
                 
                 # Convertir campos JSON a string
-                enfermedad_actual_str = json_to_str(plan.enfermedad_actual)
-                antecedentes_str = json_to_str(plan.antecedentes)
-                notas_corporales_str = json_to_str(plan.notas_corporales)
-                esquema_mejorado_str = json_to_str(plan.esquema_mejorado)
+                enfermedad_actual_str = codificar_json(plan.enfermedad_actual)
+                antecedentes_str = codificar_json(plan.antecedentes)
+                notas_corporales_str = codificar_json(plan.notas_corporales)
+                esquema_mejorado_str = codificar_json(plan.esquema_mejorado)
                 
                 # Preparar valores - IMPORTANTE: orden debe coincidir con columnas
                 valores = (
@@ -316,10 +343,10 @@ def create_plan_quirurgico(plan: PlanQuirurgicoCreate):
                     raise HTTPException(status_code=404, detail="Paciente no encontrado")
                 
                 # Convertir campos JSON a string
-                enfermedad_actual_str = json_to_str(plan.enfermedad_actual)
-                antecedentes_str = json_to_str(plan.antecedentes)
-                notas_corporales_str = json_to_str(plan.notas_corporales)
-                esquema_mejorado_str = json_to_str(plan.esquema_mejorado)
+                enfermedad_actual_str = codificar_json(plan.enfermedad_actual)
+                antecedentes_str = codificar_json(plan.antecedentes)
+                notas_corporales_str = codificar_json(plan.notas_corporales)
+                esquema_mejorado_str = codificar_json(plan.esquema_mejorado)
                 
                 # Insertar plan quirúrgico - CORREGIDO: 55 campos = 55 valores
                 cursor.execute("""
@@ -403,10 +430,10 @@ def create_plan_quirurgico(plan: PlanQuirurgicoCreate):
                     raise HTTPException(status_code=404, detail="Paciente no encontrado")
                 
                 # Convertir campos JSON a string
-                enfermedad_actual_str = json_to_str(plan.enfermedad_actual)
-                antecedentes_str = json_to_str(plan.antecedentes)
-                notas_corporales_str = json_to_str(plan.notas_corporales)
-                esquema_mejorado_str = json_to_str(plan.esquema_mejorado)
+                enfermedad_actual_str = codificar_json(plan.enfermedad_actual)
+                antecedentes_str = codificar_json(plan.antecedentes)
+                notas_corporales_str = codificar_json(plan.notas_corporales)
+                esquema_mejorado_str = codificar_json(plan.esquema_mejorado)
                 
                 # Insertar plan quirúrgico - CORREGIDO
                 cursor.execute("""
@@ -485,10 +512,10 @@ def update_plan_quirurgico(plan_id: int, plan: PlanQuirurgicoUpdate):
                     raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
                 
                 # Convertir campos JSON a string
-                enfermedad_actual_str = json_to_str(plan.enfermedad_actual)
-                antecedentes_str = json_to_str(plan.antecedentes)
-                notas_corporales_str = json_to_str(plan.notas_corporales)
-                esquema_mejorado_str = json_to_str(plan.esquema_mejorado)
+                enfermedad_actual_str = codificar_json(plan.enfermedad_actual)
+                antecedentes_str = codificar_json(plan.antecedentes)
+                notas_corporales_str = codificar_json(plan.notas_corporales)
+                esquema_mejorado_str = codificar_json(plan.esquema_mejorado)
                 
                 # Actualizar plan
                 cursor.execute("""
@@ -554,10 +581,10 @@ def update_plan_quirurgico(plan_id: int, plan: PlanQuirurgicoUpdate):
                     raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
                 
                 # Convertir campos JSON a string
-                enfermedad_actual_str = json_to_str(plan.enfermedad_actual)
-                antecedentes_str = json_to_str(plan.antecedentes)
-                notas_corporales_str = json_to_str(plan.notas_corporales)
-                esquema_mejorado_str = json_to_str(plan.esquema_mejorado)
+                enfermedad_actual_str = codificar_json(plan.enfermedad_actual)
+                antecedentes_str = codificar_json(plan.antecedentes)
+                notas_corporales_str = codificar_json(plan.notas_corporales)
+                esquema_mejorado_str = codificar_json(plan.esquema_mejorado)
                 
                 # Actualizar plan - CORREGIDO
                 cursor.execute("""
@@ -626,44 +653,19 @@ def delete_plan_quirurgico(plan_id: int):
                 if not plan:
                     raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
                 
-                # Eliminar archivos
-                if plan['imagen_procedimiento']:
-                    try:
-                        archivos = json.loads(plan['imagen_procedimiento'])
-                    except:
-                        archivos = [img.strip() for img in plan['imagen_procedimiento'].split(',') if img.strip()]
-                    
-                    for archivo_url in archivos:
-                        archivo_url = archivo_url.strip()
-                        
-                        if USE_CLOUDINARY and 'cloudinary.com' in archivo_url:
-                            # Eliminar de Cloudinary
-                            try:
-                                parts = archivo_url.split('/')
-                                if 'planes' in parts:
-                                    idx = parts.index('planes')
-                                    if idx + 1 < len(parts):
-                                        filename = parts[idx + 1].split('.')[0]
-                                        public_id = f"planes/{filename}"
-                                        cloudinary.uploader.destroy(public_id)
-                                        print(f"🗑️ Eliminado de Cloudinary: {public_id}")
-                            except Exception as e:
-                                print(f"⚠️ Error eliminando de Cloudinary: {e}")
-                        
-                        elif archivo_url.startswith('/uploads/'):
-                            # Eliminar archivo local
-                            file_path = archivo_url[1:]  # Remover '/' inicial
-                            if os.path.exists(file_path):
-                                try:
-                                    os.remove(file_path)
-                                    print(f"🗑️ Eliminado archivo local: {file_path}")
-                                except Exception as e:
-                                    print(f"⚠️ Error eliminando archivo local: {e}")
+                archivos = decodificar_archivos(plan['imagen_procedimiento'])
+                
+                # Quitar referencias: sólo se borran los archivos que nadie más usa
+                archivos_a_eliminar = media_store.liberar(
+                    cursor, [url.strip() for url in archivos if url and url.strip()]
+                )
                 
                 # Eliminar registro de la base de datos
                 cursor.execute("DELETE FROM plan_quirurgico WHERE id = %s", (plan_id,))
                 conn.commit()
                 
+                media_store.eliminar_blobs(archivos_a_eliminar, "planes")
+                
                 return {
                     "success": True,
                     "message": "Plan quirúrgico eliminado exitosamente",
@@ -686,13 +688,9 @@ async def upload_plan_archivo(
     Usa Cloudinary si está configurado, sino almacenamiento local.
     """
     try:
-        # Verificar que el plan existe
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, imagen_procedimiento FROM plan_quirurgico WHERE id = %s", (plan_id,))
-            plan = cursor.fetchone()
-            if not plan:
-                raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
+        # Verificar que el plan existe (pymysql es bloqueante: va al pool de hilos)
+        if not await en_hilo(_existe_plan, plan_id):
+            raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
         
         # Validar tipo de archivo
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.pdf'}
@@ -703,90 +701,39 @@ async def upload_plan_archivo(
                 detail="Tipo de archivo no permitido. Use JPG, PNG, GIF, BMP, WebP o PDF."
             )
         
-        # Validar tamaño (máximo 15MB para PDFs, 10MB para imágenes)
+        # Ingesta por bloques (máximo 15MB para PDFs, 10MB para imágenes) y
+        # almacenamiento por contenido: un archivo idéntico ya subido se reutiliza
         max_size = 15 * 1024 * 1024 if file_ext == '.pdf' else 10 * 1024 * 1024
-        content = await file.read()
-        if len(content) > max_size:
+        try:
+            blob = await media_store.almacenar(
+                file, "planes", file_ext, max_size,
+                resource_type="auto"  # Permite PDFs e imágenes
+            )
+        except ArchivoDemasiadoGrande:
             raise HTTPException(
                 status_code=400, 
                 detail=f"El archivo es demasiado grande. Máximo {max_size // (1024*1024)}MB."
             )
-        
-        # Generar nombre único
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        filename = f"plan_{plan_id}_{timestamp}"
-        
-        if USE_CLOUDINARY:
-            # ========== CLOUDINARY ==========
-            print(f"☁️ Subiendo a Cloudinary: {filename}")
-            
-            # Crear archivo temporal
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-                tmp_file.write(content)
-                tmp_path = tmp_file.name
-            
-            try:
-                # Subir a Cloudinary
-                upload_result = cloudinary.uploader.upload(
-                    tmp_path,
-                    folder="planes",
-                    public_id=filename,
-                    resource_type="auto"  # Permite PDFs e imágenes
-                )
-                
-                file_url = upload_result['secure_url']
-                print(f"✅ Subido a Cloudinary: {file_url}")
-                
-            finally:
-                # Limpiar archivo temporal
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-        
-        else:
-            # ========== ALMACENAMIENTO LOCAL ==========
-            print(f"💾 Guardando localmente: {filename}{file_ext}")
-            file_path = os.path.join(PLANES_DIR, f"{filename}{file_ext}")
-            
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
-            
-            if not os.path.exists(file_path):
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Error al guardar el archivo en el servidor"
-                )
-            
-            file_url = f"/uploads/planes/{filename}{file_ext}"
-            print(f"✅ Guardado localmente: {file_path}")
+        file_url = blob.url
         
         # Actualizar base de datos
-        with conn.cursor() as cursor:
-            # Obtener archivos actuales
-            archivos_actuales = []
-            if plan['imagen_procedimiento']:
-                try:
-                    archivos_actuales = json.loads(plan['imagen_procedimiento'])
-                except:
-                    archivos_actuales = [img.strip() for img in plan['imagen_procedimiento'].split(',') if img.strip()]
-            
-            # Agregar nuevo archivo
-            archivos_actuales.append(file_url)
-            archivos_json = json.dumps(archivos_actuales)
-            
-            cursor.execute(
-                "UPDATE plan_quirurgico SET imagen_procedimiento = %s WHERE id = %s",
-                (archivos_json, plan_id)
-            )
-            conn.commit()
+        if not await en_hilo(_agregar_archivo_plan, plan_id, file_url):
+            # El plan se borró durante la subida: soltar la referencia tomada
+            try:
+                await en_hilo(media_store.descartar, file_url, "planes")
+            except Exception as e:
+                print(f"⚠️ No se pudo liberar {file_url}: {e}")
+            raise HTTPException(status_code=404, detail="Plan quirúrgico no encontrado")
         
-        conn.close()
         print(f"🔗 URL final: {file_url}")
         
         return {
             "success": True,
             "message": "Archivo subido exitosamente",
             "url": file_url,
-            "filename": f"{filename}{file_ext}"
+            "filename": blob.filename,
+            "reutilizado": blob.reutilizado,
+            "miniaturas": urls_derivados(file_url)
         }
         
     except HTTPException:
@@ -796,8 +743,44 @@ async def upload_plan_archivo(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error subiendo archivo: {str(e)}")
 
+def _existe_plan(plan_id: int) -> bool:
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM plan_quirurgico WHERE id = %s", (plan_id,))
+            return cursor.fetchone() is not None
+
+def _agregar_archivo_plan(plan_id: int, file_url: str) -> bool:
+    """
+    Agrega `file_url` a imagen_procedimiento. La lista se lee con FOR UPDATE
+    en la misma transacción para no perder archivos de subidas simultáneas.
+    """
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT imagen_procedimiento FROM plan_quirurgico WHERE id = %s FOR UPDATE",
+                (plan_id,)
+            )
+            plan = cursor.fetchone()
+            if not plan:
+                conn.rollback()
+                return False
+            
+            # Obtener archivos actuales y agregar el nuevo
+            archivos_actuales = decodificar_archivos(plan['imagen_procedimiento'])
+            archivos_actuales.append(file_url)
+            archivos_json = json_codec.dumps(archivos_actuales)
+            
+            cursor.execute(
+                "UPDATE plan_quirurgico SET imagen_procedimiento = %s WHERE id = %s",
+                (archivos_json, plan_id)
+            )
+            conn.commit()
+            return True
+
 @router.post("/{plan_id}/descargar-archivo")
-async def descargar_archivo(plan_id: int, request: DescargarArchivoRequest):
+def descargar_archivo(plan_id: int, request: DescargarArchivoRequest):
     """
     Descargar un archivo específico de un plan quirúrgico.
     Funciona tanto para Cloudinary como almacenamiento local.
@@ -815,12 +798,7 @@ async def descargar_archivo(plan_id: int, request: DescargarArchivoRequest):
         conn.close()
         
         # Obtener lista de archivos
-        archivos = []
-        if plan['imagen_procedimiento']:
-            try:
-                archivos = json.loads(plan['imagen_procedimiento'])
-            except:
-                archivos = [img.strip() for img in plan['imagen_procedimiento'].split(',') if img.strip()]
+        archivos = decodificar_archivos(plan['imagen_procedimiento'])
         
         # Buscar el archivo
         archivo_url = None
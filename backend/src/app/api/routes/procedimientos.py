@@ -1,33 +1,42 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 import pymysql
 import os
 from datetime import datetime
 
+from app.core.cache import catalog_cache, catalog_response
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.calendario_agenda import calendario_cache
 from app.models.schemas.procedimiento import ProcedimientoCreate, ProcedimientoUpdate
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+CACHE_KEY = "procedimientos"
+
+def _cargar_procedimientos():
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT 
+                    p.id,
+                    p.codigo,
+                    p.nombre,
+                    p.descripcion,
+                    p.activo,
+                    t.precio_base as precio
+                FROM procedimiento p
+                LEFT JOIN tarifa t ON p.tarifa_id = t.id
+                ORDER BY p.nombre
+            """)
+            procedimientos = cursor.fetchall()
+            return {"procedimientos": procedimientos}
 
 @router.get("/", response_model=dict)
-def get_procedimientos():
+def get_procedimientos(request: Request, response: Response):
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        p.id,
-                        p.codigo,
-                        p.nombre,
-                        p.descripcion,
-                        p.activo,
-                        t.precio_base as precio
-                    FROM procedimiento p
-                    LEFT JOIN tarifa t ON p.tarifa_id = t.id
-                    ORDER BY p.nombre
-                """)
-                procedimientos = cursor.fetchall()
-                return {"procedimientos": procedimientos}
+        entry = catalog_cache.get_or_load(CACHE_KEY, _cargar_procedimientos)
+        return catalog_response(request, response, entry)
     except Exception as e:
         error_msg = str(e)
         if "procedimiento" in error_msg.lower() or "tarifa" in error_msg.lower():
@@ -111,6 +120,7 @@ def create_procedimiento(procedimiento: ProcedimientoCreate):
                 ))
                 procedimiento_id = cursor.lastrowid
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -168,6 +178,8 @@ def update_procedimiento(procedimiento_id: int, procedimiento: ProcedimientoUpda
                     cursor.execute(query, values)
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
+                calendario_cache.vencer()
                 
                 return {
                     "success": True,
@@ -196,6 +208,7 @@ def delete_procedimiento(procedimiento_id: int):
                     cursor.execute("DELETE FROM tarifa WHERE id = %s", (procedimiento_info['tarifa_id'],))
                 
                 conn.commit()
+                catalog_cache.invalidate(CACHE_KEY)
                 
                 return {
                     "success": True,
@@ -4,12 +4,24 @@ from datetime import datetime
 from typing import Optional
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
+from app.services.contadores import contadores_dashboard
+from app.utils.helpers import rango_dia
 from app.models.schemas.sala_espera import (
     SalaEsperaCreate, SalaEsperaUpdate, 
     BulkUpdateEstadosRequest, SalaEsperaInDB
 )
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
+
+ORDEN_ESTADOS = {
+    'pendiente': 1,
+    'llegada': 2,
+    'confirmada': 3,
+    'en_consulta': 4,
+    'completada': 5,
+    'no_asistio': 6
+}
 
 @router.get("/", response_model=dict)
 def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos los pacientes o solo con cita hoy")):
@@ -18,6 +30,7 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
         with conn:
             with conn.cursor() as cursor:
                 hoy = datetime.now().strftime('%Y-%m-%d')
+                inicio_dia, fin_dia = rango_dia()
                 
                 try:
                     cursor.execute("SELECT COUNT(*) as count FROM estado_sala_espera")
@@ -43,6 +56,38 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                 except Exception as e:
                     pass
                 
+                # Crear en una sola sentencia los registros del día que falten
+                cursor.execute("SELECT id FROM estado_sala_espera WHERE nombre = 'pendiente'")
+                estado_pendiente = cursor.fetchone()
+                
+                if estado_pendiente:
+                    cursor.execute(f"""
+                        INSERT INTO sala_espera 
+                        (paciente_id, estado_id, fecha_hora_ingreso, tiene_cita_hoy, hora_cita_programada)
+                        SELECT
+                            p.id,
+                            %s,
+                            NOW(),
+                            CASE WHEN c_hoy.paciente_id IS NOT NULL THEN 1 ELSE 0 END,
+                            TIME(c_hoy.fecha_hora)
+                        FROM paciente p
+                        {"LEFT" if mostrarTodos else "INNER"} JOIN (
+                            SELECT paciente_id, MIN(fecha_hora) as fecha_hora
+                            FROM cita
+                            WHERE fecha_hora >= %s AND fecha_hora < %s
+                            GROUP BY paciente_id
+                        ) c_hoy ON p.id = c_hoy.paciente_id
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM sala_espera se
+                            WHERE se.paciente_id = p.id
+                            AND se.fecha_hora_ingreso >= %s AND se.fecha_hora_ingreso < %s
+                        )
+                    """, (estado_pendiente['id'], inicio_dia, fin_dia, inicio_dia, fin_dia))
+                    
+                    if cursor.rowcount > 0:
+                        conn.commit()
+                        contadores_dashboard.refrescar_sala_espera(cursor)
+                
                 if mostrarTodos:
                     query = """
                         SELECT
@@ -55,7 +100,10 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                             se.id as sala_espera_id,
                             se.cita_id,
                             ese.nombre as estado_sala,
-                            se.tiempo_espera_minutos as tiempo_espera,
+                            COALESCE(
+                                NULLIF(se.tiempo_espera_minutos, 0),
+                                TIMESTAMPDIFF(MINUTE, se.fecha_hora_ingreso, NOW())
+                            ) as tiempo_espera,
                             TIME(se.fecha_hora_ingreso) as hora_cita,
                             DATE(se.fecha_hora_ingreso) as fecha_cita,
                             se.hora_cita_programada,
@@ -67,17 +115,17 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                             c_hoy.id as cita_id_real
                         FROM paciente p
                         LEFT JOIN sala_espera se ON p.id = se.paciente_id
-                            AND DATE(se.fecha_hora_ingreso) = %s
+                            AND se.fecha_hora_ingreso >= %s AND se.fecha_hora_ingreso < %s
                         LEFT JOIN estado_sala_espera ese ON se.estado_id = ese.id
                         LEFT JOIN (
                             SELECT paciente_id, MIN(id) as id, MIN(fecha_hora) as fecha_hora
                             FROM cita
-                            WHERE DATE(fecha_hora) = %s
+                            WHERE fecha_hora >= %s AND fecha_hora < %s
                             GROUP BY paciente_id
                         ) c_hoy ON p.id = c_hoy.paciente_id
                         ORDER BY se.fecha_hora_ingreso DESC, p.apellido, p.nombre
                     """
-                    params = [hoy, hoy]
+                    params = [inicio_dia, fin_dia, inicio_dia, fin_dia]
                 else:
                     query = """
                         SELECT
@@ -90,7 +138,10 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                             se.id as sala_espera_id,
                             se.cita_id,
                             ese.nombre as estado_sala,
-                            se.tiempo_espera_minutos as tiempo_espera,
+                            COALESCE(
+                                NULLIF(se.tiempo_espera_minutos, 0),
+                                TIMESTAMPDIFF(MINUTE, se.fecha_hora_ingreso, NOW())
+                            ) as tiempo_espera,
                             TIME(se.fecha_hora_ingreso) as hora_cita,
                             DATE(se.fecha_hora_ingreso) as fecha_cita,
                             se.hora_cita_programada,
@@ -101,54 +152,19 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                         INNER JOIN (
                             SELECT paciente_id, MIN(id) as id, MIN(fecha_hora) as fecha_hora
                             FROM cita
-                            WHERE DATE(fecha_hora) = %s
+                            WHERE fecha_hora >= %s AND fecha_hora < %s
                             GROUP BY paciente_id
                         ) c_hoy ON p.id = c_hoy.paciente_id
                         LEFT JOIN sala_espera se ON p.id = se.paciente_id
-                            AND DATE(se.fecha_hora_ingreso) = %s
+                            AND se.fecha_hora_ingreso >= %s AND se.fecha_hora_ingreso < %s
                         LEFT JOIN estado_sala_espera ese ON se.estado_id = ese.id
                         ORDER BY c_hoy.fecha_hora ASC, p.apellido, p.nombre
                     """
-                    params = [hoy, hoy]
+                    params = [inicio_dia, fin_dia, inicio_dia, fin_dia]
                 
                 cursor.execute(query, params)
                 pacientes = cursor.fetchall()
                 
-                pacientes_actualizados = 0
-                for paciente in pacientes:
-                    if not paciente['sala_espera_id']:
-                        cursor.execute("SELECT id FROM estado_sala_espera WHERE nombre = 'pendiente'")
-                        estado = cursor.fetchone()
-                        
-                        if estado:
-                            hora_cita_programada = None
-                            if paciente['cita_fecha_hora']:
-                                try:
-                                    hora_cita = datetime.strptime(
-                                        str(paciente['cita_fecha_hora']), 
-                                        '%Y-%m-%d %H:%M:%S'
-                                    )
-                                    hora_cita_programada = hora_cita.strftime('%H:%M:%S')
-                                except:
-                                    hora_cita_programada = None
-                            
-                            cursor.execute("""
-                                INSERT INTO sala_espera 
-                                (paciente_id, estado_id, fecha_hora_ingreso, tiene_cita_hoy, hora_cita_programada) 
-                                VALUES (%s, %s, NOW(), %s, %s)
-                            """, (
-                                paciente['id'],
-                                estado['id'],
-                                paciente['tiene_cita_hoy'],
-                                hora_cita_programada
-                            ))
-                            pacientes_actualizados += 1
-                
-                if pacientes_actualizados > 0:
-                    conn.commit()
-                    cursor.execute(query, params)
-                    pacientes = cursor.fetchall()
-                
                 pacientes_formateados = []
                 for paciente in pacientes:
                     hora_cita_formateada = None
@@ -169,14 +185,6 @@ def get_sala_espera(mostrarTodos: bool = Query(True, description="Mostrar todos
                             hora_cita_formateada = "09:00"
                     
                     tiempo_espera = paciente['tiempo_espera'] or 0
-                    if tiempo_espera == 0 and paciente['sala_espera_id']:
-                        cursor.execute("""
-                            SELECT TIMESTAMPDIFF(MINUTE, fecha_hora_ingreso, NOW()) as tiempo
-                            FROM sala_espera WHERE id = %s
-                        """, (paciente['sala_espera_id'],))
-                        tiempo_calculado = cursor.fetchone()
-                        if tiempo_calculado and tiempo_calculado['tiempo']:
-                            tiempo_espera = tiempo_calculado['tiempo']
                     
                     pacientes_formateados.append({
                         'id': str(paciente['id']),
@@ -228,11 +236,11 @@ def crear_registro_sala_espera(registro: SalaEsperaCreate):
                     estado_id = cursor.lastrowid
                     estado = {'id': estado_id}
                 
-                hoy = datetime.now().strftime('%Y-%m-%d')
+                inicio_dia, fin_dia = rango_dia()
                 cursor.execute("""
                     SELECT id FROM sala_espera 
-                    WHERE paciente_id = %s AND DATE(fecha_hora_ingreso) = %s
-                """, (registro.paciente_id, hoy))
+                    WHERE paciente_id = %s AND fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s
+                """, (registro.paciente_id, inicio_dia, fin_dia))
                 
                 registro_existente = cursor.fetchone()
                 
@@ -275,6 +283,7 @@ def crear_registro_sala_espera(registro: SalaEsperaCreate):
                 
                 registro_id = cursor.lastrowid
                 conn.commit()
+                contadores_dashboard.refrescar_sala_espera(cursor, [registro.paciente_id])
                 
                 return {
                     "success": True,
@@ -305,15 +314,7 @@ def actualizar_estado_sala_espera(paciente_id: int, datos: SalaEsperaUpdate):
                 cursor.execute("SELECT id FROM estado_sala_espera WHERE nombre = %s", (datos.estado,))
                 estado = cursor.fetchone()
                 if not estado:
-                    orden_map = {
-                        'pendiente': 1,
-                        'llegada': 2,
-                        'confirmada': 3,
-                        'en_consulta': 4,
-                        'completada': 5,
-                        'no_asistio': 6
-                    }
-                    orden = orden_map.get(datos.estado, 99)
+                    orden = ORDEN_ESTADOS.get(datos.estado, 99)
                     
                     cursor.execute("""
                         INSERT INTO estado_sala_espera (nombre, orden)
@@ -322,11 +323,11 @@ def actualizar_estado_sala_espera(paciente_id: int, datos: SalaEsperaUpdate):
                     estado_id = cursor.lastrowid
                     estado = {'id': estado_id}
                 
-                hoy = datetime.now().strftime('%Y-%m-%d')
+                inicio_dia, fin_dia = rango_dia()
                 cursor.execute("""
                     SELECT id, estado_id FROM sala_espera 
-                    WHERE paciente_id = %s AND DATE(fecha_hora_ingreso) = %s
-                """, (paciente_id, hoy))
+                    WHERE paciente_id = %s AND fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s
+                """, (paciente_id, inicio_dia, fin_dia))
                 
                 registro = cursor.fetchone()
                 
@@ -373,7 +374,7 @@ def actualizar_estado_sala_espera(paciente_id: int, datos: SalaEsperaUpdate):
                     cursor.execute("""
                         INSERT INTO sala_espera 
                         (paciente_id, cita_id, estado_id, fecha_hora_ingreso, tiene_cita_hoy, hora_cita_programada) 
-                        VALUES (%s, %s, %s, NOW(), %s, %s)
+                        VALUES (%s, %s, %s, %s, %s, %s)
                     """, (
                         paciente_id,
                         datos.cita_id,
@@ -394,6 +395,7 @@ def actualizar_estado_sala_espera(paciente_id: int, datos: SalaEsperaUpdate):
                         pass
                 
                 conn.commit()
+                contadores_dashboard.refrescar_sala_espera(cursor, [paciente_id])
                 
                 return {
                     "success": True,
@@ -412,228 +414,189 @@ def actualizar_estado_sala_espera(paciente_id: int, datos: SalaEsperaUpdate):
 
 @router.put("/bulk-estados", response_model=dict)
 def bulk_update_estados_sala_espera(request: BulkUpdateEstadosRequest):
+    """
+    Aplica varios cambios de estado en lote y en una sola transacción:
+    resuelve los estados una vez, trae los registros de hoy con una consulta
+    IN y escribe updates, inserts e historial con sentencias por lote.
+    """
     try:
         conn = get_connection()
         with conn:
             with conn.cursor() as cursor:
-                actualizados = 0
-                errores = []
-                hoy = datetime.now().strftime('%Y-%m-%d')
-                
-                estados_necesarios = set(request.cambios.values())
-                estado_ids = {}
-                
-                for estado_nombre in estados_necesarios:
-                    cursor.execute("SELECT id FROM estado_sala_espera WHERE nombre = %s", (estado_nombre,))
-                    estado = cursor.fetchone()
-                    if estado:
-                        estado_ids[estado_nombre] = estado['id']
-                    else:
-                        orden_map = {
-                            'pendiente': 1,
-                            'llegada': 2,
-                            'confirmada': 3,
-                            'en_consulta': 4,
-                            'completada': 5,
-                            'no_asistio': 6
-                        }
-                        orden = orden_map.get(estado_nombre, 99)
-                        
-                        cursor.execute("""
-                            INSERT INTO estado_sala_espera (nombre, orden)
-                            VALUES (%s, %s)
-                        """, (estado_nombre, orden))
-                        estado_id = cursor.lastrowid
-                        estado_ids[estado_nombre] = estado_id
+                inicio_dia, fin_dia = rango_dia()
+                resultados = {}
+                cambios = {}
                 
                 for paciente_id_str, estado_nombre in request.cambios.items():
                     try:
-                        paciente_id = int(paciente_id_str)
-                        estado_id = estado_ids.get(estado_nombre)
-                        
-                        if not estado_id:
-                            errores.append(f"Estado '{estado_nombre}' no válido para paciente {paciente_id}")
-                            continue
-                        
-                        cursor.execute("""
-                            SELECT id, estado_id FROM sala_espera 
-                            WHERE paciente_id = %s AND DATE(fecha_hora_ingreso) = %s
-                        """, (paciente_id, hoy))
-                        
-                        registro = cursor.fetchone()
-                        
-                        if registro:
-                            estado_anterior_id = registro['estado_id']
-                            
-                            cursor.execute("""
-                                UPDATE sala_espera 
-                                SET estado_id = %s, 
-                                    fecha_hora_cambio_estado = NOW(),
-                                    tiempo_espera_minutos = TIMESTAMPDIFF(MINUTE, fecha_hora_ingreso, NOW())
-                                WHERE id = %s
-                            """, (estado_id, registro['id']))
-                            
-                            try:
-                                cursor.execute("""
-                                    INSERT INTO historial_sala_espera 
-                                    (sala_espera_id, estado_anterior_id, estado_nuevo_id, fecha_hora_cambio) 
-                                    VALUES (%s, %s, %s, NOW())
-                                """, (registro['id'], estado_anterior_id, estado_id))
-                            except:
-                                pass
-                        else:
-                            cursor.execute("""
-                                SELECT id, fecha_hora FROM cita 
-                                WHERE paciente_id = %s AND DATE(fecha_hora) = %s
-                                LIMIT 1
-                            """, (paciente_id, hoy))
-                            
-                            cita = cursor.fetchone()
-                            tiene_cita_hoy = cita is not None
-                            cita_id = cita['id'] if cita else None
-                            hora_cita_programada = None
-                            
-                            if cita and cita['fecha_hora']:
-                                try:
-                                    hora_cita = datetime.strptime(
-                                        str(cita['fecha_hora']), 
-                                        '%Y-%m-%d %H:%M:%S'
-                                    )
-                                    hora_cita_programada = hora_cita.strftime('%H:%M:%S')
-                                except:
-                                    hora_cita_programada = None
-                            
-                            cursor.execute("""
-                                INSERT INTO sala_espera 
-                                (paciente_id, cita_id, estado_id, fecha_hora_ingreso, tiene_cita_hoy, hora_cita_programada) 
-                                VALUES (%s, %s, %s, NOW(), %s, %s)
-                            """, (
-                                paciente_id,
-                                cita_id,
-                                estado_id,
-                                tiene_cita_hoy,
-                                hora_cita_programada
-                            ))
-                            
-                            registro_id = cursor.lastrowid
-                            
-                            try:
-                                cursor.execute("""
-                                    INSERT INTO historial_sala_espera 
-                                    (sala_espera_id, estado_nuevo_id, fecha_hora_cambio) 
-                                    VALUES (%s, %s, NOW())
-                                """, (registro_id, estado_id))
-                            except:
-                                pass
-                        
-                        actualizados += 1
-                        
-                    except Exception as e:
-                        error_msg = f"Error con paciente {paciente_id}: {str(e)}"
-                        errores.append(error_msg)
-                        continue
+                        cambios[int(paciente_id_str)] = estado_nombre
+                    except (TypeError, ValueError):
+                        resultados[paciente_id_str] = {
+                            "resultado": "error",
+                            "estado": estado_nombre,
+                            "detalle": "ID de paciente inválido"
+                        }
+                
+                if not cambios:
+                    return _respuesta_bulk(resultados)
+                
+                # 1. Estados: una consulta y, si faltan, un INSERT por lote
+                estados_necesarios = sorted(set(cambios.values()))
+                estado_ids = _resolver_estados(cursor, estados_necesarios)
+                faltantes = [nombre for nombre in estados_necesarios if nombre not in estado_ids]
+                if faltantes:
+                    cursor.executemany("""
+                        INSERT INTO estado_sala_espera (nombre, orden)
+                        VALUES (%s, %s)
+                    """, [(nombre, ORDEN_ESTADOS.get(nombre, 99)) for nombre in faltantes])
+                    estado_ids = _resolver_estados(cursor, estados_necesarios)
+                
+                # 2. Pacientes existentes y registros de hoy, una consulta IN cada uno
+                ids = list(cambios)
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"SELECT id FROM paciente WHERE id IN ({placeholders})", ids)
+                existentes = {row['id'] for row in cursor.fetchall()}
+                
+                cursor.execute(f"""
+                    SELECT id, paciente_id, estado_id FROM sala_espera
+                    WHERE paciente_id IN ({placeholders})
+                      AND fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s
+                    ORDER BY id
+                """, ids + [inicio_dia, fin_dia])
+                registros = {row['paciente_id']: row for row in cursor.fetchall()}
+                
+                por_estado = {}
+                historial = []
+                nuevos = []
+                for paciente_id, estado_nombre in cambios.items():
+                    estado_id = estado_ids.get(estado_nombre)
+                    if not estado_id:
+                        resultados[str(paciente_id)] = {
+                            "resultado": "error",
+                            "estado": estado_nombre,
+                            "detalle": f"Estado '{estado_nombre}' no válido"
+                        }
+                    elif paciente_id not in existentes:
+                        resultados[str(paciente_id)] = {
+                            "resultado": "error",
+                            "estado": estado_nombre,
+                            "detalle": "Paciente no encontrado"
+                        }
+                    elif paciente_id in registros:
+                        registro = registros[paciente_id]
+                        por_estado.setdefault(estado_id, []).append(registro['id'])
+                        historial.append((registro['id'], registro['estado_id'], estado_id))
+                        resultados[str(paciente_id)] = {"resultado": "actualizado", "estado": estado_nombre}
+                    else:
+                        nuevos.append(paciente_id)
+                        resultados[str(paciente_id)] = {"resultado": "creado", "estado": estado_nombre}
+                
+                # Una sola lectura de la hora: con NOW() dentro del VALUES pymysql no
+                # agrupa el executemany en un INSERT multi-fila
+                cursor.execute("SELECT NOW() AS ahora")
+                ahora = cursor.fetchone()['ahora']
+                
+                # 3. Updates: una sentencia por estado destino
+                for estado_id, registro_ids in por_estado.items():
+                    marcadores = ", ".join(["%s"] * len(registro_ids))
+                    cursor.execute(f"""
+                        UPDATE sala_espera 
+                        SET estado_id = %s, 
+                            fecha_hora_cambio_estado = %s,
+                            tiempo_espera_minutos = TIMESTAMPDIFF(MINUTE, fecha_hora_ingreso, %s)
+                        WHERE id IN ({marcadores})
+                    """, [estado_id, ahora, ahora] + registro_ids)
+                
+                # 4. Inserts para pacientes sin registro hoy, con su primera cita del día
+                if nuevos:
+                    marcadores = ", ".join(["%s"] * len(nuevos))
+                    cursor.execute(f"""
+                        SELECT paciente_id, id, fecha_hora FROM cita
+                        WHERE paciente_id IN ({marcadores})
+                          AND fecha_hora >= %s AND fecha_hora < %s
+                        ORDER BY fecha_hora DESC, id DESC
+                    """, nuevos + [inicio_dia, fin_dia])
+                    citas_hoy = {row['paciente_id']: row for row in cursor.fetchall()}
+                    
+                    filas = []
+                    for paciente_id in nuevos:
+                        cita = citas_hoy.get(paciente_id)
+                        filas.append((
+                            paciente_id,
+                            cita['id'] if cita else None,
+                            estado_ids[cambios[paciente_id]],
+                            ahora,
+                            cita is not None,
+                            cita['fecha_hora'].strftime('%H:%M:%S') if cita and cita['fecha_hora'] else None
+                        ))
+                    cursor.executemany("""
+                        INSERT INTO sala_espera 
+                        (paciente_id, cita_id, estado_id, fecha_hora_ingreso, tiene_cita_hoy, hora_cita_programada) 
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """, filas)
+                    
+                    cursor.execute(f"""
+                        SELECT id, paciente_id, estado_id FROM sala_espera
+                        WHERE paciente_id IN ({marcadores})
+                          AND fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s
+                    """, nuevos + [inicio_dia, fin_dia])
+                    historial.extend(
+                        (row['id'], None, row['estado_id']) for row in cursor.fetchall()
+                    )
+                
+                # 5. Historial en un solo INSERT por lote; si falla se revierte todo el lote
+                if historial:
+                    cursor.executemany("""
+                        INSERT INTO historial_sala_espera 
+                        (sala_espera_id, estado_anterior_id, estado_nuevo_id, fecha_hora_cambio) 
+                        VALUES (%s, %s, %s, %s)
+                    """, [fila + (ahora,) for fila in historial])
                 
                 conn.commit()
+                contadores_dashboard.refrescar_sala_espera(cursor, list(cambios))
                 
-                return {
-                    "success": True,
-                    "message": f"Se actualizaron {actualizados} pacientes",
-                    "actualizados": actualizados,
-                    "errores": errores if errores else None,
-                    "timestamp": datetime.now().isoformat()
-                }
+                return _respuesta_bulk(resultados)
                 
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error actualizando estados: {str(e)}")
 
+def _resolver_estados(cursor, nombres):
+    placeholders = ", ".join(["%s"] * len(nombres))
+    cursor.execute(
+        f"SELECT id, nombre FROM estado_sala_espera WHERE nombre IN ({placeholders})",
+        nombres
+    )
+    return {row['nombre']: row['id'] for row in cursor.fetchall()}
+
+def _respuesta_bulk(resultados):
+    actualizados = sum(1 for r in resultados.values() if r["resultado"] != "error")
+    errores = [
+        f"Paciente {paciente_id}: {r['detalle']}"
+        for paciente_id, r in resultados.items() if r["resultado"] == "error"
+    ]
+    return {
+        "success": True,
+        "message": f"Se actualizaron {actualizados} pacientes",
+        "actualizados": actualizados,
+        "errores": errores if errores else None,
+        "resultados": resultados,
+        "timestamp": datetime.now().isoformat()
+    }
+
 @router.get("/estadisticas", response_model=dict)
 def get_estadisticas_sala_espera():
+    """Estadísticas del día desde los contadores en memoria (ver app/services/contadores.py)"""
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                hoy = datetime.now().strftime('%Y-%m-%d')
-                
-                cursor.execute("""
-                    SELECT 
-                        COUNT(DISTINCT p.id) as total_pacientes,
-                        SUM(CASE WHEN c.id IS NOT NULL AND DATE(c.fecha_hora) = %s THEN 1 ELSE 0 END) as con_cita_hoy,
-                        SUM(CASE WHEN c.id IS NULL OR DATE(c.fecha_hora) != %s THEN 1 ELSE 0 END) as sin_cita_hoy
-                    FROM paciente p
-                    LEFT JOIN cita c ON p.id = c.paciente_id AND DATE(c.fecha_hora) = %s
-                """, (hoy, hoy, hoy))
-                
-                general_stats = cursor.fetchone()
-                
-                cursor.execute("""
-                    SELECT 
-                        COALESCE(ese.nombre, 'pendiente') as estado,
-                        COUNT(*) as cantidad,
-                        AVG(TIMESTAMPDIFF(MINUTE, se.fecha_hora_ingreso, NOW())) as tiempo_promedio_espera
-                    FROM sala_espera se
-                    LEFT JOIN estado_sala_espera ese ON se.estado_id = ese.id
-                    WHERE DATE(se.fecha_hora_ingreso) = %s
-                    GROUP BY ese.nombre
-                """, (hoy,))
-                
-                estados_stats = cursor.fetchall()
-                
-                estadisticas = {
-                    'total': general_stats['total_pacientes'] or 0,
-                    'con_cita_hoy': general_stats['con_cita_hoy'] or 0,
-                    'sin_cita_hoy': general_stats['sin_cita_hoy'] or 0,
-                    'pendientes': 0,
-                    'llegadas': 0,
-                    'confirmadas': 0,
-                    'en_consulta': 0,
-                    'completadas': 0,
-                    'no_asistieron': 0,
-                    'tiempo_promedio_espera': 0,
-                    'tiempo_promedio_consulta': 25
-                }
-                
-                for stat in estados_stats:
-                    estado = stat['estado']
-                    cantidad = stat['cantidad']
-                    tiempo_promedio = stat['tiempo_promedio_espera'] or 0
-                    
-                    if estado == 'pendiente':
-                        estadisticas['pendientes'] = cantidad
-                    elif estado == 'llegada':
-                        estadisticas['llegadas'] = cantidad
-                    elif estado == 'confirmada':
-                        estadisticas['confirmadas'] = cantidad
-                    elif estado == 'en_consulta':
-                        estadisticas['en_consulta'] = cantidad
-                    elif estado == 'completada':
-                        estadisticas['completadas'] = cantidad
-                    elif estado == 'no_asistio':
-                        estadisticas['no_asistieron'] = cantidad
-                    
-                    if cantidad > 0:
-                        estadisticas['tiempo_promedio_espera'] = tiempo_promedio
-                
-                cursor.execute("""
-                    SELECT AVG(TIMESTAMPDIFF(MINUTE, c.fecha_hora, NOW())) as tiempo_promedio_consulta
-                    FROM cita c
-                    WHERE DATE(c.fecha_hora) = %s 
-                    AND c.estado_id = 3
-                    AND c.fecha_hora IS NOT NULL
-                """, (hoy,))
-                
-                consulta_time = cursor.fetchone()
-                if consulta_time and consulta_time['tiempo_promedio_consulta']:
-                    estadisticas['tiempo_promedio_consulta'] = consulta_time['tiempo_promedio_consulta']
-                
-                return {
-                    "success": True,
-                    "fecha": hoy,
-                    "estadisticas": estadisticas
-                }
+        snapshot = contadores_dashboard.snapshot_sala_espera()
+        return {
+            "success": True,
+            "fecha": snapshot["fecha"],
+            "estadisticas": snapshot["estadisticas"]
+        }
                 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
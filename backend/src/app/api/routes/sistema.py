@@ -1,13 +1,24 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
 import pymysql
 import os
 from typing import List, Dict, Any
 
-from app.core.database import get_connection
+from app.core.cache import catalog_cache
+from app.services.agenda_indice import indice_agenda
+from app.services.calendario_agenda import calendario_cache
+from app.services.contadores import contadores_dashboard
+from app.services.pdf_cotizaciones import pdf_cotizaciones
+from app.core.database import get_connection, get_pool_stats
+from app.core.instrumentacion import metricas_sql
+from app.core.tiempos import metricas_requests
+from app.core.compresion import metricas_compresion
+from app.core.migraciones import estado_migraciones, verificar_consultas
 from app.core.config import settings
+from app.core.respuestas import RutaJSON
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 @router.get("/health")
 def health_check():
@@ -33,30 +44,15 @@ async def health_check_fast():
 
 @router.get("/dashboard/quick-counts")
 def get_quick_counts():
-    """Endpoint SUPER rápido solo para conteos"""
+    """Endpoint SUPER rápido solo para conteos: lee los contadores en memoria"""
     try:
-        conn = get_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                # 1. Contar pacientes (solo COUNT, sin traer datos)
-                cursor.execute("SELECT COUNT(*) as total FROM paciente")
-                pacientes_total = cursor.fetchone()['total']
-                
-                # 2. Contar citas de hoy (solo COUNT)
-                hoy = datetime.now().strftime('%Y-%m-%d')
-                cursor.execute("""
-                    SELECT COUNT(*) as total 
-                    FROM cita 
-                    WHERE DATE(fecha_hora) = %s
-                """, (hoy,))
-                citas_hoy = cursor.fetchone()['total']
-                
-                return {
-                    "success": True,
-                    "pacientes_total": pacientes_total,
-                    "citas_hoy": citas_hoy,
-                    "timestamp": datetime.now().isoformat()
-                }
+        conteos = contadores_dashboard.snapshot_quick_counts()
+        return {
+            "success": True,
+            "pacientes_total": conteos["pacientes_total"],
+            "citas_hoy": conteos["citas_hoy"],
+            "timestamp": datetime.now().isoformat()
+        }
     except Exception as e:
         return {
             "success": False,
@@ -107,7 +103,10 @@ def test_frontend():
                 try:
                     cursor.execute("SELECT COUNT(*) as count FROM estado_sala_espera")
                     estados_sala_count = cursor.fetchone()['count']
-                    cursor.execute("SELECT COUNT(*) as count FROM sala_espera WHERE DATE(fecha_hora_ingreso) = CURDATE()")
+                    cursor.execute("""
+                        SELECT COUNT(*) as count FROM sala_espera
+                        WHERE fecha_hora_ingreso >= CURDATE() AND fecha_hora_ingreso < CURDATE() + INTERVAL 1 DAY
+                    """)
                     sala_hoy_count = cursor.fetchone()['count']
                     sala_espera_disponible = True
                 except:
@@ -253,6 +252,7 @@ def debug_connection_pool():
                     "max_connections": max_conn['Value'] if max_conn else "N/A",
                     "current_connections": threads_conn['Value'] if threads_conn else "N/A",
                     "active_processes": len(processes),
+                    "pool": get_pool_stats(),
                     "connection_details": {
                         "host": settings.DB_HOST,
                         "port": settings.DB_PORT,
@@ -264,6 +264,7 @@ def debug_connection_pool():
         return {
             "success": False,
             "error": str(e),
+            "pool": get_pool_stats(),
             "connection_details": {
                 "host": settings.DB_HOST,
                 "port": settings.DB_PORT,
@@ -271,6 +272,85 @@ def debug_connection_pool():
             }
         }
 
+@router.get("/debug/cache")
+def debug_cache(limpiar: bool = False):
+    """Estado del cache de catálogos (aciertos, fallos, invalidaciones). `limpiar=true` lo vacía"""
+    if limpiar:
+        catalog_cache.clear()
+        indice_agenda.limpiar()
+        calendario_cache.limpiar()
+        pdf_cotizaciones.limpiar()
+    return {
+        "success": True,
+        "catalogos": catalog_cache.stats(),
+        "agenda": indice_agenda.stats(),
+        "calendario": calendario_cache.stats(),
+        "contadores": contadores_dashboard.stats(),
+        "pdf_cotizaciones": pdf_cotizaciones.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/debug/explain")
+def debug_explain():
+    """Migraciones de índices aplicadas y EXPLAIN de las consultas calientes"""
+    try:
+        return {
+            "success": True,
+            "migraciones": estado_migraciones(),
+            "verificacion": verificar_consultas(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/debug/sql")
+def debug_sql(top: int = 20, limpiar: bool = False):
+    """
+    Métricas de las consultas SQL por ruta: latencia, filas, consultas por
+    request, huellas más costosas, consultas lentas y sospechas de N+1.
+    `limpiar=true` reinicia los contadores después de leerlos.
+    """
+    metricas = metricas_sql.snapshot(top=top)
+    if limpiar:
+        metricas_sql.limpiar()
+    return {
+        "success": True,
+        **metricas,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Métricas en formato de texto de Prometheus: p50/p95/p99 por ruta del
+    tiempo total, de DB y de serialización, requests por status, contadores
+    SQL y bytes ahorrados por la compresión. Es `async` para leer las
+    ventanas desde el event loop, el mismo hilo que las escribe.
+    """
+    return PlainTextResponse(
+        metricas_requests.prometheus() + metricas_sql.prometheus() + metricas_compresion.prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@router.get("/debug/tiempos")
+async def debug_tiempos(limpiar: bool = False):
+    """
+    Percentiles por ruta y estado de la compresión en JSON. `limpiar=true`
+    reinicia las ventanas y los contadores después de leerlos
+    """
+    rutas = metricas_requests.resumen()
+    compresion = metricas_compresion.resumen()
+    if limpiar:
+        metricas_requests.limpiar()
+        metricas_compresion.limpiar()
+    return {
+        "success": True,
+        "ventana": metricas_requests.ventana,
+        "rutas": dict(sorted(rutas.items(), key=lambda r: r[1]["p95_ms"], reverse=True)),
+        "compresion": compresion,
+        "timestamp": datetime.now().isoformat()
+    }
+
 @router.get("/debug/environment")
 def debug_environment():
     """Muestra variables de entorno (sin contraseñas)"""
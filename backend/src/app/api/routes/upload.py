@@ -1,11 +1,18 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse
 import os
 import uuid
 from datetime import datetime
 import shutil
 
-router = APIRouter()
+from app.services.archivos import ArchivoDemasiadoGrande, en_hilo, ingerir_upload
+from app.services.miniaturas import (
+    CARPETAS, FORMATOS, es_imagen, eliminar_derivados,
+    obtener_derivado, programar_derivados, urls_derivados
+)
+from app.core.respuestas import RutaJSON
+
+router = APIRouter(route_class=RutaJSON)
 
 # Configuración de carpeta de uploads
 UPLOAD_DIR = "uploads/historias"
@@ -30,25 +37,22 @@ async def upload_historia_foto(
                 detail=f"Tipo de archivo no permitido. Solo se permiten imágenes."
             )
         
-        # Validar tamaño (máximo 10MB)
-        contents = await file.read()
-        file_size = len(contents)
+        # Generar nombre único
+        file_extension = os.path.splitext(file.filename)[1]
+        unique_filename = f"{historia_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}{file_extension}"
+        file_path = os.path.join(UPLOAD_DIR, unique_filename)
         
+        # Guardar archivo por bloques directo en su destino (máximo 10MB)
         max_size = 10 * 1024 * 1024  # 10MB
-        if file_size > max_size:
+        try:
+            ingerido = await ingerir_upload(file, max_size, file_path)
+        except ArchivoDemasiadoGrande:
             raise HTTPException(
                 status_code=400,
                 detail=f"Archivo demasiado grande. Máximo: 10MB"
             )
-        
-        # Generar nombre único
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{historia_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Guardar archivo
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
+        file_size = ingerido.size
+        programar_derivados(file_path)
         
         # URL pública del archivo
         file_url = f"/uploads/historias/{unique_filename}"
@@ -63,6 +67,8 @@ async def upload_historia_foto(
             "filename": unique_filename,
             "original_filename": file.filename,
             "size": file_size,
+            "sha256": ingerido.sha256,
+            "miniaturas": urls_derivados(file_url),
             "content_type": file.content_type
         }
         
@@ -88,6 +94,7 @@ async def delete_historia_foto(historia_id: int, filename: str):
             raise HTTPException(status_code=404, detail="Archivo no encontrado")
         
         os.remove(file_path)
+        eliminar_derivados(file_path)
         
         return {
             "success": True,
@@ -100,4 +107,34 @@ async def delete_historia_foto(historia_id: int, filename: str):
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar archivo: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/miniatura/{carpeta}/{filename}")
+async def get_miniatura(
+    carpeta: str,
+    filename: str,
+    tamano: str = Query("thumb", pattern="^(thumb|medium)$", description="'thumb' (256px) o 'medium' (1024px)"),
+    formato: str = Query("webp", pattern="^(webp|jpeg)$", description="'webp' o 'jpeg'")
+):
+    """
+    Devuelve una versión reducida de una foto almacenada localmente.
+    Se genera en el primer pedido si el worker aún no la creó.
+    """
+    if carpeta not in CARPETAS or filename != os.path.basename(filename) or not es_imagen(filename):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    ruta_original = os.path.join("uploads", carpeta, filename)
+    if not os.path.exists(ruta_original):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    try:
+        ruta = await en_hilo(obtener_derivado, ruta_original, tamano, formato)
+    except Exception as e:
+        print(f"⚠️ Error generando miniatura de {ruta_original}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generando miniatura: {str(e)}")
+    
+    return FileResponse(
+        ruta,
+        media_type=FORMATOS[formato][1],
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
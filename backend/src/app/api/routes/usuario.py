@@ -5,9 +5,10 @@ from datetime import datetime
 import pymysql
 
 from app.core.database import get_connection
+from app.core.respuestas import RutaJSON
 from app.models.schemas.usuario import UsuarioCreate, UsuarioUpdate
 
-router = APIRouter()
+router = APIRouter(route_class=RutaJSON)
 
 @router.post("/", response_model=dict)
 def create_usuario(usuario: UsuarioCreate):
@@ -0,0 +1,123 @@
+# backend/src/app/core/cache.py
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request, Response
+
+from .config import settings
+
+class CacheEntry:
+    """Valor cacheado junto con su ETag y el instante en que vence"""
+    __slots__ = ("value", "etag", "expires_at")
+
+    def __init__(self, value: Any, ttl: float):
+        self.value = value
+        body = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+        self.etag = '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+        self.expires_at = time.monotonic() + ttl
+
+class CatalogCache:
+    """
+    ⚡ Cache de lectura para catálogos pequeños (procedimientos, adicionales, estados...)
+
+    - `get_or_load` devuelve el valor vigente o lo recarga con `loader`
+      (una sola recarga concurrente por clave).
+    - Los handlers de escritura llaman `invalidate(clave)` tras el commit.
+    - Cada entrada lleva un ETag para responder 304 a `If-None-Match`.
+
+    La invalidación es local al proceso; con varios workers el TTL acota
+    cuánto puede tardar un cambio en verse en los demás.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._entries: Dict[str, CacheEntry] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "not_modified": 0}
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _fresh(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            return entry
+        return None
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> CacheEntry:
+        entry = self._fresh(key)
+        if entry is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return entry
+
+        with self._key_lock(key):
+            # Otro hilo pudo haberlo recargado mientras esperábamos
+            entry = self._fresh(key)
+            if entry is not None:
+                with self._lock:
+                    self._stats["hits"] += 1
+                return entry
+
+            entry = CacheEntry(loader(), self.ttl)
+            with self._lock:
+                self._entries[key] = entry
+                self._stats["misses"] += 1
+            return entry
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._stats["hits"] + self._stats["misses"]
+            now = time.monotonic()
+            return {
+                "ttl_s": self.ttl,
+                **self._stats,
+                "hit_ratio": round(self._stats["hits"] / total, 4) if total else None,
+                "keys": {
+                    key: {"etag": entry.etag, "expires_in_s": round(entry.expires_at - now, 1)}
+                    for key, entry in self._entries.items()
+                },
+            }
+
+    def note_not_modified(self):
+        with self._lock:
+            self._stats["not_modified"] += 1
+
+catalog_cache = CatalogCache(ttl=settings.CATALOGO_CACHE_TTL)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def catalog_response(request: Request, response: Response, entry: CacheEntry):
+    """
+    Devuelve el catálogo con su ETag, o un 304 vacío si el cliente ya tiene
+    esa versión (`If-None-Match`).
+    """
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        catalog_cache.note_not_modified()
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return entry.value
@@ -0,0 +1,153 @@
+"""
+Compresión de respuestas HTTP: gzip, y brotli si está instalado.
+
+`CompresionMiddleware` (en `app.core.middleware`) decide por respuesta:
+
+- el cliente debe aceptarlo (`Accept-Encoding`); si acepta ambos se prefiere
+  brotli, que en JSON comprime bastante más que gzip al mismo costo.
+- sólo tipos de texto de `COMPRESION_TIPOS` (JSON, NDJSON, CSV, texto...):
+  imágenes y PDF ya vienen comprimidos.
+- una respuesta completa menor a `COMPRESION_MIN_BYTES` sale tal cual (la
+  cabecera gzip y el CPU no compensan).
+- las respuestas en streaming (exportaciones) se comprimen bloque a bloque
+  con un flush tras cada uno, así el cliente recibe los datos a medida que
+  se generan y no al final.
+
+Los bloques grandes se comprimen en el threadpool para no frenar el event
+loop. Los contadores de `metricas_compresion` se escriben desde el
+middleware (event loop) y se leen desde endpoints `async`, como los de
+`app.core.tiempos`: no hace falta candado.
+
+`brotli` es opcional: si no está instalado sólo se ofrece gzip.
+"""
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+BROTLI_DISPONIBLE = brotli is not None
+
+class _Gzip:
+    __slots__ = ("_compresor",)
+
+    def __init__(self, nivel: int):
+        # wbits=31: formato gzip (cabecera y CRC), no zlib crudo
+        self._compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def comprimir(self, datos: bytes, final: bool) -> bytes:
+        salida = self._compresor.compress(datos)
+        return salida + self._compresor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class _Brotli:
+    __slots__ = ("_compresor",)
+
+    def __init__(self, nivel: int):
+        self._compresor = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, datos: bytes, final: bool) -> bytes:
+        salida = self._compresor.process(datos)
+        return salida + (self._compresor.finish() if final else self._compresor.flush())
+
+def compresor(codificacion: str, nivel_gzip: int, nivel_brotli: int):
+    """Compresor con estado para una respuesta (`comprimir(datos, final)`)"""
+    if codificacion == "br":
+        return _Brotli(nivel_brotli)
+    return _Gzip(nivel_gzip)
+
+def negociar(accept_encoding: Optional[str]) -> Optional[str]:
+    """`"br"`, `"gzip"` o `None` según el `Accept-Encoding` del cliente"""
+    if not accept_encoding:
+        return None
+    calidades: Dict[str, float] = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                calidad = float(parametros[2:])
+            except ValueError:
+                calidad = 0.0
+        calidades[nombre.strip()] = calidad
+
+    comodin = calidades.get("*", 0.0)
+    opciones = []
+    if BROTLI_DISPONIBLE:
+        opciones.append(("br", calidades.get("br", comodin)))
+    opciones.append(("gzip", calidades.get("gzip", calidades.get("x-gzip", comodin))))
+    # max se queda con la primera en caso de empate: brotli
+    codificacion, calidad = max(opciones, key=lambda o: o[1])
+    return codificacion if calidad > 0 else None
+
+def tipo_comprimible(content_type: Optional[str], tipos) -> bool:
+    if not content_type:
+        return False
+    return content_type.split(";", 1)[0].strip().lower() in tipos
+
+class MetricasCompresion:
+
+    def __init__(self):
+        # codificación -> [respuestas, bytes originales, bytes enviados]
+        self._por_codificacion: Dict[str, list] = {}
+        # motivo -> respuestas que salieron sin comprimir
+        self._omitidas: Dict[str, int] = {}
+
+    def observar(self, codificacion: str, originales: int, comprimidos: int):
+        acumulado = self._por_codificacion.get(codificacion)
+        if acumulado is None:
+            acumulado = self._por_codificacion[codificacion] = [0, 0, 0]
+        acumulado[0] += 1
+        acumulado[1] += originales
+        acumulado[2] += comprimidos
+
+    def omitir(self, motivo: str):
+        self._omitidas[motivo] = self._omitidas.get(motivo, 0) + 1
+
+    def resumen(self) -> dict:
+        codificaciones = {}
+        for codificacion, (respuestas, originales, comprimidos) in self._por_codificacion.items():
+            codificaciones[codificacion] = {
+                "respuestas": respuestas,
+                "bytes_originales": originales,
+                "bytes_enviados": comprimidos,
+                "bytes_ahorrados": originales - comprimidos,
+                "ratio": round(comprimidos / originales, 3) if originales else None,
+            }
+        return {
+            "brotli_disponible": BROTLI_DISPONIBLE,
+            "codificaciones": codificaciones,
+            "omitidas": dict(self._omitidas),
+        }
+
+    def prometheus(self) -> str:
+        lineas = []
+        contadores = (
+            ("http_compressed_responses_total", "Respuestas comprimidas", 0),
+            ("http_compression_input_bytes_total", "Bytes antes de comprimir", 1),
+            ("http_compression_output_bytes_total", "Bytes enviados tras comprimir", 2),
+        )
+        for nombre, ayuda, indice in contadores:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for codificacion, acumulado in self._por_codificacion.items():
+                lineas.append(f'{nombre}{{encoding="{codificacion}"}} {acumulado[indice]}')
+
+        lineas.append("# HELP http_compression_saved_bytes_total Bytes ahorrados por la compresión")
+        lineas.append("# TYPE http_compression_saved_bytes_total counter")
+        for codificacion, (_, originales, comprimidos) in self._por_codificacion.items():
+            lineas.append(f'http_compression_saved_bytes_total{{encoding="{codificacion}"}} {originales - comprimidos}')
+
+        lineas.append("# HELP http_uncompressed_responses_total Respuestas sin comprimir por motivo")
+        lineas.append("# TYPE http_uncompressed_responses_total counter")
+        for motivo, cantidad in sorted(self._omitidas.items()):
+            lineas.append(f'http_uncompressed_responses_total{{reason="{motivo}"}} {cantidad}')
+        return "\n".join(lineas) + "\n"
+
+    def limpiar(self):
+        self._por_codificacion.clear()
+        self._omitidas.clear()
+
+metricas_compresion = MetricasCompresion()
@@ -25,7 +25,47 @@ class Settings(BaseSettings):
     
     # SSL para DB
     DB_SSL_CA: str = ""
-    
+
+    # Pool de conexiones
+    DB_POOL_ENABLED: bool = True
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_TIMEOUT: float = 10.0          # segundos esperando una conexión libre
+    DB_POOL_IDLE_TIMEOUT: float = 300.0    # segundos antes de cerrar una conexión ociosa
+    DB_POOL_MAX_LIFETIME: float = 3600.0   # segundos de vida máxima de una conexión
+    DB_POOL_PING_INTERVAL: float = 30.0    # hacer ping al prestar si estuvo ociosa más de esto
+    DB_MIGRACIONES_AUTO: bool = True       # aplicar migraciones de índices pendientes al iniciar
+
+    # Instrumentación de consultas SQL
+    SQL_INSTRUMENTACION: bool = True    # medir cada consulta (latencia, filas, ruta)
+    SQL_LENTA_MS: float = 200.0         # consultas más lentas que esto van al registro de lentas
+    SQL_LENTAS_MAX: int = 100           # tamaño del buffer circular de consultas lentas
+    SQL_N_MAS_1_UMBRAL: int = 10        # repeticiones de una misma consulta en un request para sospechar N+1
+    SERVER_TIMING: bool = True          # agregar la cabecera Server-Timing (total, db, serialización)
+    METRICAS_VENTANA: int = 1024        # requests por ruta para calcular p50/p95/p99
+
+    # Índice de búsqueda de pacientes en memoria
+    PACIENTES_INDICE_REFRESCO: float = 300.0  # segundos entre reconstrucciones completas
+
+    # Cache de catálogos (procedimientos, adicionales, estados)
+    CATALOGO_CACHE_TTL: float = 60.0  # segundos antes de recargar desde la base de datos
+
+    # Contadores del dashboard en memoria
+    CONTADORES_RECONCILIACION: float = 300.0  # segundos entre reconciliaciones completas
+
+    # Índice de disponibilidad de la agenda de procedimientos
+    AGENDA_INDICE_TTL: float = 60.0     # segundos antes de recargar un día desde la base de datos
+    AGENDA_HORA_INICIO: str = "07:00"   # inicio de la jornada para buscar horarios libres
+    AGENDA_HORA_FIN: str = "19:00"      # fin de la jornada para buscar horarios libres
+    CALENDARIO_CACHE_TTL: float = 300.0 # segundos antes de reconciliar un mes del calendario con la base de datos
+    CALENDARIO_CACHE_MESES: int = 36    # meses del calendario en memoria; al pasarse se descarta el menos usado
+
+    # Búsqueda de horarios libres para citas
+    CITAS_HORA_INICIO: str = "08:00"            # inicio de la jornada de consulta
+    CITAS_HORA_FIN: str = "18:00"               # fin de la jornada de consulta
+    CITAS_DIAS_LABORALES: List[int] = [0, 1, 2, 3, 4, 5]  # lunes=0 ... domingo=6
+    CITAS_BUSQUEDA_MAX_DIAS: int = 62           # rango máximo de una búsqueda
+
     # JWT
     SECRET_KEY: str = ""
     ALGORITHM: str = "HS256"
@@ -40,6 +80,44 @@ class Settings(BaseSettings):
     
     # Uploads
     UPLOAD_DIR: str = "uploads"
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024    # bytes por bloque al copiar archivos
+    UPLOAD_IO_WORKERS: int = 4              # hilos para trabajo bloqueante de uploads
+    STORAGE_UPLOAD_CONCURRENCIA: int = 2    # subidas simultáneas a Cloudinary
+    UPLOAD_MAX_REQUEST_BYTES: int = 16 * 1024 * 1024  # tope del cuerpo multipart (mayor límite por tipo + margen)
+
+    # Miniaturas de fotos clínicas
+    MINIATURAS_WORKERS: int = 1     # hilos del worker que genera derivados
+    MINIATURAS_CALIDAD: int = 80    # calidad WebP/JPEG de los derivados
+
+    # Exportaciones en streaming
+    EXPORT_LOTE: int = 1000                  # filas leídas y enviadas por lote
+    EXPORT_NET_WRITE_TIMEOUT: int = 600      # segundos que MySQL espera a un cliente lento
+
+    # Compresión de respuestas (gzip, y brotli si está instalado)
+    COMPRESION_ACTIVA: bool = True
+    COMPRESION_MIN_BYTES: int = 1024         # respuestas completas más chicas salen sin comprimir
+    COMPRESION_NIVEL_GZIP: int = 6           # 1 (rápido) a 9 (máximo)
+    COMPRESION_NIVEL_BROTLI: int = 5         # 0 a 11; por encima de 6 es caro para respuestas dinámicas
+    COMPRESION_HILO_BYTES: int = 256 * 1024  # bloques mayores se comprimen en el threadpool
+    COMPRESION_TIPOS: List[str] = [
+        "application/json",
+        "application/x-ndjson",
+        "application/javascript",
+        "text/csv",
+        "text/plain",
+        "text/html",
+        "text/css",
+        "image/svg+xml",
+    ]
+
+    # Importación masiva de pacientes
+    IMPORT_LOTE: int = 500                   # filas validadas e insertadas por transacción
+    IMPORT_MAX_ERRORES: int = 1000           # errores detallados en el reporte (el resto sólo se cuentan)
+
+    # PDF de cotizaciones
+    PDF_WORKERS: int = 1                # procesos que dibujan PDFs con reportlab
+    PDF_CACHE_DIR: str = "cache/pdf"    # PDFs generados (fuera de UPLOAD_DIR, que es público)
+    PDF_LOGO_PATH: str = ""             # logo del encabezado (opcional)
     
     class Config:
         env_file = ".env"
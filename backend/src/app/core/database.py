@@ -1,8 +1,13 @@
 # backend/src/app/core/database.py
 import pymysql
 import os
+import threading
+import time
+from collections import deque
 from functools import lru_cache
+from pymysql.constants import SERVER_STATUS
 from .config import settings
+from .instrumentacion import instrumentar_cursor, metricas_sql
 
 @lru_cache(maxsize=1)
 def get_connection_config():
@@ -42,27 +47,339 @@ def get_connection_config():
     
     return config
 
+class PoolTimeoutError(pymysql.err.OperationalError):
+    """No se obtuvo una conexión libre del pool dentro del tiempo límite"""
+
+class _PoolEntry:
+    """Conexión física del pool junto con sus marcas de tiempo"""
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión prestada por el pool.
+
+    Se comporta como un `pymysql.Connection` (delega todos los atributos),
+    pero `close()` y la salida de `with conn:` devuelven la conexión al pool
+    en lugar de cerrar el socket. Devolverla varias veces es inofensivo.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise pymysql.err.InterfaceError(0, "La conexión ya fue devuelta al pool")
+        return getattr(entry.raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def open(self):
+        return self._entry is not None and self._entry.raw.open
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def discard(self):
+        """
+        Cierra la conexión física en lugar de devolverla al pool (p. ej. si
+        quedó un resultado sin buffer a medio leer).
+        """
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._discard(entry)
+
+    def __del__(self):
+        # Conexiones olvidadas sin close(): no sabemos en qué estado quedaron,
+        # así que se descartan para no perder el cupo del pool.
+        entry = self.__dict__.get("_entry")
+        if entry is not None:
+            self._entry = None
+            try:
+                self._pool._discard(entry)
+            except Exception:
+                pass
+
+class ConnectionPool:
+    """
+    ⚡ Pool acotado de conexiones MySQL
+
+    - Mantiene hasta `max_size` conexiones físicas (prestadas + ociosas).
+    - Reutiliza primero la conexión ociosa más reciente (socket "caliente").
+    - Hace ping al prestar si la conexión estuvo ociosa más de `ping_interval`.
+    - Cierra conexiones ociosas más allá de `idle_timeout` (respetando `min_size`)
+      y las que superan `max_lifetime`.
+    - Si el pool está lleno espera hasta `timeout` segundos y luego lanza
+      `PoolTimeoutError`.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0,
+                 idle_timeout=300.0, max_lifetime=3600.0, ping_interval=30.0):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._size = 0
+        # RLock: __del__ de una conexión olvidada puede ejecutarse (vía GC) mientras
+        # este mismo hilo ya tiene el candado.
+        self._cond = threading.Condition(threading.RLock())
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "checkins": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "ping_failures": 0,
+            "max_wait_ms": 0.0,
+        }
+
+    # ---------- API pública ----------
+
+    def acquire(self):
+        """Presta una conexión viva del pool (o crea una nueva si hay cupo)"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            2013,
+                            f"No hay conexiones libres en el pool (max_size={self.max_size}, "
+                            f"espera={self.timeout}s)"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    entry = _PoolEntry(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._is_usable(entry):
+                self._discard(entry)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if waited:
+                    wait_ms = (time.monotonic() - start) * 1000
+                    self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], round(wait_ms, 2))
+            return PooledConnection(self, entry)
+
+    def warm(self):
+        """Abre conexiones hasta alcanzar `min_size` (llamado al iniciar la app)"""
+        entries = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size or self._size >= self.max_size:
+                        break
+                    self._size += 1
+                try:
+                    entries.append(_PoolEntry(self._connect()))
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                    raise
+        finally:
+            with self._cond:
+                self._stats["created"] += len(entries)
+                self._idle.extend(entries)
+                self._cond.notify_all()
+
+    def close_all(self):
+        """Cierra todas las conexiones ociosas (usado al apagar la app)"""
+        with self._cond:
+            entries = list(self._idle)
+            self._idle.clear()
+        for entry in entries:
+            self._discard(entry)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "enabled": True,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "timeout_s": self.timeout,
+                "idle_timeout_s": self.idle_timeout,
+                "max_lifetime_s": self.max_lifetime,
+                "ping_interval_s": self.ping_interval,
+                **self._stats,
+            }
+
+    # ---------- internos ----------
+
+    def _is_usable(self, entry):
+        now = time.monotonic()
+        if now - entry.created_at > self.max_lifetime:
+            return False
+        if not entry.raw.open:
+            return False
+        if now - entry.last_used > self.ping_interval:
+            try:
+                entry.raw.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats["ping_failures"] += 1
+                return False
+        return True
+
+    def _release(self, entry):
+        raw = entry.raw
+        try:
+            if raw.open and raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                # Nunca devolver una transacción a medias al pool
+                raw.rollback()
+        except Exception:
+            self._discard(entry)
+            return
+
+        now = time.monotonic()
+        if not raw.open or now - entry.created_at > self.max_lifetime:
+            self._discard(entry)
+            return
+
+        entry.last_used = now
+        expired = []
+        with self._cond:
+            self._stats["checkins"] += 1
+            self._idle.append(entry)
+            # Las más antiguas quedan a la izquierda: podar las que llevan
+            # ociosas demasiado tiempo sin bajar de min_size.
+            while (self._idle and self._size - len(expired) > self.min_size
+                   and now - self._idle[0].last_used > self.idle_timeout):
+                expired.append(self._idle.popleft())
+            self._cond.notify()
+        for old in expired:
+            self._discard(old)
+
+    def _discard(self, entry):
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+
+class _InstrumentedConnection(pymysql.connections.Connection):
+    """`pymysql.Connection` cuyos cursores registran latencia y filas en `metricas_sql`"""
+
+    def cursor(self, cursor=None):
+        return instrumentar_cursor(super().cursor(cursor))
+
+    def commit(self):
+        super().commit()
+        metricas_sql.registrar_ida_vuelta()
+
+    def rollback(self):
+        super().rollback()
+        metricas_sql.registrar_ida_vuelta()
+
+    def discard(self):
+        """Misma interfaz que `PooledConnection.discard`: sin pool, cerrar basta"""
+        self.close()
+
+def _create_raw_connection():
+    return _InstrumentedConnection(**get_connection_config())
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Devuelve el pool global (se crea perezosamente en el primer uso)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _create_raw_connection,
+                    min_size=settings.DB_POOL_MIN_SIZE,
+                    max_size=settings.DB_POOL_MAX_SIZE,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    idle_timeout=settings.DB_POOL_IDLE_TIMEOUT,
+                    max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+                    ping_interval=settings.DB_POOL_PING_INTERVAL,
+                )
+    return _pool
+
+def get_pool_stats():
+    """Estadísticas del pool para los endpoints de diagnóstico"""
+    if not settings.DB_POOL_ENABLED:
+        return {"enabled": False}
+    return get_pool().stats()
+
 def get_connection():
     """
     ⚡ Obtiene una conexión optimizada a la base de datos
-    
-    Usa configuración cacheada (@lru_cache) para mejor rendimiento.
-    La configuración se lee UNA sola vez y se reutiliza en todas
-    las conexiones siguientes.
-    
+
+    Toma la conexión del pool global: la configuración se lee una sola vez
+    (@lru_cache) y el handshake TCP/TLS sólo se paga cuando el pool necesita
+    abrir una conexión nueva. Al salir de `with conn:` (o con `conn.close()`)
+    la conexión vuelve al pool. Con DB_POOL_ENABLED=false se abre una
+    conexión directa como antes.
+
     Returns:
-        pymysql.Connection: Conexión activa a la base de datos
-        
+        PooledConnection | pymysql.Connection: Conexión activa a la base de datos
+
     Raises:
         pymysql.Error: Si no se puede establecer la conexión
-        
+        PoolTimeoutError: Si el pool está lleno y no se libera una conexión a tiempo
+
     Example:
         >>> conn = get_connection()
         >>> with conn:
         >>>     with conn.cursor() as cursor:
         >>>         cursor.execute("SELECT 1")
         >>>         result = cursor.fetchone()
-        >>> conn.close()
     """
-    config = get_connection_config()
-    return pymysql.connect(**config)
\ No newline at end of file
+    if not settings.DB_POOL_ENABLED:
+        return _create_raw_connection()
+    return get_pool().acquire()
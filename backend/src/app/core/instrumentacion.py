@@ -0,0 +1,348 @@
+"""
+Instrumentación de las consultas SQL.
+
+Todas las conexiones de `get_connection()` entregan cursores envueltos en
+`CursorInstrumentado`, que mide cada `execute`/`executemany` y lo registra en
+`metricas_sql`:
+
+- por ruta de FastAPI (`GET /api/pacientes/{paciente_id}`): consultas,
+  idas y vueltas (consultas + commit/rollback), filas, tiempo total e
+  histograma de latencia por consulta y de consultas por request.
+- por huella (SQL con los literales reemplazados por `?`): cantidad, tiempo
+  total y máximo, para ver qué sentencia pesa más.
+- un buffer circular con las consultas más lentas que `SQL_LENTA_MS`.
+- sospechas de N+1: requests donde una misma huella se ejecutó
+  `SQL_N_MAS_1_UMBRAL` veces o más.
+
+La ruta se toma del scope ASGI que `InstrumentacionSQLMiddleware` deja en un
+ContextVar; los handlers síncronos corren en el threadpool con una copia del
+contexto, así que ven el mismo request. Las consultas fuera de un request
+(arranque, hilos de reconciliación) quedan bajo `(sin request)`.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+SIN_REQUEST = "(sin request)"
+SIN_RUTA = "(sin ruta)"
+OTRAS_HUELLAS = "(otras)"
+
+# Límites superiores (ms) de los buckets de latencia por consulta
+LIMITES_LATENCIA_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Límites superiores de los buckets de consultas por request
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+_RE_COMENTARIOS = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+_RE_CADENAS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_RE_NUMEROS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def huella(sql) -> str:
+    """SQL normalizado: sin comentarios, literales como `?` y listas IN colapsadas"""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _RE_COMENTARIOS.sub(" ", sql)
+    sql = _RE_CADENAS.sub("?", sql)
+    sql = _RE_NUMEROS.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _RE_LISTAS.sub("(?+)", sql)
+    return _RE_ESPACIOS.sub(" ", sql).strip()[:300]
+
+class Histograma:
+    """Conteos por bucket (no acumulados) más suma y máximo"""
+    __slots__ = ("limites", "conteos", "cantidad", "suma", "maximo")
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.conteos = [0] * (len(limites) + 1)
+        self.cantidad = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor: float):
+        self.conteos[bisect_left(self.limites, valor)] += 1
+        self.cantidad += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def a_dict(self) -> dict:
+        buckets = {f"<={limite}": n for limite, n in zip(self.limites, self.conteos)}
+        buckets[f">{self.limites[-1]}"] = self.conteos[-1]
+        return {
+            "cantidad": self.cantidad,
+            "promedio": round(self.suma / self.cantidad, 3) if self.cantidad else 0,
+            "maximo": round(self.maximo, 3),
+            "buckets": buckets,
+        }
+
+class _MetricasRuta:
+    __slots__ = ("requests", "consultas", "idas_vuelta", "filas", "ms", "max_consultas",
+                 "latencia", "consultas_por_request", "n_mas_1")
+
+    def __init__(self):
+        self.requests = 0
+        self.consultas = 0
+        self.idas_vuelta = 0
+        self.filas = 0
+        self.ms = 0.0
+        self.max_consultas = 0
+        self.latencia = Histograma(LIMITES_LATENCIA_MS)
+        self.consultas_por_request = Histograma(LIMITES_CONSULTAS)
+        self.n_mas_1 = 0
+
+    def a_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "consultas": self.consultas,
+            "idas_vuelta": self.idas_vuelta,
+            "filas": self.filas,
+            "ms_total": round(self.ms, 2),
+            "consultas_promedio": round(self.consultas / self.requests, 2) if self.requests else None,
+            "max_consultas": self.max_consultas,
+            "n_mas_1": self.n_mas_1,
+            "latencia_ms": self.latencia.a_dict(),
+            "consultas_por_request": self.consultas_por_request.a_dict(),
+        }
+
+class RequestSQL:
+    """Acumulador de un request; lo crea el middleware y lo comparten sus consultas"""
+    __slots__ = ("scope", "consultas", "idas_vuelta", "filas", "ms", "huellas")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.consultas = 0
+        self.idas_vuelta = 0
+        self.filas = 0
+        self.ms = 0.0
+        self.huellas: Counter = Counter()
+
+    @property
+    def ruta(self) -> str:
+        return nombre_ruta(self.scope) if self.scope is not None else SIN_REQUEST
+
+def nombre_ruta(scope: dict) -> str:
+    """`MÉTODO /plantilla/{param}` de la ruta que atendió el request"""
+    # FastAPI recientes dejan la ruta sin el prefijo del router incluido;
+    # la ruta efectiva (con prefijo) va en scope["fastapi"]
+    route = (scope.get("fastapi") or {}).get("effective_route_context") or scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return SIN_RUTA
+    return f"{scope.get('method', '')} {path}".strip()
+
+_request_actual: ContextVar[Optional[RequestSQL]] = ContextVar("request_sql", default=None)
+
+def request_actual() -> Optional[RequestSQL]:
+    return _request_actual.get()
+
+def _filas(cursor) -> int:
+    # Los cursores sin buffer (SSCursor) no conocen el total: pymysql deja -1 o 2**64-1
+    filas = getattr(cursor, "rowcount", -1)
+    return filas if isinstance(filas, int) and 0 <= filas < 2 ** 63 else 0
+
+class MetricasSQL:
+
+    def __init__(self, lenta_ms: float = 200.0, max_lentas: int = 100,
+                 umbral_n_mas_1: int = 10, max_huellas: int = 500):
+        self.activo = True
+        self.lenta_ms = lenta_ms
+        self.umbral_n_mas_1 = umbral_n_mas_1
+        self.max_huellas = max_huellas
+        self._lock = threading.Lock()
+        self._rutas: Dict[str, _MetricasRuta] = {}
+        # huella -> [cantidad, ms_total, ms_max, filas]
+        self._huellas: Dict[str, list] = {}
+        self._lentas: deque = deque(maxlen=max_lentas)
+        self._sospechas: deque = deque(maxlen=50)
+        self._desde = datetime.now()
+
+    # ---------- registro ----------
+
+    def iniciar_request(self, scope: dict):
+        """Abre el acumulador del request; devuelve el token para `terminar_request`"""
+        request = RequestSQL(scope)
+        return request, _request_actual.set(request)
+
+    def terminar_request(self, request: RequestSQL, token):
+        _request_actual.reset(token)
+        ruta = request.ruta
+        repetidas = [(h, n) for h, n in request.huellas.items() if n >= self.umbral_n_mas_1]
+        with self._lock:
+            metricas = self._ruta(ruta)
+            metricas.requests += 1
+            metricas.idas_vuelta += request.idas_vuelta - request.consultas
+            metricas.max_consultas = max(metricas.max_consultas, request.consultas)
+            metricas.consultas_por_request.observar(request.consultas)
+            if repetidas:
+                metricas.n_mas_1 += 1
+                for sql, veces in repetidas:
+                    self._sospechas.append({
+                        "ruta": ruta,
+                        "huella": sql,
+                        "repeticiones": veces,
+                        "consultas_request": request.consultas,
+                        "fecha": datetime.now().isoformat(),
+                    })
+
+    def registrar_consulta(self, sql, ms: float, filas: int):
+        request = _request_actual.get()
+        ruta = request.ruta if request is not None else SIN_REQUEST
+        firma = huella(sql)
+        if request is not None:
+            request.consultas += 1
+            request.idas_vuelta += 1
+            request.filas += filas
+            request.ms += ms
+            request.huellas[firma] += 1
+
+        with self._lock:
+            metricas = self._ruta(ruta)
+            metricas.consultas += 1
+            metricas.idas_vuelta += 1
+            metricas.filas += filas
+            metricas.ms += ms
+            metricas.latencia.observar(ms)
+
+            acumulado = self._huellas.get(firma)
+            if acumulado is None:
+                if len(self._huellas) >= self.max_huellas:
+                    firma = OTRAS_HUELLAS
+                acumulado = self._huellas.setdefault(firma, [0, 0.0, 0.0, 0])
+            acumulado[0] += 1
+            acumulado[1] += ms
+            acumulado[2] = max(acumulado[2], ms)
+            acumulado[3] += filas
+
+            if ms >= self.lenta_ms:
+                self._lentas.append({
+                    "ruta": ruta,
+                    "ms": round(ms, 2),
+                    "filas": filas,
+                    "sql": _RE_ESPACIOS.sub(" ", sql if isinstance(sql, str) else str(sql)).strip()[:1000],
+                    "fecha": datetime.now().isoformat(),
+                })
+
+    def registrar_ida_vuelta(self):
+        """commit/rollback: cuentan como viaje al servidor pero no como consulta"""
+        request = _request_actual.get()
+        if request is not None:
+            request.idas_vuelta += 1
+        else:
+            with self._lock:
+                self._ruta(SIN_REQUEST).idas_vuelta += 1
+
+    def _ruta(self, ruta: str) -> _MetricasRuta:
+        metricas = self._rutas.get(ruta)
+        if metricas is None:
+            metricas = self._rutas[ruta] = _MetricasRuta()
+        return metricas
+
+    # ---------- lectura ----------
+
+    def snapshot(self, top: int = 20) -> dict:
+        with self._lock:
+            rutas = {ruta: m.a_dict() for ruta, m in self._rutas.items()}
+            huellas = sorted(self._huellas.items(), key=lambda h: h[1][1], reverse=True)[:top]
+            return {
+                "activo": self.activo,
+                "desde": self._desde.isoformat(),
+                "lenta_ms": self.lenta_ms,
+                "umbral_n_mas_1": self.umbral_n_mas_1,
+                "rutas": dict(sorted(rutas.items(), key=lambda r: r[1]["ms_total"], reverse=True)),
+                "huellas": [
+                    {
+                        "huella": sql,
+                        "cantidad": n,
+                        "ms_total": round(total, 2),
+                        "ms_promedio": round(total / n, 3) if n else 0,
+                        "ms_max": round(maximo, 2),
+                        "filas": filas,
+                    }
+                    for sql, (n, total, maximo, filas) in huellas
+                ],
+                "lentas": list(reversed(self._lentas)),
+                "sospechas_n_mas_1": list(reversed(self._sospechas)),
+            }
+
+    def prometheus(self) -> str:
+        """Contadores por ruta en el formato de texto de Prometheus"""
+        with self._lock:
+            rutas = [(ruta.replace('"', '\\"'), m.consultas, m.filas, m.ms, m.n_mas_1)
+                     for ruta, m in self._rutas.items()]
+        lineas = []
+        metricas = (
+            ("db_queries_total", "counter", "Consultas SQL ejecutadas por ruta", 1, 1),
+            ("db_rows_total", "counter", "Filas devueltas o afectadas por ruta", 2, 1),
+            ("db_query_seconds_total", "counter", "Tiempo acumulado en consultas SQL por ruta", 3, 1000),
+            ("db_n_plus_one_requests_total", "counter", "Requests con sospecha de N+1 por ruta", 4, 1),
+        )
+        for nombre, tipo, ayuda, indice, divisor in metricas:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for fila in rutas:
+                lineas.append(f'{nombre}{{route="{fila[0]}"}} {fila[indice] / divisor:g}')
+        return "\n".join(lineas) + "\n"
+
+    def limpiar(self):
+        with self._lock:
+            self._rutas.clear()
+            self._huellas.clear()
+            self._lentas.clear()
+            self._sospechas.clear()
+            self._desde = datetime.now()
+
+metricas_sql = MetricasSQL(
+    lenta_ms=settings.SQL_LENTA_MS,
+    max_lentas=settings.SQL_LENTAS_MAX,
+    umbral_n_mas_1=settings.SQL_N_MAS_1_UMBRAL,
+)
+metricas_sql.activo = settings.SQL_INSTRUMENTACION
+
+class CursorInstrumentado:
+    """
+    Envoltorio de un cursor de pymysql: mide `execute`/`executemany` y delega
+    el resto (fetch*, rowcount, lastrowid, iteración...).
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["_cursor"], name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+    def execute(self, query, args=None):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            metricas_sql.registrar_consulta(query, (time.perf_counter() - inicio) * 1000, _filas(self._cursor))
+
+    def executemany(self, query, args):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            metricas_sql.registrar_consulta(query, (time.perf_counter() - inicio) * 1000, _filas(self._cursor))
+
+def instrumentar_cursor(cursor):
+    return CursorInstrumentado(cursor) if metricas_sql.activo else cursor
@@ -0,0 +1,295 @@
+# backend/src/app/core/middleware.py
+import json
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+
+from app.core import tiempos as tiempos_request
+from app.core.compresion import compresor, metricas_compresion, negociar, tipo_comprimible
+from app.core.instrumentacion import metricas_sql, nombre_ruta, request_actual
+
+class _CuerpoDemasiadoGrande(Exception):
+    pass
+
+def _buscar_header(headers, nombre: bytes):
+    for clave, valor in headers:
+        if clave.lower() == nombre:
+            return valor.decode("latin-1")
+    return None
+
+class LimiteUploadMiddleware:
+    """
+    Corta los uploads multipart que superan `max_bytes` antes de que Starlette
+    los termine de recibir y volcar a disco.
+
+    - Con `Content-Length` conocido se responde 413 sin leer el cuerpo.
+    - Sin él (transferencia por bloques) se cuentan los bytes recibidos y se
+      aborta en cuanto se supera el límite.
+
+    Es sólo un tope global; el límite por tipo de archivo (10MB/15MB) lo
+    aplica la etapa de ingesta de cada endpoint.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._es_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = self._header(scope, b"content-length")
+        if content_length is not None:
+            try:
+                if int(content_length) > self.max_bytes:
+                    await self._rechazar(send)
+                    return
+            except ValueError:
+                pass
+
+        recibidos = 0
+        excedido = False
+        respuesta_iniciada = False
+
+        async def receive_limitado():
+            nonlocal recibidos, excedido
+            message = await receive()
+            if message["type"] == "http.request":
+                recibidos += len(message.get("body", b""))
+                if recibidos > self.max_bytes:
+                    excedido = True
+                    raise _CuerpoDemasiadoGrande()
+            return message
+
+        async def send_marcado(message):
+            nonlocal respuesta_iniciada
+            if excedido:
+                # FastAPI convierte el error de lectura en un 400 genérico:
+                # se reemplaza por el 413 propio.
+                if message["type"] == "http.response.start" and not respuesta_iniciada:
+                    respuesta_iniciada = True
+                    await self._rechazar(send)
+                return
+            if message["type"] == "http.response.start":
+                respuesta_iniciada = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limitado, send_marcado)
+        except _CuerpoDemasiadoGrande:
+            if not respuesta_iniciada:
+                await self._rechazar(send)
+
+    @staticmethod
+    def _header(scope, nombre: bytes):
+        return _buscar_header(scope.get("headers", []), nombre)
+
+    def _es_multipart(self, scope) -> bool:
+        content_type = self._header(scope, b"content-type") or ""
+        return content_type.startswith("multipart/form-data")
+
+    async def _rechazar(self, send):
+        limite_mb = self.max_bytes // (1024 * 1024)
+        body = json.dumps(
+            {"detail": f"El archivo es demasiado grande. Máximo {limite_mb}MB."},
+            ensure_ascii=False
+        ).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+class InstrumentacionSQLMiddleware:
+    """
+    Abre un acumulador de `metricas_sql` por request HTTP para que las
+    consultas que ejecute el handler queden atribuidas a su ruta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metricas_sql.activo:
+            await self.app(scope, receive, send)
+            return
+
+        request, token = metricas_sql.iniciar_request(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metricas_sql.terminar_request(request, token)
+
+class TiemposMiddleware:
+    """
+    Mide cada request HTTP, agrega `Server-Timing` a la respuesta y registra
+    la muestra en `metricas_requests`.
+    """
+
+    def __init__(self, app, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        tiempos, token = tiempos_request.iniciar_request()
+        status = 500
+        sql = None
+
+        async def send_medido(message):
+            nonlocal status, sql
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # El acumulador SQL del request sólo es visible dentro de la app
+                sql = request_actual()
+                if self.server_timing:
+                    total = (time.perf_counter() - inicio) * 1000
+                    valor = tiempos_request.server_timing(total, sql, tiempos)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", valor.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            tiempos_request.terminar_request(token)
+            total = (time.perf_counter() - inicio) * 1000
+            tiempos_request.metricas_requests.observar(
+                nombre_ruta(scope),
+                total,
+                sql.ms if sql is not None else 0.0,
+                tiempos.serializacion_ms,
+                status,
+            )
+
+class CompresionMiddleware:
+    """
+    Comprime las respuestas con gzip o brotli según `Accept-Encoding`; ver
+    `app.core.compresion` para los criterios.
+    """
+
+    def __init__(self, app, min_bytes: int = 1024, tipos=("application/json",),
+                 nivel_gzip: int = 6, nivel_brotli: int = 5, hilo_bytes: int = 256 * 1024):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.tipos = frozenset(t.lower() for t in tipos)
+        self.nivel_gzip = nivel_gzip
+        self.nivel_brotli = nivel_brotli
+        self.hilo_bytes = hilo_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        codificacion = negociar(_buscar_header(scope.get("headers", []), b"accept-encoding"))
+        if codificacion is None:
+            metricas_compresion.omitir("cliente")
+            await self.app(scope, receive, send)
+            return
+
+        inicio = None
+        comprimiendo = None
+        pasar = False
+        terminado = False
+        originales = enviados = 0
+
+        async def send_comprimido(message):
+            nonlocal inicio, comprimiendo, pasar, terminado, originales, enviados
+            if pasar:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                motivo = self._motivo_para_omitir(message)
+                if motivo:
+                    metricas_compresion.omitir(motivo)
+                    pasar = True
+                    await send(message)
+                else:
+                    # Se retiene hasta ver el primer bloque del cuerpo
+                    inicio = message
+                return
+
+            if message["type"] != "http.response.body":
+                pasar = True
+                if comprimiendo is None:
+                    await send(inicio)
+                await send(message)
+                return
+
+            cuerpo = message.get("body", b"")
+            mas = message.get("more_body", False)
+            if comprimiendo is None:
+                if not mas and len(cuerpo) < self.min_bytes:
+                    metricas_compresion.omitir("pequena")
+                    pasar = True
+                    await send(inicio)
+                    await send(message)
+                    return
+                comprimiendo = compresor(codificacion, self.nivel_gzip, self.nivel_brotli)
+                datos = await self._comprimir(comprimiendo, cuerpo, not mas)
+                await send({**inicio, "headers": self._headers(inicio, codificacion, None if mas else len(datos))})
+            elif not cuerpo and mas:
+                return
+            else:
+                datos = await self._comprimir(comprimiendo, cuerpo, not mas)
+
+            originales += len(cuerpo)
+            enviados += len(datos)
+            if not mas:
+                terminado = True
+                metricas_compresion.observar(codificacion, originales, enviados)
+            await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+        try:
+            await self.app(scope, receive, send_comprimido)
+        finally:
+            if comprimiendo is not None and not terminado:
+                # Descarga cortada: se cuenta lo que se llegó a enviar
+                metricas_compresion.observar(codificacion, originales, enviados)
+
+    def _motivo_para_omitir(self, message):
+        status = message["status"]
+        if status < 200 or status in (204, 304):
+            return "status"
+        headers = message.get("headers", [])
+        if _buscar_header(headers, b"content-encoding") is not None:
+            return "codificada"
+        if not tipo_comprimible(_buscar_header(headers, b"content-type"), self.tipos):
+            return "tipo"
+        return None
+
+    @staticmethod
+    def _headers(inicio, codificacion: str, largo):
+        headers = MutableHeaders(raw=list(inicio.get("headers", [])))
+        headers["Content-Encoding"] = codificacion
+        headers.add_vary_header("Accept-Encoding")
+        if largo is None:
+            # Streaming: el largo final no se conoce
+            if "content-length" in headers:
+                del headers["content-length"]
+        else:
+            headers["Content-Length"] = str(largo)
+        # El cuerpo ya no es idéntico byte a byte al original
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        return headers.raw
+
+    async def _comprimir(self, comprimiendo, datos: bytes, final: bool) -> bytes:
+        if len(datos) >= self.hilo_bytes:
+            return await run_in_threadpool(comprimiendo.comprimir, datos, final)
+        return comprimiendo.comprimir(datos, final)
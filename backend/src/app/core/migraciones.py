@@ -0,0 +1,266 @@
+"""
+Migraciones de índices versionadas y verificación con EXPLAIN.
+
+Cada migración es (versión, nombre, índices). Se aplican en orden al iniciar
+la app (`aplicar_migraciones`) y quedan registradas en `schema_migracion`,
+así cada versión corre una sola vez por base de datos. Un índice se omite si
+ya existe otro con las mismas columnas al inicio; las columnas TEXT/BLOB se
+indexan por prefijo. Los índices se crean con DDL en línea
+(ALGORITHM=INPLACE, LOCK=NONE) para no bloquear escrituras.
+
+`verificar_consultas` corre EXPLAIN sobre las consultas calientes y marca
+como regresión la que ya no puede usar su índice (p. ej. si alguien vuelve
+a envolver la columna en `DATE()`). Se expone en /api/debug/explain y por
+línea de comandos:
+
+    python -m app.core.migraciones            # aplica y verifica
+    python -m app.core.migraciones --verificar  # sólo verifica (sale con 1 si hay regresiones)
+"""
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.database import get_connection
+from app.utils.helpers import rango_dia
+
+# (tabla, nombre del índice, columnas)
+Indice = Tuple[str, str, Sequence[str]]
+
+MIGRACIONES: List[Tuple[int, str, List[Indice]]] = [
+    (1, "Citas y sala de espera por rango de fecha", [
+        ("cita", "idx_cita_fecha_paciente", ("fecha_hora", "paciente_id")),
+        ("cita", "idx_cita_usuario_fecha", ("usuario_id", "fecha_hora", "duracion_minutos", "estado_id")),
+        ("cita", "idx_cita_paciente_fecha", ("paciente_id", "fecha_hora")),
+        ("sala_espera", "idx_sala_espera_paciente_ingreso", ("paciente_id", "fecha_hora_ingreso")),
+        ("sala_espera", "idx_sala_espera_ingreso_estado", ("fecha_hora_ingreso", "estado_id")),
+    ]),
+    (2, "Agenda de procedimientos por día", [
+        ("agenda_procedimientos", "idx_agenda_fecha_estado_hora", ("fecha", "estado", "hora")),
+    ]),
+    (3, "Cotizaciones e items", [
+        ("cotizacion_item", "idx_cotizacion_item_cotizacion", ("cotizacion_id", "tipo", "descripcion")),
+        ("cotizacion", "idx_cotizacion_emision", ("fecha_emision", "id")),
+    ]),
+    (4, "Listados paginados por llave", [
+        ("plan_quirurgico", "idx_plan_quirurgico_creacion", ("fecha_creacion", "id")),
+        ("historial_clinico", "idx_historial_clinico_creacion", ("fecha_creacion", "id")),
+        ("historial_clinico", "idx_historial_clinico_paciente", ("paciente_id",)),
+        ("paciente", "idx_paciente_apellido_nombre", ("apellido", "nombre")),
+    ]),
+]
+
+_TIPOS_CON_PREFIJO = {"text", "tinytext", "mediumtext", "longtext", "blob", "tinyblob", "mediumblob", "longblob"}
+_LARGO_PREFIJO = 191
+
+def _asegurar_tabla(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migracion (
+            version INT NOT NULL PRIMARY KEY,
+            nombre VARCHAR(200) NOT NULL,
+            detalle TEXT,
+            aplicada_en DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _columnas(cursor, tabla: str) -> dict:
+    cursor.execute("""
+        SELECT COLUMN_NAME as columna, DATA_TYPE as tipo
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (tabla,))
+    return {fila['columna']: fila['tipo'].lower() for fila in cursor.fetchall()}
+
+def _indices(cursor, tabla: str) -> dict:
+    """nombre del índice -> columnas en orden"""
+    cursor.execute("""
+        SELECT INDEX_NAME as indice, COLUMN_NAME as columna
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (tabla,))
+    indices = {}
+    for fila in cursor.fetchall():
+        indices.setdefault(fila['indice'], []).append(fila['columna'])
+    return indices
+
+def _crear_indice(cursor, tabla: str, nombre: str, columnas: Sequence[str]) -> str:
+    """Crea el índice si hace falta y devuelve qué se hizo"""
+    existentes = _columnas(cursor, tabla)
+    if not existentes:
+        return f"{tabla}.{nombre}: tabla inexistente, omitido"
+    faltantes = [c for c in columnas if c not in existentes]
+    if faltantes:
+        return f"{tabla}.{nombre}: faltan columnas {', '.join(faltantes)}, omitido"
+
+    for indice, cols in _indices(cursor, tabla).items():
+        if indice == nombre or cols[:len(columnas)] == list(columnas):
+            return f"{tabla}.{nombre}: ya cubierto por {indice}"
+
+    definicion = ", ".join(
+        f"`{c}`({_LARGO_PREFIJO})" if existentes[c] in _TIPOS_CON_PREFIJO else f"`{c}`"
+        for c in columnas
+    )
+    try:
+        cursor.execute(
+            f"ALTER TABLE `{tabla}` ADD INDEX `{nombre}` ({definicion}), ALGORITHM=INPLACE, LOCK=NONE"
+        )
+    except Exception:
+        # Algunos motores/versiones no aceptan DDL en línea para este caso
+        cursor.execute(f"ALTER TABLE `{tabla}` ADD INDEX `{nombre}` ({definicion})")
+    return f"{tabla}.{nombre}: creado ({definicion})"
+
+def aplicar_migraciones() -> List[int]:
+    """Aplica las versiones pendientes y devuelve las que se aplicaron"""
+    aplicadas = []
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            # Varios workers arrancan a la vez: sólo uno migra
+            cursor.execute("SELECT GET_LOCK('schema_migracion', 60) as obtenido")
+            if not cursor.fetchone()['obtenido']:
+                print("⚠️ Otro proceso está aplicando migraciones, se omite")
+                return aplicadas
+            try:
+                _asegurar_tabla(cursor)
+                cursor.execute("SELECT version FROM schema_migracion")
+                hechas = {fila['version'] for fila in cursor.fetchall()}
+
+                for version, nombre, indices in MIGRACIONES:
+                    if version in hechas:
+                        continue
+                    detalle = [_crear_indice(cursor, *indice) for indice in indices]
+                    cursor.execute(
+                        "INSERT INTO schema_migracion (version, nombre, detalle) VALUES (%s, %s, %s)",
+                        (version, nombre, "\n".join(detalle))
+                    )
+                    conn.commit()
+                    aplicadas.append(version)
+                    print(f"🗂️ Migración {version} aplicada: {nombre}")
+                    for linea in detalle:
+                        print(f"   - {linea}")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('schema_migracion')")
+                cursor.fetchall()
+    return aplicadas
+
+def estado_migraciones() -> dict:
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            _asegurar_tabla(cursor)
+            cursor.execute("SELECT version, nombre, detalle, aplicada_en FROM schema_migracion ORDER BY version")
+            aplicadas = cursor.fetchall()
+    hechas = {fila['version'] for fila in aplicadas}
+    return {
+        "aplicadas": aplicadas,
+        "pendientes": [version for version, _, _ in MIGRACIONES if version not in hechas],
+    }
+
+# ---------- verificación con EXPLAIN ----------
+
+def _consultas_calientes():
+    """(nombre, sql, params, alias de la tabla, índices aceptados)"""
+    inicio_dia, fin_dia = rango_dia()
+    return [
+        ("citas del día (dashboard)",
+         "SELECT id, paciente_id, fecha_hora, estado_id FROM cita WHERE fecha_hora >= %s AND fecha_hora < %s",
+         (inicio_dia, fin_dia), "cita", {"idx_cita_fecha_paciente"}),
+        ("huecos de citas por doctor",
+         "SELECT c.usuario_id, c.fecha_hora, c.duracion_minutos FROM cita c "
+         "WHERE c.usuario_id IN (%s) AND c.fecha_hora >= %s AND c.fecha_hora < %s",
+         (1, inicio_dia, fin_dia), "c", {"idx_cita_usuario_fecha"}),
+        ("sala de espera del paciente hoy",
+         "SELECT id, estado_id FROM sala_espera "
+         "WHERE paciente_id = %s AND fecha_hora_ingreso >= %s AND fecha_hora_ingreso < %s",
+         (1, inicio_dia, fin_dia), "sala_espera", {"idx_sala_espera_paciente_ingreso"}),
+        ("sala de espera del día",
+         "SELECT se.id, se.paciente_id, se.estado_id FROM sala_espera se "
+         "WHERE se.fecha_hora_ingreso >= %s AND se.fecha_hora_ingreso < %s",
+         (inicio_dia, fin_dia), "se", {"idx_sala_espera_ingreso_estado", "idx_sala_espera_paciente_ingreso"}),
+        ("agenda del día",
+         "SELECT id, hora, duracion FROM agenda_procedimientos "
+         "WHERE fecha = %s AND estado NOT IN ('Cancelado', 'Operado')",
+         (inicio_dia.date(),), "agenda_procedimientos", {"idx_agenda_fecha_estado_hora"}),
+        ("items de cotizaciones",
+         "SELECT id, cotizacion_id, tipo, subtotal FROM cotizacion_item "
+         "WHERE cotizacion_id IN (%s, %s) ORDER BY cotizacion_id, tipo, descripcion",
+         (1, 2), "cotizacion_item", {"idx_cotizacion_item_cotizacion"}),
+        ("listado de cotizaciones por llave",
+         "SELECT c.id FROM cotizacion c ORDER BY c.fecha_emision DESC, c.id DESC LIMIT 50",
+         (), "c", {"idx_cotizacion_emision"}),
+        ("listado de planes por llave",
+         "SELECT pq.id FROM plan_quirurgico pq ORDER BY pq.fecha_creacion DESC, pq.id DESC LIMIT 50",
+         (), "pq", {"idx_plan_quirurgico_creacion"}),
+        ("listado de historias por llave",
+         "SELECT id FROM historial_clinico ORDER BY fecha_creacion DESC, id DESC LIMIT 50",
+         (), "historial_clinico", {"idx_historial_clinico_creacion"}),
+    ]
+
+def verificar_consultas(umbral_filas: int = 1000) -> dict:
+    """
+    EXPLAIN de cada consulta caliente. Resultado por consulta:
+    - ok: usa uno de sus índices
+    - advertencia: el optimizador prefirió no usarlo en una tabla chica
+    - regresion: el índice no es aplicable o la tabla grande se recorre completa
+    """
+    resultados = []
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            for nombre, sql, params, alias, esperados in _consultas_calientes():
+                try:
+                    cursor.execute("EXPLAIN " + sql, params)
+                    filas = cursor.fetchall()
+                except Exception as e:
+                    resultados.append({"consulta": nombre, "estado": "error", "detalle": str(e)})
+                    continue
+
+                plan = next((f for f in filas if f.get('table') == alias), filas[0] if filas else {})
+                posibles = set((plan.get('possible_keys') or "").split(",")) - {""}
+                clave = plan.get('key')
+                filas_estimadas = plan.get('rows') or 0
+
+                if clave in esperados:
+                    estado = "ok"
+                elif posibles & esperados:
+                    # Aplicable pero no elegido: normal en tablas chicas
+                    estado = "advertencia" if filas_estimadas < umbral_filas else "regresion"
+                elif " WHERE " not in sql and filas_estimadas < umbral_filas and _existe_indice(cursor, sql, esperados):
+                    # ORDER BY ... LIMIT sin filtro: en tablas chicas se prefiere ordenar en memoria
+                    estado = "advertencia"
+                else:
+                    estado = "regresion"
+
+                resultados.append({
+                    "consulta": nombre,
+                    "estado": estado,
+                    "tipo_acceso": plan.get('type'),
+                    "indice_usado": clave,
+                    "indices_posibles": sorted(posibles),
+                    "indices_esperados": sorted(esperados),
+                    "filas_estimadas": filas_estimadas,
+                    "extra": plan.get('Extra'),
+                })
+
+    return {
+        "ok": all(r["estado"] in ("ok", "advertencia") for r in resultados),
+        "regresiones": [r["consulta"] for r in resultados if r["estado"] in ("regresion", "error")],
+        "consultas": resultados,
+    }
+
+def _existe_indice(cursor, sql: str, esperados: set) -> bool:
+    tabla = sql.split(" FROM ", 1)[1].split()[0]
+    return bool(esperados & set(_indices(cursor, tabla)))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if "--verificar" not in argv:
+        aplicar_migraciones()
+    reporte = verificar_consultas()
+    for r in reporte["consultas"]:
+        icono = {"ok": "✅", "advertencia": "⚠️"}.get(r["estado"], "❌")
+        print(f"{icono} {r['consulta']}: {r['estado']} "
+              f"(acceso={r.get('tipo_acceso')}, índice={r.get('indice_usado')}, filas≈{r.get('filas_estimadas')})")
+    return 0 if reporte["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Clase de respuesta JSON por defecto de la app y ruta que la usa directo.
+
+`RespuestaJSON` codifica con `json_codec` (orjson si está instalado) y
+resuelve ella misma los tipos que devuelve pymysql, con un formato único en
+toda la API:
+
+- DATETIME / DATE: ISO 8601 (`2024-05-01T09:30:00`, `2024-05-01`).
+- TIME (pymysql lo entrega como `timedelta`): `HH:MM:SS`, igual que las
+  exportaciones; antes salía como `PT9H30M` o como segundos según la ruta.
+- DECIMAL: número (entero si no tiene parte decimal).
+
+Además mide el tiempo de `render` para que `Server-Timing` y las métricas
+por ruta separen la serialización del resto del handler.
+
+`RutaJSON` es la `route_class` de todos los routers: entrega lo que devuelve
+el handler directo a `RespuestaJSON`, sin el paso previo de FastAPI
+(`jsonable_encoder` o la validación y el `serialize` de Pydantic), que en los
+listados grandes era la mayor parte del tiempo de serialización. Sólo lo
+hace en rutas cuyo `response_model` es `dict`, `list` o ninguno, donde ese
+paso no filtra ni valida nada; las que declaran un modelo siguen el camino
+normal.
+"""
+import functools
+import inspect
+import time
+from datetime import date, datetime, time as hora, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+from fastapi import Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from app.core.tiempos import registrar_serializacion
+from app.utils import json_codec
+
+def _hora(valor: timedelta) -> str:
+    segundos = int(valor.total_seconds())
+    signo = "-" if segundos < 0 else ""
+    segundos = abs(segundos)
+    return f"{signo}{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+def _numero(valor: Decimal):
+    numero = float(valor)
+    return int(numero) if numero.is_integer() else numero
+
+# Por tipo exacto, que es lo que entrega pymysql: evita la cadena de isinstance
+_CONVERSORES = {
+    Decimal: _numero,
+    timedelta: _hora,
+    # orjson ya los escribe; esto es para el `json` estándar
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    hora: hora.isoformat,
+    set: list,
+    frozenset: list,
+}
+
+def valor_json(valor):
+    """`default` del codificador: tipos que ni orjson ni json resuelven solos"""
+    conversor = _CONVERSORES.get(type(valor))
+    if conversor is not None:
+        return conversor(valor)
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", "replace")
+    # Subclases, modelos Pydantic, enums, etc.
+    return jsonable_encoder(valor)
+
+class RespuestaJSON(JSONResponse):
+
+    def render(self, content: Any) -> bytes:
+        inicio = time.perf_counter()
+        try:
+            return json_codec.dumpb(content, default=valor_json)
+        finally:
+            registrar_serializacion((time.perf_counter() - inicio) * 1000)
+
+_OPCIONES_MODELO = (
+    "response_model_include", "response_model_exclude", "response_model_exclude_unset",
+    "response_model_exclude_defaults", "response_model_exclude_none",
+)
+
+def _sin_modelo(endpoint: Callable[..., Any], opciones: dict) -> bool:
+    modelo = opciones.get("response_model")
+    if modelo is None or isinstance(modelo, DefaultPlaceholder):
+        # FastAPI toma el modelo de la anotación de retorno si no se indica
+        modelo = inspect.signature(endpoint).return_annotation
+    if modelo not in (None, dict, list, inspect.Signature.empty):
+        return False
+    respuesta = opciones.get("response_class")
+    if respuesta is not None and not isinstance(respuesta, DefaultPlaceholder):
+        return False
+    if inspect.isgeneratorfunction(endpoint) or inspect.isasyncgenfunction(endpoint):
+        return False
+    return not any(opciones.get(opcion) for opcion in _OPCIONES_MODELO)
+
+def _responder(contenido, status_code: int, argumentos: dict):
+    if isinstance(contenido, Response):
+        return contenido
+    respuesta = RespuestaJSON(contenido, status_code=status_code)
+    # Lo que el handler puso en un `response: Response` inyectado (p. ej. ETag),
+    # como hace FastAPI con su respuesta
+    for valor in argumentos.values():
+        if isinstance(valor, Response):
+            if valor.status_code:
+                respuesta.status_code = valor.status_code
+            respuesta.headers.raw.extend(valor.headers.raw)
+    return respuesta
+
+def _respuesta_directa(endpoint: Callable[..., Any], status_code: int):
+    # `wraps` conserva la firma: FastAPI sigue viendo los parámetros originales
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envuelto(*args, **kwargs):
+            return _responder(await endpoint(*args, **kwargs), status_code, kwargs)
+    else:
+        # Handler síncrono: también se serializa en el threadpool, fuera del event loop
+        @functools.wraps(endpoint)
+        def envuelto(*args, **kwargs):
+            return _responder(endpoint(*args, **kwargs), status_code, kwargs)
+    return envuelto
+
+class RutaJSON(APIRoute):
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        if _sin_modelo(endpoint, kwargs):
+            endpoint = _respuesta_directa(endpoint, kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,157 @@
+"""
+Tiempos por request y exportación en formato Prometheus.
+
+`TiemposMiddleware` (en `app.core.middleware`) mide cada request HTTP y lo
+separa en:
+
+- total: desde que entra el request hasta que sale la respuesta completa.
+- db: tiempo en consultas SQL (lo acumula la capa de conexión, ver
+  `app.core.instrumentacion`).
+- serializacion: tiempo en `RespuestaJSON.render` (el `JSONResponse` por
+  defecto de la app).
+- app: el resto (validación, lógica del handler, `jsonable_encoder`).
+
+Los valores hasta el envío de las cabeceras van en `Server-Timing`, así el
+navegador los muestra en la pestaña de red.
+
+Por ruta se guarda una ventana circular de las últimas `METRICAS_VENTANA`
+muestras para calcular p50/p95/p99, más contadores acumulados. Todo se
+escribe desde el middleware, que corre en el event loop (un solo hilo por
+worker), y el endpoint de métricas es `async`, así que también lee desde ese
+hilo: no hace falta ningún candado.
+"""
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+CUANTILES = (0.5, 0.95, 0.99)
+
+class TiemposRequest:
+    """Acumulador de un request; lo crea `TiemposMiddleware`"""
+    __slots__ = ("serializacion_ms",)
+
+    def __init__(self):
+        self.serializacion_ms = 0.0
+
+_tiempos_actual: ContextVar[Optional[TiemposRequest]] = ContextVar("tiempos_request", default=None)
+
+def iniciar_request():
+    """Abre el acumulador del request; devuelve el token para `terminar_request`"""
+    tiempos = TiemposRequest()
+    return tiempos, _tiempos_actual.set(tiempos)
+
+def terminar_request(token):
+    _tiempos_actual.reset(token)
+
+def registrar_serializacion(ms: float):
+    tiempos = _tiempos_actual.get()
+    if tiempos is not None:
+        tiempos.serializacion_ms += ms
+
+class _Ventana:
+    """Últimas `tamano` muestras (total, db, serializacion) de una ruta y sus acumulados"""
+    __slots__ = ("muestras", "siguiente", "cantidad", "suma", "por_status")
+
+    def __init__(self, tamano: int):
+        self.muestras = [None] * tamano
+        self.siguiente = 0
+        self.cantidad = 0
+        # total, db, serializacion (ms)
+        self.suma = [0.0, 0.0, 0.0]
+        self.por_status: Dict[int, int] = {}
+
+    def observar(self, total: float, db: float, serializacion: float, status: int):
+        self.muestras[self.siguiente] = (total, db, serializacion)
+        self.siguiente = (self.siguiente + 1) % len(self.muestras)
+        self.cantidad += 1
+        self.suma[0] += total
+        self.suma[1] += db
+        self.suma[2] += serializacion
+        self.por_status[status] = self.por_status.get(status, 0) + 1
+
+    def cuantiles(self, componente: int) -> Dict[float, float]:
+        valores = sorted(m[componente] for m in self.muestras if m is not None)
+        if not valores:
+            return {}
+        return {q: valores[min(int(q * len(valores)), len(valores) - 1)] for q in CUANTILES}
+
+class MetricasRequests:
+
+    def __init__(self, ventana: int = 1024):
+        self.ventana = ventana
+        self._rutas: Dict[str, _Ventana] = {}
+        self.inicio = time.time()
+
+    def observar(self, ruta: str, total: float, db: float, serializacion: float, status: int):
+        rango = self._rutas.get(ruta)
+        if rango is None:
+            rango = self._rutas[ruta] = _Ventana(self.ventana)
+        rango.observar(total, db, serializacion, status)
+
+    def resumen(self) -> dict:
+        rutas = {}
+        for ruta, rango in self._rutas.items():
+            total = rango.cuantiles(0)
+            rutas[ruta] = {
+                "requests": rango.cantidad,
+                "por_status": dict(rango.por_status),
+                "p50_ms": round(total.get(0.5, 0), 2),
+                "p95_ms": round(total.get(0.95, 0), 2),
+                "p99_ms": round(total.get(0.99, 0), 2),
+                "promedio_ms": round(rango.suma[0] / rango.cantidad, 2) if rango.cantidad else 0,
+                "db_promedio_ms": round(rango.suma[1] / rango.cantidad, 2) if rango.cantidad else 0,
+                "serializacion_promedio_ms": round(rango.suma[2] / rango.cantidad, 2) if rango.cantidad else 0,
+            }
+        return rutas
+
+    def prometheus(self) -> str:
+        """Métricas en el formato de texto de Prometheus (summaries en segundos)"""
+        lineas = []
+        componentes = (
+            ("http_request_duration_seconds", "Duración total del request"),
+            ("http_request_db_seconds", "Tiempo en consultas SQL por request"),
+            ("http_request_serialization_seconds", "Tiempo serializando la respuesta JSON"),
+        )
+        for indice, (nombre, ayuda) in enumerate(componentes):
+            lineas.append(f"# HELP {nombre} {ayuda} (ventana de {self.ventana} requests por ruta)")
+            lineas.append(f"# TYPE {nombre} summary")
+            for ruta, rango in self._rutas.items():
+                etiqueta = _etiqueta(ruta)
+                for q, valor in rango.cuantiles(indice).items():
+                    lineas.append(f'{nombre}{{route="{etiqueta}",quantile="{q}"}} {valor / 1000:.6f}')
+                lineas.append(f'{nombre}_sum{{route="{etiqueta}"}} {rango.suma[indice] / 1000:.6f}')
+                lineas.append(f'{nombre}_count{{route="{etiqueta}"}} {rango.cantidad}')
+
+        lineas.append("# HELP http_requests_total Requests atendidos por ruta y status")
+        lineas.append("# TYPE http_requests_total counter")
+        for ruta, rango in self._rutas.items():
+            etiqueta = _etiqueta(ruta)
+            for status, cantidad in sorted(rango.por_status.items()):
+                lineas.append(f'http_requests_total{{route="{etiqueta}",status="{status}"}} {cantidad}')
+
+        lineas.append("# HELP process_start_time_seconds Inicio del proceso (epoch)")
+        lineas.append("# TYPE process_start_time_seconds gauge")
+        lineas.append(f"process_start_time_seconds {self.inicio:.3f}")
+        return "\n".join(lineas) + "\n"
+
+    def limpiar(self):
+        self._rutas.clear()
+
+def _etiqueta(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metricas_requests = MetricasRequests(ventana=settings.METRICAS_VENTANA)
+
+def server_timing(total: float, sql, tiempos: TiemposRequest) -> str:
+    """Valor de la cabecera `Server-Timing` (ms)"""
+    partes = []
+    db = 0.0
+    if sql is not None:
+        db = sql.ms
+        partes.append(f'db;dur={db:.2f};desc="{sql.consultas} consultas"')
+    partes.append(f"ser;dur={tiempos.serializacion_ms:.2f}")
+    partes.append(f"app;dur={max(total - db - tiempos.serializacion_ms, 0):.2f}")
+    partes.append(f"total;dur={total:.2f}")
+    return ", ".join(partes)
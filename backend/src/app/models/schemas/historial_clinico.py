@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 
 class HistorialClinicoBase(BaseModel):
@@ -32,4 +32,5 @@ class FileUploadResponse(BaseModel):
     success: bool
     message: str
     url: Optional[str] = None
-    filename: Optional[str] = None
\ No newline at end of file
+    filename: Optional[str] = None
+    miniaturas: Optional[Dict[str, str]] = None
\ No newline at end of file
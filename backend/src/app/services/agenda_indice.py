@@ -0,0 +1,244 @@
+"""
+Índice de disponibilidad de la agenda de procedimientos en memoria.
+
+`verificar_disponibilidad` resolvía el solapamiento en SQL con
+`TIME()`/`ADDTIME()`/`SEC_TO_TIME()` sobre `ap.hora`, que no puede usar
+índices, y además unía `paciente` por `numero_documento` sólo para poner
+nombre a los conflictos.
+
+Aquí cada día se carga una vez (`WHERE fecha = %s`, sargable) como una lista
+de intervalos en minutos ordenada por inicio, con el máximo acumulado de los
+finales (un arreglo de máximos de prefijo, no un árbol de intervalos):
+
+- ¿hay conflicto con [a, b)? -> bisect del primer inicio >= b y comparar el
+  máximo acumulado de los finales anteriores con a: O(log n).
+- listar los conflictos recorre hacia atrás mientras ese máximo sea > a. Un
+  intervalo largo temprano (p. ej. un bloqueo de todo el día) mantiene alto
+  el máximo y obliga a recorrer todas las filas anteriores: O(n) en el peor
+  caso. Un día tiene pocas decenas de procedimientos, así que no compensa
+  un árbol de intervalos.
+
+Los días se cargan bajo demanda y se invalidan en cada alta, edición y borrado
+de la agenda. La carga lee MySQL fuera del candado; si llega una
+invalidación de ese día mientras tanto, lo leído puede ser anterior al
+cambio y no se guarda (cada día en carga lleva un número de generación que
+`invalidar` incrementa). Con varios workers cada proceso tiene su propio índice; el TTL
+por día acota cuánto tarda en verse un cambio hecho por otro proceso.
+"""
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.core.database import get_connection
+
+ESTADOS_INACTIVOS = ("Cancelado", "Operado")
+DURACION_POR_DEFECTO = 60
+MINUTOS_DIA = 24 * 60
+
+def a_minutos(hora: Union[str, timedelta, None]) -> Optional[int]:
+    """'HH:MM[:SS]' o el timedelta que devuelve pymysql para TIME -> minutos desde 00:00"""
+    if hora is None:
+        return None
+    if isinstance(hora, timedelta):
+        return int(hora.total_seconds()) // 60
+    partes = str(hora).strip().split(":")
+    if len(partes) < 2:
+        raise ValueError(f"Hora inválida: {hora}")
+    horas, minutos = int(partes[0]), int(partes[1])
+    if not (0 <= horas < 24 and 0 <= minutos < 60):
+        raise ValueError(f"Hora inválida: {hora}")
+    return horas * 60 + minutos
+
+def a_hora(minutos: int) -> str:
+    """Minutos desde 00:00 -> 'HH:MM'"""
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def a_fecha(fecha: Union[str, date]) -> date:
+    if isinstance(fecha, datetime):
+        return fecha.date()
+    if isinstance(fecha, date):
+        return fecha
+    return date.fromisoformat(str(fecha).strip()[:10])
+
+class _Dia:
+    """Intervalos activos de un día, ordenados por inicio"""
+    __slots__ = ("inicios", "finales", "max_final", "filas", "cargado_en")
+
+    def __init__(self, filas: List[dict]):
+        filas = sorted(filas, key=lambda f: (f["inicio"], f["fin"]))
+        self.filas = filas
+        self.inicios = [f["inicio"] for f in filas]
+        self.finales = [f["fin"] for f in filas]
+        self.max_final = []
+        acumulado = -1
+        for fin in self.finales:
+            acumulado = max(acumulado, fin)
+            self.max_final.append(acumulado)
+        self.cargado_en = time.monotonic()
+
+    def solapados(self, inicio: int, fin: int) -> List[dict]:
+        """
+        Filas cuyo intervalo [inicio, fin) se cruza con el pedido. O(n) en el
+        peor caso (ver el docstring del módulo)
+        """
+        i = bisect_left(self.inicios, fin) - 1
+        resultado = []
+        while i >= 0 and self.max_final[i] > inicio:
+            if self.finales[i] > inicio:
+                resultado.append(self.filas[i])
+            i -= 1
+        resultado.reverse()
+        return resultado
+
+    def ocupados(self) -> List[Tuple[int, int]]:
+        """Intervalos ocupados fusionados"""
+        fusionados: List[Tuple[int, int]] = []
+        for inicio, fin in zip(self.inicios, self.finales):
+            if fusionados and inicio <= fusionados[-1][1]:
+                if fin > fusionados[-1][1]:
+                    fusionados[-1] = (fusionados[-1][0], fin)
+            else:
+                fusionados.append((inicio, fin))
+        return fusionados
+
+class IndiceAgenda:
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._dias: Dict[date, _Dia] = {}
+        # Días con cargas en curso -> [generación, cargas en curso]
+        self._generaciones: Dict[date, List[int]] = {}
+        self._lock = threading.Lock()
+        self.cargas = 0
+        self.aciertos = 0
+
+    # ---------- carga ----------
+
+    def _cargar(self, fecha: date, cursor=None) -> _Dia:
+        query = f"""
+            SELECT id, fecha, hora, duracion, estado, procedimiento_id, numero_documento
+            FROM agenda_procedimientos
+            WHERE fecha = %s
+            AND estado NOT IN ({', '.join(['%s'] * len(ESTADOS_INACTIVOS))})
+        """
+        params = (fecha, *ESTADOS_INACTIVOS)
+        if cursor is not None:
+            cursor.execute(query, params)
+            filas = cursor.fetchall()
+        else:
+            conn = get_connection()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    filas = cur.fetchall()
+
+        registros = []
+        for fila in filas:
+            inicio = a_minutos(fila["hora"])
+            if inicio is None:
+                continue
+            duracion = fila["duracion"] or DURACION_POR_DEFECTO
+            registros.append({**fila, "inicio": inicio, "fin": inicio + duracion})
+        return _Dia(registros)
+
+    def dia(self, fecha: Union[str, date], cursor=None) -> _Dia:
+        """Intervalos del día, cargándolos si no están o si vencieron"""
+        fecha = a_fecha(fecha)
+        with self._lock:
+            dia = self._dias.get(fecha)
+        if dia is not None and (self.ttl <= 0 or time.monotonic() - dia.cargado_en < self.ttl):
+            self.aciertos += 1
+            return dia
+
+        with self._lock:
+            generacion = self._generaciones.setdefault(fecha, [0, 0])
+            generacion[1] += 1
+            vista = generacion[0]
+        try:
+            dia = self._cargar(fecha, cursor)
+        finally:
+            with self._lock:
+                generacion[1] -= 1
+                if generacion[1] == 0:
+                    self._generaciones.pop(fecha, None)
+        with self._lock:
+            self.cargas += 1
+            # Invalidado durante la carga: se usa para esta consulta pero no se guarda
+            if generacion[0] == vista:
+                self._dias[fecha] = dia
+        return dia
+
+    def invalidar(self, *fechas):
+        """Descarta los días indicados; se recargan en la próxima consulta"""
+        with self._lock:
+            for fecha in fechas:
+                if fecha is None:
+                    continue
+                fecha = a_fecha(fecha)
+                self._dias.pop(fecha, None)
+                generacion = self._generaciones.get(fecha)
+                if generacion is not None:
+                    generacion[0] += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._dias.clear()
+            for generacion in self._generaciones.values():
+                generacion[0] += 1
+
+    # ---------- consultas ----------
+
+    def conflictos(self, fecha, hora, duracion: int, exclude_id: Optional[int] = None,
+                   procedimiento_id: Optional[int] = None, cursor=None) -> List[dict]:
+        """Procedimientos activos que se cruzan con [hora, hora + duracion)"""
+        inicio = a_minutos(hora)
+        fin = inicio + (duracion or DURACION_POR_DEFECTO)
+        return [
+            fila for fila in self.dia(fecha, cursor).solapados(inicio, fin)
+            if (exclude_id is None or fila["id"] != exclude_id)
+            and (procedimiento_id is None or fila["procedimiento_id"] == procedimiento_id)
+        ]
+
+    def huecos(self, fecha, duracion: int, cantidad: int = 5, desde=None, hasta=None,
+               paso: int = 30, cursor=None) -> List[dict]:
+        """
+        Próximos `cantidad` horarios libres de `duracion` minutos dentro de
+        [desde, hasta), probando inicios cada `paso` minutos.
+        """
+        inicio_jornada = a_minutos(desde) if desde is not None else 0
+        fin_jornada = a_minutos(hasta) if hasta is not None else MINUTOS_DIA
+        paso = max(1, paso)
+
+        resultado = []
+        cursor_min = inicio_jornada
+        for ocupado_inicio, ocupado_fin in self.dia(fecha, cursor).ocupados() + [(fin_jornada, fin_jornada)]:
+            if ocupado_fin <= cursor_min:
+                continue
+            limite = min(ocupado_inicio, fin_jornada)
+            # Alinear al paso desde el inicio de la jornada
+            candidato = cursor_min + (-(cursor_min - inicio_jornada)) % paso
+            while candidato + duracion <= limite and len(resultado) < cantidad:
+                resultado.append({
+                    "hora_inicio": a_hora(candidato),
+                    "hora_fin": a_hora(candidato + duracion),
+                })
+                candidato += paso
+            if len(resultado) >= cantidad or ocupado_inicio >= fin_jornada:
+                break
+            cursor_min = max(cursor_min, ocupado_fin)
+        return resultado
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "dias": len(self._dias),
+                "intervalos": sum(len(d.filas) for d in self._dias.values()),
+                "cargas": self.cargas,
+                "aciertos": self.aciertos,
+                "ttl": self.ttl,
+            }
+
+indice_agenda = IndiceAgenda(ttl=settings.AGENDA_INDICE_TTL)
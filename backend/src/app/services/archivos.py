@@ -0,0 +1,103 @@
+"""
+Utilidades de subida de archivos para los endpoints `async`.
+
+Los handlers de upload son `async def`, así que cualquier llamada bloqueante
+(pymysql, escritura en disco, Cloudinary) detendría el event loop y con él
+todas las demás peticiones del worker. Aquí se centraliza:
+
+- un pool de hilos acotado para el trabajo bloqueante (`en_hilo`),
+- la ingesta por bloques del `UploadFile` con límite de tamaño y SHA-256
+  (`ingerir_upload`),
+- un límite de subidas concurrentes al almacenamiento externo (`subir_a_storage`).
+"""
+import asyncio
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.UPLOAD_IO_WORKERS,
+    thread_name_prefix="uploads"
+)
+_semaforo_storage = asyncio.Semaphore(settings.STORAGE_UPLOAD_CONCURRENCIA)
+
+async def en_hilo(func, *args, **kwargs):
+    """Ejecuta `func` en el pool de hilos de uploads sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+async def subir_a_storage(func, *args, **kwargs):
+    """
+    Igual que `en_hilo`, pero limitado a STORAGE_UPLOAD_CONCURRENCIA subidas
+    simultáneas (p. ej. `cloudinary.uploader.upload`). Las demás esperan en el
+    event loop sin ocupar hilos del pool.
+    """
+    async with _semaforo_storage:
+        return await en_hilo(func, *args, **kwargs)
+
+class ArchivoDemasiadoGrande(ValueError):
+    """El archivo superó el límite de tamaño durante la ingesta"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"El archivo supera el máximo de {max_bytes // (1024 * 1024)}MB")
+
+class ArchivoIngerido:
+    """Resultado de `ingerir_upload`: tamaño, SHA-256 y ruta final (si se escribió a disco)"""
+    __slots__ = ("size", "sha256", "path")
+
+    def __init__(self, size: int, sha256: str, path: Optional[str]):
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+
+def _ingerir(origen, destino: Optional[str], max_bytes: int, chunk_size: int) -> ArchivoIngerido:
+    origen.seek(0)
+    digest = hashlib.sha256()
+    total = 0
+    salida = open(destino, "wb") if destino else None
+    try:
+        while True:
+            bloque = origen.read(chunk_size)
+            if not bloque:
+                break
+            total += len(bloque)
+            if total > max_bytes:
+                raise ArchivoDemasiadoGrande(max_bytes)
+            digest.update(bloque)
+            if salida:
+                salida.write(bloque)
+    except Exception:
+        if salida:
+            salida.close()
+            salida = None
+            if os.path.exists(destino):
+                os.remove(destino)
+        raise
+    finally:
+        if salida:
+            salida.close()
+    return ArchivoIngerido(total, digest.hexdigest(), destino)
+
+async def ingerir_upload(file: UploadFile, max_bytes: int, destino: Optional[str] = None) -> ArchivoIngerido:
+    """
+    Etapa de ingesta común a todos los uploads.
+
+    Lee el `UploadFile` en bloques de UPLOAD_CHUNK_SIZE bytes en el pool de
+    hilos, calculando el SHA-256 sobre la marcha, y aborta con
+    `ArchivoDemasiadoGrande` apenas se supera `max_bytes` (sin leer el resto).
+    Con `destino` cada bloque se escribe directamente en la ruta final, sin
+    archivo temporal intermedio; si la ingesta falla no queda nada a medias.
+    Al terminar, el stream queda listo para releerse (p. ej. para Cloudinary).
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise ArchivoDemasiadoGrande(max_bytes)
+    resultado = await en_hilo(_ingerir, file.file, destino, max_bytes, settings.UPLOAD_CHUNK_SIZE)
+    await en_hilo(file.file.seek, 0)
+    return resultado
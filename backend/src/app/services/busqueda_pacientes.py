@@ -0,0 +1,319 @@
+"""
+Índice de búsqueda de pacientes en memoria.
+
+Reemplaza el `LIKE '%q%'` sobre `paciente` (que no puede usar índices) por un
+índice de prefijos construido al iniciar la app y actualizado en cada alta,
+edición y borrado de pacientes. Soporta prefijos de nombre/apellido sin
+tildes ni mayúsculas y prefijos de número de documento, con resultados
+ordenados por relevancia.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import get_connection
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+CAMPOS_PACIENTE = (
+    "id", "nombre", "apellido", "numero_documento",
+    "telefono", "email", "fecha_nacimiento",
+)
+
+def normalizar(texto) -> str:
+    """Minúsculas y sin tildes: 'Martínez' -> 'martinez'"""
+    if not texto:
+        return ""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+def tokenizar(texto) -> List[str]:
+    return _TOKEN_RE.findall(normalizar(texto))
+
+def _normalizar_documento(documento) -> str:
+    return "".join(tokenizar(documento))
+
+def _calcular_edad(fecha_nacimiento) -> Optional[int]:
+    if not isinstance(fecha_nacimiento, date):
+        return None
+    hoy = date.today()
+    return hoy.year - fecha_nacimiento.year - (
+        (hoy.month, hoy.day) < (fecha_nacimiento.month, fecha_nacimiento.day)
+    )
+
+class _IndicePrefijos:
+    """Lista ordenada de claves + mapa clave -> ids, para búsquedas por prefijo con bisect"""
+
+    def __init__(self):
+        self.claves: List[str] = []
+        self.ids: Dict[str, set] = {}
+
+    def agregar(self, clave: str, paciente_id: int):
+        ids = self.ids.get(clave)
+        if ids is None:
+            self.ids[clave] = {paciente_id}
+            insort(self.claves, clave)
+        else:
+            ids.add(paciente_id)
+
+    def quitar(self, clave: str, paciente_id: int):
+        ids = self.ids.get(clave)
+        if ids is None:
+            return
+        ids.discard(paciente_id)
+        if not ids:
+            del self.ids[clave]
+            pos = bisect_left(self.claves, clave)
+            if pos < len(self.claves) and self.claves[pos] == clave:
+                self.claves.pop(pos)
+
+    def prefijo(self, prefijo: str):
+        """Genera (clave, ids) de todas las claves que empiezan por `prefijo`"""
+        pos = bisect_left(self.claves, prefijo)
+        while pos < len(self.claves) and self.claves[pos].startswith(prefijo):
+            clave = self.claves[pos]
+            yield clave, self.ids[clave]
+            pos += 1
+
+class IndicePacientes:
+    """Índice invertido por prefijos de nombre, apellido y documento"""
+
+    def __init__(self, refresco: float = 300.0):
+        self.refresco = refresco
+        self._lock = threading.RLock()
+        self._reconstruyendo = False
+        # Una lista por reconstrucción en curso con los cambios llegados mientras
+        # tanto, para reaplicarlos sobre el índice nuevo antes del reemplazo
+        self._pendientes: List[list] = []
+        self._reset()
+
+    def _reset(self):
+        self._pacientes: Dict[int, dict] = {}
+        self._tokens: Dict[int, tuple] = {}
+        self._nombres = _IndicePrefijos()
+        self._documentos = _IndicePrefijos()
+        self.construido_en: Optional[float] = None
+
+    # ---------- carga ----------
+
+    def construir(self):
+        """
+        Carga todos los pacientes desde MySQL y reemplaza el índice de forma
+        atómica. Las altas, ediciones y borrados que llegan mientras se lee se
+        anotan y se reaplican sobre el índice nuevo, para que el reemplazo no
+        los pise con la foto anterior.
+        """
+        inicio = time.perf_counter()
+        pendientes: list = []
+        with self._lock:
+            self._pendientes.append(pendientes)
+        try:
+            conn = get_connection()
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SELECT {', '.join(CAMPOS_PACIENTE)} FROM paciente")
+                    filas = cursor.fetchall()
+
+            nuevo = IndicePacientes(self.refresco)
+            for fila in filas:
+                nuevo._agregar(fila)
+        except Exception:
+            with self._lock:
+                self._pendientes.remove(pendientes)
+            raise
+
+        with self._lock:
+            self._pendientes.remove(pendientes)
+            # Son idempotentes: reaplicar uno que ya estaba en la foto no cambia nada
+            for operacion, args in pendientes:
+                operacion(nuevo, *args)
+            self._pacientes = nuevo._pacientes
+            self._tokens = nuevo._tokens
+            self._nombres = nuevo._nombres
+            self._documentos = nuevo._documentos
+            self.construido_en = time.time()
+
+        duracion = (time.perf_counter() - inicio) * 1000
+        print(f"🔎 Índice de pacientes construido: {len(filas)} pacientes en {duracion:.1f} ms")
+        return len(filas)
+
+    @property
+    def listo(self) -> bool:
+        return self.construido_en is not None
+
+    def _refrescar_si_vencido(self):
+        """Reconstruye en segundo plano si el índice es más viejo que `refresco`.
+
+        Con varios workers cada proceso tiene su propio índice; la reconstrucción
+        periódica recoge los cambios hechos por los demás procesos.
+        """
+        if not self.listo or self.refresco <= 0:
+            return
+        if time.time() - self.construido_en < self.refresco:
+            return
+        with self._lock:
+            if self._reconstruyendo:
+                return
+            self._reconstruyendo = True
+
+        def _tarea():
+            try:
+                self.construir()
+            except Exception as e:
+                print(f"⚠️ Error reconstruyendo índice de pacientes: {e}")
+            finally:
+                self._reconstruyendo = False
+
+        threading.Thread(target=_tarea, daemon=True).start()
+
+    # ---------- mantenimiento incremental ----------
+
+    def _agregar(self, paciente: dict):
+        pid = paciente["id"]
+        registro = {campo: paciente.get(campo) for campo in CAMPOS_PACIENTE}
+        tokens = tuple(dict.fromkeys(
+            tokenizar(registro["nombre"]) + tokenizar(registro["apellido"])
+        ))
+        documento = _normalizar_documento(registro["numero_documento"])
+
+        registro["_nombre_norm"] = normalizar(registro["nombre"])
+        registro["_apellido_norm"] = normalizar(registro["apellido"])
+        registro["_documento_norm"] = documento
+        self._pacientes[pid] = registro
+        self._tokens[pid] = tokens
+        for token in tokens:
+            self._nombres.agregar(token, pid)
+        if documento:
+            self._documentos.agregar(documento, pid)
+
+    def _quitar(self, paciente_id: int):
+        registro = self._pacientes.pop(paciente_id, None)
+        if registro is None:
+            return
+        for token in self._tokens.pop(paciente_id, ()):
+            self._nombres.quitar(token, paciente_id)
+        if registro["_documento_norm"]:
+            self._documentos.quitar(registro["_documento_norm"], paciente_id)
+
+    def _upsert(self, paciente: dict):
+        self._quitar(paciente["id"])
+        self._agregar(paciente)
+
+    def _actualizar(self, paciente_id: int, campos: dict):
+        actual = self._pacientes.get(paciente_id)
+        if actual is None:
+            return
+        fusion = {campo: actual.get(campo) for campo in CAMPOS_PACIENTE}
+        fusion.update({k: v for k, v in campos.items() if k in fusion and v is not None})
+        self._quitar(paciente_id)
+        self._agregar(fusion)
+
+    def _aplicar(self, operacion, *args):
+        """Aplica un cambio y lo anota para las reconstrucciones en curso"""
+        with self._lock:
+            for pendientes in self._pendientes:
+                pendientes.append((operacion, args))
+            if self.listo:
+                operacion(self, *args)
+
+    def upsert(self, paciente: dict):
+        """Agrega o reemplaza un paciente completo (tras crear)"""
+        self._aplicar(IndicePacientes._upsert, paciente)
+
+    def actualizar(self, paciente_id: int, campos: dict):
+        """Aplica una edición parcial (sólo los campos no nulos, como en el UPDATE)"""
+        self._aplicar(IndicePacientes._actualizar, paciente_id, dict(campos))
+
+    def eliminar(self, paciente_id: int):
+        self._aplicar(IndicePacientes._quitar, paciente_id)
+
+    # ---------- consulta ----------
+
+    def buscar(self, q: str, limit: int = 10) -> List[dict]:
+        """
+        Busca pacientes cuyo nombre/apellido tenga tokens que empiecen por cada
+        término de `q` (todos los términos deben coincidir) o cuyo documento
+        empiece por `q`. Ordena por relevancia y luego por nombre, apellido.
+        """
+        self._refrescar_si_vencido()
+        terminos = tokenizar(q)
+        documento_q = _normalizar_documento(q)
+
+        with self._lock:
+            if not terminos:
+                mejores = heapq.nsmallest(
+                    limit, self._pacientes.values(),
+                    key=lambda r: (r["_nombre_norm"], r["_apellido_norm"])
+                )
+                return [self._formatear(r) for r in mejores]
+
+            puntajes: Dict[int, float] = {}
+
+            # Coincidencias por documento (prefijo del número completo)
+            for clave, ids in self._documentos.prefijo(documento_q):
+                puntos = 100.0 if clave == documento_q else 50.0
+                for pid in ids:
+                    puntajes[pid] = max(puntajes.get(pid, 0.0), puntos)
+
+            # Coincidencias por nombre: intersección de términos
+            candidatos = None
+            por_termino: Dict[int, float] = {}
+            for termino in terminos:
+                coincidencias = set()
+                for clave, ids in self._nombres.prefijo(termino):
+                    puntos = 3.0 if clave == termino else 2.0
+                    for pid in ids:
+                        coincidencias.add(pid)
+                        por_termino[pid] = por_termino.get(pid, 0.0) + puntos
+                candidatos = coincidencias if candidatos is None else candidatos & coincidencias
+                if not candidatos:
+                    break
+
+            for pid in candidatos or ():
+                registro = self._pacientes[pid]
+                puntos = por_termino[pid]
+                # Bonificación si el primer término abre el nombre o el apellido
+                if registro["_nombre_norm"].startswith(terminos[0]) or \
+                        registro["_apellido_norm"].startswith(terminos[0]):
+                    puntos += 1.0
+                puntajes[pid] = max(puntajes.get(pid, 0.0), puntos)
+
+            mejores = heapq.nsmallest(
+                limit, puntajes.items(),
+                key=lambda item: (
+                    -item[1],
+                    self._pacientes[item[0]]["_nombre_norm"],
+                    self._pacientes[item[0]]["_apellido_norm"],
+                )
+            )
+            return [self._formatear(self._pacientes[pid]) for pid, _ in mejores]
+
+    @staticmethod
+    def _formatear(registro: dict) -> dict:
+        return {
+            "id": registro["id"],
+            "nombre_completo": f"{registro['nombre'] or ''} {registro['apellido'] or ''}".strip(),
+            "documento": registro["numero_documento"],
+            "telefono": registro["telefono"],
+            "email": registro["email"],
+            "fecha_nacimiento": registro["fecha_nacimiento"],
+            "edad": _calcular_edad(registro["fecha_nacimiento"]),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "listo": self.listo,
+                "pacientes": len(self._pacientes),
+                "tokens_nombre": len(self._nombres.claves),
+                "documentos": len(self._documentos.claves),
+                "construido_en": self.construido_en,
+            }
+
+indice_pacientes = IndicePacientes(refresco=settings.PACIENTES_INDICE_REFRESCO)
@@ -0,0 +1,289 @@
+"""
+Calendario mensual de la agenda de procedimientos materializado en memoria.
+
+Cada (año, mes) se carga una vez y se guarda como tuplas compactas por id
+(`_FILA`). Cuando cambia una fila de `agenda_procedimientos` sólo se relee
+esa fila y se parcha el mes (o los dos meses, si cambió de fecha) en lugar
+de reconstruirlo.
+
+Cada cambio recibe un número de versión global y queda en un registro
+acotado por mes, de modo que el cliente puede pedir sólo lo que cambió desde
+la versión que ya tiene (`cambios_desde`). Si esa versión es más vieja que el
+registro se responde el mes completo.
+
+Con varios workers cada proceso tiene su propio cache: al vencer el TTL el
+mes se relee y se compara con lo guardado, y las diferencias entran al
+registro como cambios normales, así los deltas siguen siendo válidos.
+
+El nombre del paciente y el nombre y precio del procedimiento se copian en
+cada fila. `update_paciente` y `update_procedimiento` llaman a `vencer`, que
+marca todos los meses cargados para reconciliarlos en la próxima lectura: los
+cambios de etiqueta entran al registro como cualquier otro.
+
+Se guardan a lo sumo `max_meses` meses: al cargar uno más se descarta el
+usado hace más tiempo (LRU), así recorrer años de calendario no hace crecer
+la memoria sin límite.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import get_connection
+from app.services.agenda_indice import a_hora, a_minutos
+
+_FILA = ("id", "fecha", "hora", "estado", "duracion", "paciente", "procedimiento", "precio")
+
+_SELECT = """
+    SELECT
+        ap.id,
+        ap.fecha,
+        ap.hora,
+        ap.estado,
+        ap.duracion,
+        p.nombre as paciente_nombre,
+        p.apellido as paciente_apellido,
+        proc.nombre as procedimiento_nombre,
+        proc.precio as procedimiento_precio
+    FROM agenda_procedimientos ap
+    JOIN paciente p ON ap.numero_documento = p.numero_documento
+    JOIN procedimiento proc ON ap.procedimiento_id = proc.id
+"""
+
+def _compactar(proc: dict) -> tuple:
+    minutos = a_minutos(proc['hora'])
+    return (
+        proc['id'],
+        str(proc['fecha']),
+        a_hora(minutos) if minutos is not None else None,
+        proc['estado'],
+        proc['duracion'],
+        f"{proc['paciente_nombre']} {proc['paciente_apellido']}",
+        proc['procedimiento_nombre'],
+        proc['procedimiento_precio'],
+    )
+
+def _expandir(fila: tuple) -> dict:
+    registro = dict(zip(_FILA, fila))
+    del registro["fecha"]
+    return registro
+
+def _clave_mes(fecha) -> Tuple[int, int]:
+    if isinstance(fecha, str):
+        fecha = date.fromisoformat(fecha[:10])
+    return fecha.year, fecha.month
+
+class _Mes:
+    __slots__ = ("filas", "version", "minima", "registro", "max_registro", "cargado_en", "_vista")
+
+    def __init__(self, filas: Dict[int, tuple], version: int, max_registro: int, cargado_en: float):
+        self.filas = filas
+        self.version = version
+        # Versión más vieja desde la que se puede armar un delta
+        self.minima = version
+        # (version, id) de cada cambio; la fila actual se lee de `filas`
+        self.registro: deque = deque()
+        self.max_registro = max_registro
+        # Momento en que empezó la lectura de la que salen las filas
+        self.cargado_en = cargado_en
+        self._vista: Optional[dict] = None
+
+    def aplicar(self, procedimiento_id: int, fila: Optional[tuple], version: int):
+        if fila is None:
+            self.filas.pop(procedimiento_id, None)
+        else:
+            self.filas[procedimiento_id] = fila
+        self.version = version
+        self.registro.append((version, procedimiento_id))
+        if len(self.registro) > self.max_registro:
+            self.minima = self.registro.popleft()[0]
+        self._vista = None
+
+    def vista(self) -> dict:
+        """Estructura agrupada por fecha (la que devuelve el endpoint), memorizada"""
+        if self._vista is None:
+            calendario: Dict[str, List[dict]] = {}
+            for fila in sorted(self.filas.values(), key=lambda f: (f[1], f[2] or "", f[0])):
+                calendario.setdefault(fila[1], []).append(_expandir(fila))
+            self._vista = calendario
+        return self._vista
+
+class CalendarioCache:
+
+    def __init__(self, ttl: float = 300.0, max_registro: int = 500, max_meses: int = 36):
+        self.ttl = ttl
+        self.max_registro = max_registro
+        self.max_meses = max_meses
+        # Del menos al más usado recientemente
+        self._meses: "OrderedDict[Tuple[int, int], _Mes]" = OrderedDict()
+        self._lock = threading.RLock()
+        # Arranca en milisegundos para que versiones de otro proceso no caigan en el rango de éste
+        self._versiones = itertools.count(int(time.time() * 1000))
+        self.cargas = 0
+        self.parches = 0
+        self.descartes = 0
+        # Los meses leídos antes de esto se reconcilian en la próxima lectura
+        self._vencidos_en = float("-inf")
+
+    # ---------- carga ----------
+
+    def _leer_mes(self, year: int, month: int) -> Dict[int, tuple]:
+        fecha_inicio = date(year, month, 1)
+        fecha_fin = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_SELECT + """
+                    WHERE ap.fecha >= %s AND ap.fecha < %s
+                """, (fecha_inicio, fecha_fin))
+                return {proc['id']: _compactar(proc) for proc in cursor.fetchall()}
+
+    def _mes(self, year: int, month: int) -> _Mes:
+        clave = (year, month)
+        with self._lock:
+            mes = self._meses.get(clave)
+            if mes is not None and self._vigente(mes):
+                self._meses.move_to_end(clave)
+                return mes
+
+        inicio = time.monotonic()
+        filas = self._leer_mes(year, month)
+        with self._lock:
+            self.cargas += 1
+            mes = self._meses.get(clave)
+            if mes is None:
+                mes = self._meses[clave] = _Mes(filas, next(self._versiones), self.max_registro, inicio)
+                while len(self._meses) > self.max_meses:
+                    self._meses.popitem(last=False)
+                    self.descartes += 1
+                return mes
+            self._meses.move_to_end(clave)
+            # Reconciliar: registrar como cambios las diferencias con lo leído
+            for procedimiento_id in set(mes.filas) | set(filas):
+                nueva = filas.get(procedimiento_id)
+                if mes.filas.get(procedimiento_id) != nueva:
+                    mes.aplicar(procedimiento_id, nueva, next(self._versiones))
+            mes.cargado_en = inicio
+            return mes
+
+    def _vigente(self, mes: _Mes) -> bool:
+        if mes.cargado_en <= self._vencidos_en:
+            return False
+        return self.ttl <= 0 or time.monotonic() - mes.cargado_en < self.ttl
+
+    # ---------- parches ----------
+
+    def refrescar_fila(self, procedimiento_id: int, cursor=None):
+        """Relee una fila tras crearla o editarla y parcha los meses cargados"""
+        query = _SELECT + " WHERE ap.id = %s"
+        try:
+            if cursor is not None:
+                cursor.execute(query, (procedimiento_id,))
+                proc = cursor.fetchone()
+            else:
+                conn = get_connection()
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(query, (procedimiento_id,))
+                        proc = cur.fetchone()
+        except Exception as e:
+            # El cambio ya está confirmado: ante la duda se descarta el cache
+            print(f"⚠️ No se pudo releer el procedimiento {procedimiento_id} para el calendario: {e}")
+            self.limpiar()
+            return
+
+        fila = _compactar(proc) if proc else None
+        destino = _clave_mes(fila[1]) if fila else None
+        with self._lock:
+            for clave, mes in self._meses.items():
+                if clave != destino and procedimiento_id in mes.filas:
+                    mes.aplicar(procedimiento_id, None, next(self._versiones))
+            mes = self._meses.get(destino) if destino else None
+            if mes is not None and mes.filas.get(procedimiento_id) != fila:
+                mes.aplicar(procedimiento_id, fila, next(self._versiones))
+            self.parches += 1
+
+    def quitar(self, procedimiento_id: int):
+        """Saca una fila borrada de los meses cargados"""
+        with self._lock:
+            for mes in self._meses.values():
+                if procedimiento_id in mes.filas:
+                    mes.aplicar(procedimiento_id, None, next(self._versiones))
+            self.parches += 1
+
+    # ---------- lectura ----------
+
+    def calendario(self, year: int, month: int) -> dict:
+        mes = self._mes(year, month)
+        with self._lock:
+            return self._completo(year, month, mes)
+
+    @staticmethod
+    def _completo(year: int, month: int, mes: _Mes) -> dict:
+        return {
+            "year": year,
+            "month": month,
+            "version": mes.version,
+            "delta": False,
+            "procedimientos": mes.vista(),
+            "total": len(mes.filas),
+        }
+
+    def cambios_desde(self, year: int, month: int, version: int) -> dict:
+        """
+        Filas cambiadas después de `version`. Si el registro ya no alcanza
+        esa versión (o es de otro proceso) devuelve el mes completo.
+        """
+        mes = self._mes(year, month)
+        with self._lock:
+            if not mes.minima <= version <= mes.version:
+                return self._completo(year, month, mes)
+
+            actualizados: Dict[int, dict] = {}
+            eliminados = []
+            for cambio_version, procedimiento_id in mes.registro:
+                if cambio_version <= version or procedimiento_id in actualizados or procedimiento_id in eliminados:
+                    continue
+                fila = mes.filas.get(procedimiento_id)
+                if fila is None:
+                    eliminados.append(procedimiento_id)
+                else:
+                    actualizados[procedimiento_id] = {"fecha": fila[1], **_expandir(fila)}
+            return {
+                "year": year,
+                "month": month,
+                "version": mes.version,
+                "delta": True,
+                "desde_version": version,
+                "actualizados": list(actualizados.values()),
+                "eliminados": eliminados,
+                "total": len(mes.filas),
+            }
+
+    def vencer(self):
+        """Reconciliar todos los meses en su próxima lectura (cambió una etiqueta copiada en las filas)"""
+        with self._lock:
+            self._vencidos_en = time.monotonic()
+
+    def limpiar(self):
+        with self._lock:
+            self._meses.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "meses": len(self._meses),
+                "filas": sum(len(m.filas) for m in self._meses.values()),
+                "cargas": self.cargas,
+                "parches": self.parches,
+                "descartes": self.descartes,
+                "max_meses": self.max_meses,
+                "ttl": self.ttl,
+            }
+
+calendario_cache = CalendarioCache(
+    ttl=settings.CALENDARIO_CACHE_TTL, max_meses=settings.CALENDARIO_CACHE_MESES
+)
@@ -0,0 +1,324 @@
+"""
+Contadores del dashboard en memoria.
+
+`get_quick_counts` y `get_estadisticas_sala_espera` se consultan por polling
+y cada llamada recorría `paciente`, `cita` y `sala_espera` con `COUNT(*)` y
+filtros `DATE()`. Aquí los agregados se mantienen de forma incremental:
+
+- las rutas que escriben pacientes, citas o la sala de espera avisan después
+  del commit (`paciente_creado`, `refrescar_cita`, `refrescar_sala_espera`...);
+  las citas y la sala se releen por llave y se aplica la diferencia contra la
+  fila que se tenía, así una edición nunca cuenta dos veces.
+- `snapshot_*` sólo arma diccionarios a partir de los agregados: O(1).
+- una reconciliación completa contra la base de datos corre al primer uso,
+  al cambiar el día, si un aviso falló, y en segundo plano cada
+  `CONTADORES_RECONCILIACION` segundos (recoge lo que escriben otros workers).
+
+Los tiempos promedio dependen de la hora actual; se guarda la suma de las
+marcas de tiempo por grupo y el promedio se calcula al leer como
+`ahora - suma / cantidad`.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.core.database import get_connection
+from app.utils.helpers import rango_dia
+
+ESTADO_CITA_COMPLETADA = 3
+
+# nombre en estado_sala_espera -> clave en la respuesta de estadísticas
+CLAVES_SALA = {
+    "pendiente": "pendientes",
+    "llegada": "llegadas",
+    "confirmada": "confirmadas",
+    "en_consulta": "en_consulta",
+    "completada": "completadas",
+    "no_asistio": "no_asistieron",
+}
+
+_SELECT_SALA = """
+    SELECT se.id, se.paciente_id, COALESCE(ese.nombre, 'pendiente') as estado, se.fecha_hora_ingreso
+    FROM sala_espera se
+    LEFT JOIN estado_sala_espera ese ON se.estado_id = ese.id
+    WHERE se.fecha_hora_ingreso >= %s AND se.fecha_hora_ingreso < %s
+"""
+
+def _ts(valor) -> Optional[float]:
+    return valor.timestamp() if isinstance(valor, datetime) else None
+
+class _Estado:
+    """Agregados de un día; se reemplaza completo al reconciliar"""
+
+    def __init__(self, dia: date):
+        self.dia = dia
+        self.pacientes_total = 0
+        # cita_id -> (paciente_id, ts, estado_id), sólo citas de `dia`
+        self.citas: Dict[int, tuple] = {}
+        self.pacientes_con_cita: Counter = Counter()
+        self.completadas = [0, 0.0]
+        # sala_espera.id -> (paciente_id, estado, ts), sólo registros de `dia`
+        self.sala: Dict[int, tuple] = {}
+        self.sala_por_estado: Dict[str, list] = {}
+        self.sala_total = [0, 0.0]
+
+    def sumar_cita(self, cita: tuple, signo: int):
+        paciente_id, ts, estado_id = cita
+        self.pacientes_con_cita[paciente_id] += signo
+        if self.pacientes_con_cita[paciente_id] <= 0:
+            del self.pacientes_con_cita[paciente_id]
+        if estado_id == ESTADO_CITA_COMPLETADA and ts is not None:
+            self.completadas[0] += signo
+            self.completadas[1] += signo * ts
+
+    def poner_cita(self, cita_id: int, cita: Optional[tuple]):
+        anterior = self.citas.pop(cita_id, None)
+        if anterior is not None:
+            self.sumar_cita(anterior, -1)
+        if cita is not None:
+            self.citas[cita_id] = cita
+            self.sumar_cita(cita, 1)
+
+    def sumar_sala(self, registro: tuple, signo: int):
+        _, estado, ts = registro
+        grupo = self.sala_por_estado.setdefault(estado, [0, 0.0])
+        grupo[0] += signo
+        self.sala_total[0] += signo
+        if ts is not None:
+            grupo[1] += signo * ts
+            self.sala_total[1] += signo * ts
+        if grupo[0] <= 0:
+            del self.sala_por_estado[estado]
+
+    def poner_sala(self, registro_id: int, registro: Optional[tuple]):
+        anterior = self.sala.pop(registro_id, None)
+        if anterior is not None:
+            self.sumar_sala(anterior, -1)
+        if registro is not None:
+            self.sala[registro_id] = registro
+            self.sumar_sala(registro, 1)
+
+class ContadoresDashboard:
+
+    def __init__(self, reconciliacion: float = 300.0):
+        self.reconciliacion = reconciliacion
+        self._lock = threading.RLock()
+        self._estado: Optional[_Estado] = None
+        self._reconciliado_en: Optional[float] = None
+        self._reconciliando = False
+        self._sucio = False
+        self.avisos = 0
+        self.reconciliaciones = 0
+
+    # ---------- reconciliación ----------
+
+    def reconciliar(self):
+        """Recalcula todos los agregados del día desde MySQL y los reemplaza de forma atómica"""
+        inicio = time.perf_counter()
+        dia = date.today()
+        desde, hasta = rango_dia(dia)
+        nuevo = _Estado(dia)
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) as total FROM paciente")
+                nuevo.pacientes_total = cursor.fetchone()['total']
+
+                cursor.execute("""
+                    SELECT id, paciente_id, fecha_hora, estado_id FROM cita
+                    WHERE fecha_hora >= %s AND fecha_hora < %s
+                """, (desde, hasta))
+                for cita in cursor.fetchall():
+                    nuevo.poner_cita(cita['id'], (cita['paciente_id'], _ts(cita['fecha_hora']), cita['estado_id']))
+
+                cursor.execute(_SELECT_SALA, (desde, hasta))
+                for registro in cursor.fetchall():
+                    nuevo.poner_sala(registro['id'], (
+                        registro['paciente_id'], registro['estado'], _ts(registro['fecha_hora_ingreso'])
+                    ))
+
+        with self._lock:
+            self._estado = nuevo
+            self._reconciliado_en = time.time()
+            self._sucio = False
+            self.reconciliaciones += 1
+
+        duracion = (time.perf_counter() - inicio) * 1000
+        print(f"📊 Contadores del dashboard reconciliados en {duracion:.1f} ms")
+
+    def _vigente(self) -> _Estado:
+        """Estado del día, reconciliando en línea si hace falta y en segundo plano si venció"""
+        with self._lock:
+            estado = self._estado
+            necesita = estado is None or self._sucio or estado.dia != date.today()
+        if necesita:
+            self.reconciliar()
+            with self._lock:
+                return self._estado
+
+        if self.reconciliacion > 0 and time.time() - self._reconciliado_en >= self.reconciliacion:
+            with self._lock:
+                lanzar = not self._reconciliando
+                self._reconciliando = True
+            if lanzar:
+                def _tarea():
+                    try:
+                        self.reconciliar()
+                    except Exception as e:
+                        print(f"⚠️ Error reconciliando contadores del dashboard: {e}")
+                    finally:
+                        self._reconciliando = False
+
+                threading.Thread(target=_tarea, daemon=True).start()
+        return estado
+
+    def _aviso(self, aplicar):
+        """Aplica un cambio incremental; si falla, la próxima lectura reconcilia"""
+        try:
+            with self._lock:
+                if self._estado is None:
+                    return
+                aplicar(self._estado)
+                self.avisos += 1
+        except Exception as e:
+            self._marcar_sucio(e)
+
+    def _marcar_sucio(self, e: Exception):
+        print(f"⚠️ Contadores del dashboard desincronizados, se reconciliarán: {e}")
+        with self._lock:
+            self._sucio = True
+
+    # ---------- avisos de escritura ----------
+
+    def paciente_creado(self, cantidad: int = 1):
+        def aplicar(estado: _Estado):
+            estado.pacientes_total += cantidad
+        self._aviso(aplicar)
+
+    def paciente_eliminado(self, paciente_id: int):
+        """El borrado de un paciente también borra sus citas"""
+        def aplicar(estado: _Estado):
+            estado.pacientes_total -= 1
+            for cita_id in [i for i, c in estado.citas.items() if c[0] == paciente_id]:
+                estado.poner_cita(cita_id, None)
+            for registro_id in [i for i, r in estado.sala.items() if r[0] == paciente_id]:
+                estado.poner_sala(registro_id, None)
+        self._aviso(aplicar)
+
+    def refrescar_cita(self, cursor, cita_id: int):
+        """Relee una cita por id tras crearla, editarla o borrarla"""
+        if self._estado is None:
+            return
+        try:
+            cursor.execute(
+                "SELECT paciente_id, fecha_hora, estado_id FROM cita WHERE id = %s", (cita_id,)
+            )
+            cita = cursor.fetchone()
+        except Exception as e:
+            self._marcar_sucio(e)
+            return
+
+        def aplicar(estado: _Estado):
+            if cita and isinstance(cita['fecha_hora'], datetime) and cita['fecha_hora'].date() == estado.dia:
+                estado.poner_cita(cita_id, (cita['paciente_id'], _ts(cita['fecha_hora']), cita['estado_id']))
+            else:
+                estado.poner_cita(cita_id, None)
+        self._aviso(aplicar)
+
+    def refrescar_sala_espera(self, cursor, paciente_ids: Optional[Iterable[int]] = None):
+        """
+        Relee los registros de hoy de la sala de espera de `paciente_ids`
+        (o todos, si es None) y aplica las diferencias.
+        """
+        if self._estado is None:
+            return
+        desde, hasta = rango_dia(self._estado.dia)
+        try:
+            if paciente_ids is None:
+                cursor.execute(_SELECT_SALA, (desde, hasta))
+            else:
+                paciente_ids = list(paciente_ids)
+                if not paciente_ids:
+                    return
+                marcadores = ", ".join(["%s"] * len(paciente_ids))
+                cursor.execute(
+                    _SELECT_SALA + f" AND se.paciente_id IN ({marcadores})",
+                    [desde, hasta] + paciente_ids
+                )
+            registros = cursor.fetchall()
+        except Exception as e:
+            self._marcar_sucio(e)
+            return
+
+        def aplicar(estado: _Estado):
+            vistos = set()
+            for registro in registros:
+                vistos.add(registro['id'])
+                estado.poner_sala(registro['id'], (
+                    registro['paciente_id'], registro['estado'], _ts(registro['fecha_hora_ingreso'])
+                ))
+            alcance = None if paciente_ids is None else set(paciente_ids)
+            for registro_id in [
+                i for i, r in estado.sala.items()
+                if i not in vistos and (alcance is None or r[0] in alcance)
+            ]:
+                estado.poner_sala(registro_id, None)
+        self._aviso(aplicar)
+
+    # ---------- lectura ----------
+
+    def snapshot_quick_counts(self) -> dict:
+        estado = self._vigente()
+        with self._lock:
+            return {
+                "pacientes_total": estado.pacientes_total,
+                "citas_hoy": len(estado.citas),
+            }
+
+    def snapshot_sala_espera(self) -> dict:
+        estado = self._vigente()
+        ahora = time.time()
+        with self._lock:
+            estadisticas = {
+                'total': estado.pacientes_total,
+                'con_cita_hoy': len(estado.citas),
+                'sin_cita_hoy': max(estado.pacientes_total - len(estado.pacientes_con_cita), 0),
+                'pendientes': 0,
+                'llegadas': 0,
+                'confirmadas': 0,
+                'en_consulta': 0,
+                'completadas': 0,
+                'no_asistieron': 0,
+                'tiempo_promedio_espera': 0,
+                'tiempo_promedio_consulta': 25
+            }
+            for nombre, (cantidad, _) in estado.sala_por_estado.items():
+                clave = CLAVES_SALA.get(nombre)
+                if clave:
+                    estadisticas[clave] = cantidad
+
+            cantidad, suma = estado.sala_total
+            if cantidad > 0:
+                estadisticas['tiempo_promedio_espera'] = round((ahora - suma / cantidad) / 60, 2)
+            cantidad, suma = estado.completadas
+            if cantidad > 0:
+                estadisticas['tiempo_promedio_consulta'] = round((ahora - suma / cantidad) / 60, 2)
+            return {"fecha": estado.dia.isoformat(), "estadisticas": estadisticas}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "listo": self._estado is not None,
+                "dia": self._estado.dia.isoformat() if self._estado else None,
+                "citas_hoy": len(self._estado.citas) if self._estado else 0,
+                "registros_sala": len(self._estado.sala) if self._estado else 0,
+                "avisos": self.avisos,
+                "reconciliaciones": self.reconciliaciones,
+                "reconciliado_en": self._reconciliado_en,
+                "sucio": self._sucio,
+            }
+
+contadores_dashboard = ContadoresDashboard(reconciliacion=settings.CONTADORES_RECONCILIACION)
@@ -0,0 +1,143 @@
+"""
+Exportación masiva en streaming (NDJSON y CSV).
+
+Las filas se leen con un `SSDictCursor` (sin buffer: MySQL las envía a
+medida que se piden) en lotes de `EXPORT_LOTE` con `fetchmany`, y cada lote
+se codifica y se entrega a `StreamingResponse` antes de leer el siguiente.
+La memoria usada es la de un lote, no la de la tabla.
+
+Mientras dura la descarga la conexión queda ocupada con el resultado a
+medias:
+
+- se sube `net_write_timeout` de la sesión para que MySQL no corte a un
+  cliente lento, y se restaura al terminar.
+- si el cliente corta la descarga o hay un error, la conexión se descarta
+  en lugar de volver al pool (devolverla obligaría a leer el resto del
+  resultado antes de poder reutilizarla).
+"""
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import pymysql
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.database import get_connection
+from app.utils import json_codec
+
+TIPOS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+def filtro_fechas(columna: str, desde: Optional[date], hasta: Optional[date]) -> Tuple[str, list]:
+    """
+    `WHERE` por rango de fechas (ambas inclusive) sobre una columna
+    DATETIME/DATE, como rango semiabierto para que use el índice.
+    """
+    if desde and hasta and desde > hasta:
+        raise ValueError("fecha_desde no puede ser posterior a fecha_hasta")
+    condiciones, params = [], []
+    if desde:
+        condiciones.append(f"{columna} >= %s")
+        params.append(desde)
+    if hasta:
+        condiciones.append(f"{columna} < %s")
+        params.append(hasta + timedelta(days=1))
+    return (f"WHERE {' AND '.join(condiciones)}" if condiciones else ""), params
+
+def _basico(valor):
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, timedelta):
+        segundos = int(valor.total_seconds())
+        return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", "replace")
+    return valor
+
+def _lote_ndjson(filas: List[dict]) -> bytes:
+    return "".join(
+        json_codec.dumps({k: _basico(v) for k, v in fila.items()}) + "\n" for fila in filas
+    ).encode("utf-8")
+
+def _lote_csv(filas: List[dict], columnas: Sequence[str]) -> bytes:
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    for fila in filas:
+        escritor.writerow(["" if fila.get(c) is None else _basico(fila.get(c)) for c in columnas])
+    return salida.getvalue().encode("utf-8")
+
+def exportar_filas(query: str, params, formato: str,
+                   detalles: Optional[Callable[[List[dict]], None]] = None,
+                   lote: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Genera el contenido de la exportación por lotes.
+
+    `detalles` recibe cada lote antes de codificarlo (p. ej. para agregar los
+    items de las cotizaciones); debe usar su propia conexión, porque ésta
+    está ocupada con el resultado sin buffer.
+    """
+    lote = lote or settings.EXPORT_LOTE
+    conn = get_connection()
+    completo = False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET SESSION net_write_timeout = %s", (settings.EXPORT_NET_WRITE_TIMEOUT,))
+
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(query, params)
+        columnas = [d[0] for d in cursor.description]
+        if formato == "csv":
+            # BOM para que Excel reconozca UTF-8 (tildes y eñes)
+            yield "\ufeff".encode("utf-8") + _lote_csv([dict(zip(columnas, columnas))], columnas)
+
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            if detalles is not None:
+                detalles(filas)
+            yield _lote_csv(filas, columnas) if formato == "csv" else _lote_ndjson(filas)
+        cursor.close()
+
+        with conn.cursor() as cursor:
+            cursor.execute("SET SESSION net_write_timeout = DEFAULT")
+        completo = True
+    finally:
+        if completo:
+            conn.close()
+        else:
+            conn.discard()
+
+def respuesta_exportacion(query: str, params, formato: str, nombre: str,
+                          detalles: Optional[Callable[[List[dict]], None]] = None) -> StreamingResponse:
+    """
+    `StreamingResponse` con la exportación. El primer lote (o el encabezado
+    CSV) se obtiene antes de responder, así un error en la consulta todavía
+    llega como 500 y no como una descarga cortada.
+    """
+    media_type, extension = TIPOS[formato]
+    contenido = exportar_filas(query, params, formato, detalles)
+    try:
+        primero = next(contenido)
+    except StopIteration:
+        primero = b""
+
+    def cuerpo():
+        yield primero
+        yield from contenido
+
+    return StreamingResponse(
+        cuerpo(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{nombre}_{date.today().isoformat()}.{extension}"',
+            "Cache-Control": "no-store",
+        }
+    )
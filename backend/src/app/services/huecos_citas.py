@@ -0,0 +1,129 @@
+"""
+Búsqueda de horarios libres para citas.
+
+El rango de fechas completo se representa como un bitset por minuto en un
+entero de Python (bit i = minuto i desde las 00:00 del primer día), así que
+cada paso opera sobre todos los días a la vez en lugar de recorrerlos:
+
+- jornada: el patrón de un día laboral se replica con una sola
+  multiplicación por un "peine" con un bit al inicio de cada día laboral.
+- ocupado: los intervalos de citas (ya fusionados) se encienden como rangos.
+- un inicio i admite `duracion` minutos libres si los bits i..i+duracion-1
+  están libres; eso se calcula con AND de desplazamientos que duplican la
+  ventana en cada paso (O(log duracion) operaciones para todo el rango).
+
+Sin dependencias nuevas: los enteros de Python ya operan por palabras de
+máquina, con lo que un mes completo (~45 000 bits) se resuelve en
+microsegundos por doctor.
+"""
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+MINUTOS_DIA = 24 * 60
+
+def _rango(inicio: int, fin: int) -> int:
+    """Bits encendidos en [inicio, fin)"""
+    if fin <= inicio:
+        return 0
+    return ((1 << (fin - inicio)) - 1) << inicio
+
+def fusionar_intervalos(intervalos: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Une intervalos [inicio, fin) solapados o contiguos"""
+    fusionados: List[Tuple[int, int]] = []
+    for inicio, fin in sorted(intervalos):
+        if fusionados and inicio <= fusionados[-1][1]:
+            if fin > fusionados[-1][1]:
+                fusionados[-1] = (fusionados[-1][0], fin)
+        else:
+            fusionados.append((inicio, fin))
+    return fusionados
+
+def _peine(dias: Sequence[date], dias_laborales: Iterable[int]) -> int:
+    """Un bit al inicio de cada día laboral del rango"""
+    laborales = set(dias_laborales)
+    peine = 0
+    for indice, dia in enumerate(dias):
+        if dia.weekday() in laborales:
+            peine |= 1 << (indice * MINUTOS_DIA)
+    return peine
+
+def _ventanas_libres(libre: int, duracion: int) -> int:
+    """Bits i tales que i..i+duracion-1 están todos en `libre`"""
+    ventanas = libre
+    cubierto = 1
+    while cubierto < duracion:
+        paso = min(cubierto, duracion - cubierto)
+        ventanas &= ventanas >> paso
+        cubierto += paso
+    return ventanas
+
+def intervalos_ocupados(citas: Iterable[dict], desde: datetime,
+                        duracion_por_defecto: int = 30) -> List[Tuple[int, int]]:
+    """(fecha_hora, duracion_minutos) de cada cita -> intervalos fusionados en minutos desde `desde`"""
+    intervalos = []
+    for cita in citas:
+        fecha_hora = cita['fecha_hora']
+        if isinstance(fecha_hora, str):
+            fecha_hora = datetime.fromisoformat(fecha_hora.replace('Z', ''))
+        inicio = int((fecha_hora - desde).total_seconds()) // 60
+        intervalos.append((inicio, inicio + (cita.get('duracion_minutos') or duracion_por_defecto)))
+    return fusionar_intervalos(intervalos)
+
+def buscar_huecos(
+    ocupados: List[Tuple[int, int]],
+    fecha_desde: date,
+    fecha_hasta: date,
+    duracion: int,
+    hora_inicio: int,
+    hora_fin: int,
+    dias_laborales: Iterable[int],
+    paso: int = 30,
+    cantidad: int = 20,
+    no_antes_de: Optional[datetime] = None,
+) -> List[dict]:
+    """
+    Primeros `cantidad` inicios libres entre `fecha_desde` y `fecha_hasta`
+    (inclusive) donde caben `duracion` minutos dentro de [hora_inicio, hora_fin)
+    de un día laboral. Los inicios se alinean a `paso` desde `hora_inicio`.
+    `ocupados` son intervalos en minutos desde las 00:00 de `fecha_desde`.
+    """
+    dias = [fecha_desde + timedelta(days=i) for i in range((fecha_hasta - fecha_desde).days + 1)]
+    total_bits = len(dias) * MINUTOS_DIA
+    peine = _peine(dias, dias_laborales)
+    if not peine or duracion <= 0 or hora_fin - hora_inicio < duracion:
+        return []
+
+    jornada = _rango(hora_inicio, hora_fin) * peine
+
+    ocupado = 0
+    for inicio, fin in ocupados:
+        ocupado |= _rango(max(inicio, 0), min(fin, total_bits))
+
+    libre = jornada & ~ocupado
+    if no_antes_de is not None:
+        origen = datetime.combine(fecha_desde, datetime.min.time())
+        corte = int((no_antes_de - origen).total_seconds() + 59) // 60
+        if corte > 0:
+            libre &= ~((1 << min(corte, total_bits)) - 1)
+
+    # Inicios permitidos: alineados al paso y con la cita terminando dentro de la jornada
+    paso = max(1, paso)
+    inicios_dia = 0
+    for minuto in range(hora_inicio, hora_fin - duracion + 1, paso):
+        inicios_dia |= 1 << minuto
+    candidatos = _ventanas_libres(libre, duracion) & (inicios_dia * peine)
+
+    huecos = []
+    while candidatos and len(huecos) < cantidad:
+        bit = candidatos & -candidatos
+        posicion = bit.bit_length() - 1
+        candidatos ^= bit
+        dia, minuto = divmod(posicion, MINUTOS_DIA)
+        inicio = datetime.combine(dias[dia], datetime.min.time()) + timedelta(minutes=minuto)
+        huecos.append({
+            "fecha": dias[dia].isoformat(),
+            "hora_inicio": inicio.strftime('%H:%M'),
+            "hora_fin": (inicio + timedelta(minutes=duracion)).strftime('%H:%M'),
+            "fecha_hora": inicio.isoformat(),
+        })
+    return huecos
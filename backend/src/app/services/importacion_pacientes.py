@@ -0,0 +1,313 @@
+"""
+Importación masiva de pacientes desde CSV o NDJSON.
+
+El archivo se recorre línea a línea (la memoria es la de un lote, no la del
+archivo) y se procesa en lotes de `IMPORT_LOTE` filas:
+
+1. cada fila se valida con `PacienteCreate`, igual que en `create_paciente`;
+2. los documentos del lote se buscan en la base con un solo
+   `SELECT ... WHERE numero_documento IN (...)`; también se rechazan los
+   repetidos dentro del mismo archivo;
+3. las filas válidas se insertan con `executemany`, que pymysql convierte en
+   un `INSERT` de varias filas, y el lote se confirma en su propia
+   transacción. Si el `INSERT` del lote falla (p. ej. otro usuario creó el
+   mismo documento entre el `SELECT` y el `INSERT`) se deshace y el lote se
+   reintenta fila por fila para saber cuáles fallan.
+
+Los lotes ya confirmados quedan guardados aunque un lote posterior falle:
+el reporte dice cuántas filas entraron y por qué se rechazó cada una.
+"""
+import csv
+import io
+from typing import Iterator, List, Optional, Tuple
+
+import pymysql
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.models.schemas.paciente import PacienteCreate
+from app.services.busqueda_pacientes import indice_pacientes
+from app.services.contadores import contadores_dashboard
+from app.utils import json_codec
+
+FORMATOS = ("csv", "ndjson")
+
+COLUMNAS = (
+    "numero_documento", "tipo_documento", "nombre", "apellido",
+    "fecha_nacimiento", "genero", "telefono", "email", "direccion", "ciudad",
+)
+OBLIGATORIAS = ("numero_documento", "nombre", "apellido")
+
+# Sin NOW(): pymysql sólo agrupa en un INSERT multi-fila si todos los
+# valores son parámetros
+INSERT_PACIENTE = f"""
+    INSERT INTO paciente ({", ".join(COLUMNAS)}, fecha_registro)
+    VALUES ({", ".join(["%s"] * (len(COLUMNAS) + 1))})
+"""
+
+class ArchivoInvalido(ValueError):
+    """El archivo no se puede leer como el formato indicado"""
+
+def detectar_formato(nombre_archivo: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Formato según la extensión o el Content-Type de la subida"""
+    nombre = (nombre_archivo or "").lower()
+    tipo = (content_type or "").lower()
+    if nombre.endswith(".csv") or "csv" in tipo:
+        return "csv"
+    if nombre.endswith((".ndjson", ".jsonl")) or "ndjson" in tipo or "jsonl" in tipo:
+        return "ndjson"
+    return None
+
+def _limpiar(valor):
+    # Documentos y teléfonos numéricos en NDJSON se aceptan como texto
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        valor = str(valor)
+    if isinstance(valor, str):
+        valor = valor.strip()
+        return valor or None
+    return valor
+
+def _datos(pares) -> dict:
+    """
+    Campos con valor de una fila. Las celdas vacías se omiten (no se pasan
+    como `None`) para que apliquen los defaults de `PacienteCreate`, como en
+    `create_paciente` (p. ej. `tipo_documento = "CC"`).
+    """
+    datos = {}
+    for columna, valor in pares:
+        valor = _limpiar(valor)
+        if valor is not None:
+            datos[columna] = valor
+    return datos
+
+def _filas_csv(texto) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    lector = csv.reader(texto)
+    encabezado = next(lector, None)
+    if not encabezado:
+        raise ArchivoInvalido("El archivo está vacío")
+    columnas = [c.strip().lower() for c in encabezado]
+    faltantes = [c for c in OBLIGATORIAS if c not in columnas]
+    if faltantes:
+        raise ArchivoInvalido(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+
+    numero = 0
+    for valores in lector:
+        if not any(v.strip() for v in valores):
+            continue
+        numero += 1
+        if len(valores) > len(columnas):
+            yield numero, None, f"La fila tiene {len(valores)} columnas y el encabezado {len(columnas)}"
+            continue
+        yield numero, _datos((c, v) for c, v in zip(columnas, valores) if c in COLUMNAS), None
+
+def _filas_ndjson(texto) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    numero = 0
+    for linea in texto:
+        if not linea.strip():
+            continue
+        numero += 1
+        try:
+            objeto = json_codec.loads(linea)
+        except json_codec.JSONDecodeError:
+            yield numero, None, "JSON inválido"
+            continue
+        if not isinstance(objeto, dict):
+            yield numero, None, "Cada línea debe ser un objeto JSON"
+            continue
+        yield numero, _datos((c, objeto[c]) for c in COLUMNAS if c in objeto), None
+
+def _mensajes(error: ValidationError) -> List[str]:
+    mensajes = []
+    for detalle in error.errors():
+        campo = ".".join(str(p) for p in detalle.get("loc", ()))
+        mensaje = detalle.get("msg", "")
+        if mensaje.startswith("Value error, "):
+            mensaje = mensaje[len("Value error, "):]
+        mensajes.append(f"{campo}: {mensaje}" if campo else mensaje)
+    return mensajes
+
+def _valores(paciente: PacienteCreate, fecha_registro) -> tuple:
+    return tuple(getattr(paciente, c) for c in COLUMNAS) + (fecha_registro,)
+
+class _Reporte:
+
+    def __init__(self, max_errores: int, validar_solo: bool):
+        self.max_errores = max_errores
+        self.validar_solo = validar_solo
+        self.total_filas = 0
+        self.validos = 0
+        self.insertados = 0
+        self.rechazados = 0
+        self.lotes = 0
+        self.errores: List[dict] = []
+        self.errores_omitidos = 0
+        self.interrumpido: Optional[str] = None
+
+    def rechazar(self, fila: int, numero_documento, errores: List[str]):
+        self.rechazados += 1
+        if len(self.errores) < self.max_errores:
+            self.errores.append({"fila": fila, "numero_documento": numero_documento, "errores": errores})
+        else:
+            self.errores_omitidos += 1
+
+    def a_dict(self) -> dict:
+        return {
+            "total_filas": self.total_filas,
+            "validos": self.validos,
+            "insertados": self.insertados,
+            "rechazados": self.rechazados,
+            "lotes": self.lotes,
+            "validar_solo": self.validar_solo,
+            "interrumpido": self.interrumpido,
+            "errores": sorted(self.errores, key=lambda e: e["fila"]),
+            "errores_omitidos": self.errores_omitidos,
+        }
+
+class ImportadorPacientes:
+    """Procesa un archivo completo sobre una conexión; ver `importar_pacientes`"""
+
+    def __init__(self, conn, lote: int, reporte: _Reporte):
+        self.conn = conn
+        self.lote = max(1, lote)
+        self.reporte = reporte
+        # documento (casefold, como compara MySQL) -> fila donde apareció primero
+        self.vistos = {}
+        self.fecha_registro = None
+
+    def procesar(self, filas: Iterator[Tuple[int, Optional[dict], Optional[str]]]):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT NOW() AS ahora")
+            self.fecha_registro = cursor.fetchone()["ahora"]
+
+        pendientes: List[Tuple[int, PacienteCreate]] = []
+        for numero, datos, error in filas:
+            self.reporte.total_filas += 1
+            if error:
+                self.reporte.rechazar(numero, None, [error])
+                continue
+            try:
+                pendientes.append((numero, PacienteCreate(**datos)))
+            except ValidationError as e:
+                self.reporte.rechazar(numero, datos.get("numero_documento"), _mensajes(e))
+                continue
+            if len(pendientes) >= self.lote:
+                self._procesar_lote(pendientes)
+                pendientes = []
+        if pendientes:
+            self._procesar_lote(pendientes)
+
+    def _procesar_lote(self, pendientes: List[Tuple[int, PacienteCreate]]):
+        self.reporte.lotes += 1
+        documentos = list({p.numero_documento for _, p in pendientes})
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT numero_documento FROM paciente WHERE numero_documento IN ({', '.join(['%s'] * len(documentos))})",
+                documentos
+            )
+            existentes = {fila["numero_documento"].casefold() for fila in cursor.fetchall()}
+
+        validos: List[Tuple[int, PacienteCreate]] = []
+        for numero, paciente in pendientes:
+            clave = paciente.numero_documento.casefold()
+            if clave in existentes:
+                self.reporte.rechazar(numero, paciente.numero_documento, ["El número de documento ya existe"])
+            elif clave in self.vistos:
+                self.reporte.rechazar(numero, paciente.numero_documento, [
+                    f"Documento repetido en el archivo (fila {self.vistos[clave]})"
+                ])
+            else:
+                self.vistos[clave] = numero
+                validos.append((numero, paciente))
+
+        self.reporte.validos += len(validos)
+        if not validos or self.reporte.validar_solo:
+            return
+
+        insertados = self._insertar(validos)
+        if insertados:
+            self.reporte.insertados += len(insertados)
+            contadores_dashboard.paciente_creado(len(insertados))
+            self._actualizar_indice(insertados)
+
+    def _insertar(self, validos: List[Tuple[int, PacienteCreate]]) -> List[PacienteCreate]:
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.executemany(INSERT_PACIENTE, [_valores(p, self.fecha_registro) for _, p in validos])
+            self.conn.commit()
+            return [p for _, p in validos]
+        except (pymysql.err.IntegrityError, pymysql.err.DataError):
+            self.conn.rollback()
+
+        # Fila por fila para aislar las que fallan
+        insertados = []
+        with self.conn.cursor() as cursor:
+            for numero, paciente in validos:
+                try:
+                    cursor.execute(INSERT_PACIENTE, _valores(paciente, self.fecha_registro))
+                    insertados.append(paciente)
+                except pymysql.err.IntegrityError as e:
+                    mensaje = "El número de documento ya existe" if "numero_documento" in str(e) else "Error de integridad"
+                    self.reporte.rechazar(numero, paciente.numero_documento, [mensaje])
+                except pymysql.err.DataError as e:
+                    self.reporte.rechazar(numero, paciente.numero_documento, [f"Dato inválido: {e.args[-1]}"])
+        self.conn.commit()
+        return insertados
+
+    def _actualizar_indice(self, insertados: List[PacienteCreate]):
+        # executemany sólo informa el primer id: se leen por documento
+        if not indice_pacientes.listo:
+            return
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT id, numero_documento FROM paciente WHERE numero_documento IN ({', '.join(['%s'] * len(insertados))})",
+                    [p.numero_documento for p in insertados]
+                )
+                ids = {fila["numero_documento"].casefold(): fila["id"] for fila in cursor.fetchall()}
+            for paciente in insertados:
+                paciente_id = ids.get(paciente.numero_documento.casefold())
+                if paciente_id is not None:
+                    indice_pacientes.upsert({"id": paciente_id, **paciente.dict()})
+        except Exception as e:
+            print(f"⚠️ No se pudo actualizar el índice de pacientes tras importar: {e}")
+
+def importar_pacientes(conn, archivo, formato: str, validar_solo: bool = False,
+                       lote: Optional[int] = None) -> dict:
+    """
+    Importa los pacientes de `archivo` (binario, p. ej. `UploadFile.file`).
+
+    Lanza `ArchivoInvalido` si el archivo no se puede empezar a leer (vacío o
+    sin las columnas obligatorias). Un error de lectura a mitad de archivo no
+    deshace los lotes ya guardados: se corta ahí y se informa en
+    `interrumpido`.
+    """
+    if formato not in FORMATOS:
+        raise ArchivoInvalido(f"Formato no soportado: {formato}")
+    reporte = _Reporte(settings.IMPORT_MAX_ERRORES, validar_solo)
+    archivo.seek(0)
+    # utf-8-sig: acepta el BOM que agrega Excel (y nuestra exportación CSV)
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    try:
+        filas = _filas_csv(texto) if formato == "csv" else _filas_ndjson(texto)
+        ImportadorPacientes(conn, lote or settings.IMPORT_LOTE, reporte).procesar(filas)
+    except UnicodeDecodeError:
+        if reporte.total_filas == 0:
+            raise ArchivoInvalido("El archivo debe estar codificado en UTF-8")
+        reporte.interrumpido = f"El archivo no es UTF-8 válido después de la fila {reporte.total_filas}"
+    except csv.Error as e:
+        if reporte.total_filas == 0:
+            raise ArchivoInvalido(f"CSV inválido: {e}")
+        reporte.interrumpido = f"CSV inválido después de la fila {reporte.total_filas}: {e}"
+    except pymysql.MySQLError as e:
+        # Sin nada guardado es un error común; si no, se informa lo que quedó
+        if reporte.insertados == 0:
+            raise
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        reporte.interrumpido = f"Error de base de datos después de la fila {reporte.total_filas}: {e}"
+    finally:
+        # El archivo lo cierra quien lo abrió
+        texto.detach()
+    return reporte.a_dict()
@@ -0,0 +1,242 @@
+"""
+Almacén de adjuntos direccionado por contenido.
+
+Cada archivo se guarda una sola vez por carpeta ("planes", "historias") con
+su SHA-256 como nombre (`uploads/planes/<sha256>.pdf` o public_id
+`planes/<sha256>` en Cloudinary). La tabla `media_blob` lleva la URL y un
+contador de referencias:
+
+- `almacenar` ingiere el upload; si el contenido ya existe sólo incrementa
+  el contador y devuelve la URL existente, sin escribir en disco ni subir
+  nada a la red.
+- `liberar` decrementa dentro de la transacción del borrado y devuelve las
+  URLs que quedaron sin referencias; `eliminar_blobs` las borra después del
+  commit.
+
+Las URLs que no están en `media_blob` (archivos subidos antes de este
+almacén) se siguen borrando directamente, como antes.
+
+La referencia se toma al subir, no al guardar la URL en su registro:
+
+- si el registro ya no existe al guardarla (un plan borrado durante la
+  subida) el handler la devuelve con `descartar`.
+- las fotos de historias se suben antes de que un PUT las escriba en
+  `fotos`; si ese PUT nunca llega, o una edición quita la URL, la referencia
+  queda tomada y el archivo se conserva (nunca se borra algo en uso, a
+  cambio de poder dejar archivos huérfanos).
+"""
+import os
+import threading
+from typing import List, Optional
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import UploadFile
+
+from app.core.database import get_connection
+from app.services.archivos import en_hilo, ingerir_upload, subir_a_storage
+from app.services.miniaturas import eliminar_derivados, programar_derivados
+
+USE_CLOUDINARY = all([
+    os.getenv("CLOUDINARY_CLOUD_NAME"),
+    os.getenv("CLOUDINARY_API_KEY"),
+    os.getenv("CLOUDINARY_API_SECRET")
+])
+
+UPLOAD_DIR = "uploads"
+
+class BlobAlmacenado:
+    """Resultado de `almacenar`"""
+    __slots__ = ("url", "filename", "sha256", "size", "reutilizado")
+
+    def __init__(self, url: str, sha256: str, size: int, reutilizado: bool):
+        self.url = url
+        self.filename = url.rsplit("/", 1)[-1]
+        self.sha256 = sha256
+        self.size = size
+        self.reutilizado = reutilizado
+
+class MediaStore:
+
+    def __init__(self):
+        self._tabla_lista = False
+        self._lock = threading.Lock()
+
+    def _asegurar_tabla(self, cursor):
+        if self._tabla_lista:
+            return
+        with self._lock:
+            if self._tabla_lista:
+                return
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS media_blob (
+                    sha256 CHAR(64) NOT NULL,
+                    carpeta VARCHAR(32) NOT NULL,
+                    url VARCHAR(500) NOT NULL,
+                    size_bytes BIGINT NOT NULL DEFAULT 0,
+                    ref_count INT NOT NULL DEFAULT 1,
+                    fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (sha256, carpeta),
+                    KEY idx_media_blob_url (url(191))
+                )
+            """)
+            self._tabla_lista = True
+
+    # ---------- subida ----------
+
+    def _adquirir(self, sha256: str, carpeta: str) -> Optional[str]:
+        """Si el contenido ya existe, suma una referencia y devuelve su URL"""
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                self._asegurar_tabla(cursor)
+                cursor.execute("""
+                    UPDATE media_blob SET ref_count = ref_count + 1
+                    WHERE sha256 = %s AND carpeta = %s
+                """, (sha256, carpeta))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return None
+                cursor.execute(
+                    "SELECT url FROM media_blob WHERE sha256 = %s AND carpeta = %s",
+                    (sha256, carpeta)
+                )
+                fila = cursor.fetchone()
+                conn.commit()
+                return fila['url'] if fila else None
+
+    def _registrar(self, sha256: str, carpeta: str, url: str, size: int):
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                self._asegurar_tabla(cursor)
+                # Dos subidas simultáneas del mismo contenido: la segunda suma referencia
+                cursor.execute("""
+                    INSERT INTO media_blob (sha256, carpeta, url, size_bytes, ref_count)
+                    VALUES (%s, %s, %s, %s, 1)
+                    ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+                """, (sha256, carpeta, url, size))
+                conn.commit()
+
+    async def almacenar(self, file: UploadFile, carpeta: str, file_ext: str,
+                        max_bytes: int, resource_type: str = "auto") -> BlobAlmacenado:
+        """
+        Ingiere `file` y lo guarda bajo su SHA-256. Lanza `ArchivoDemasiadoGrande`
+        si supera `max_bytes`.
+        """
+        ingerido = await ingerir_upload(file, max_bytes)
+        sha256 = ingerido.sha256
+
+        url = await en_hilo(self._adquirir, sha256, carpeta)
+        if url:
+            print(f"♻️ Contenido ya almacenado, se reutiliza: {url}")
+            return BlobAlmacenado(url, sha256, ingerido.size, reutilizado=True)
+
+        if USE_CLOUDINARY:
+            print(f"☁️ Subiendo a Cloudinary: {carpeta}/{sha256}")
+            upload_result = await subir_a_storage(
+                cloudinary.uploader.upload,
+                file.file,
+                folder=carpeta,
+                public_id=sha256,
+                filename=f"{sha256}{file_ext}",
+                resource_type=resource_type
+            )
+            url = upload_result['secure_url']
+        else:
+            file_path = os.path.join(UPLOAD_DIR, carpeta, f"{sha256}{file_ext}")
+            if not await en_hilo(os.path.exists, file_path):
+                await ingerir_upload(file, max_bytes, file_path)
+                programar_derivados(file_path)
+            url = f"/{UPLOAD_DIR}/{carpeta}/{sha256}{file_ext}"
+
+        await en_hilo(self._registrar, sha256, carpeta, url, ingerido.size)
+        return BlobAlmacenado(url, sha256, ingerido.size, reutilizado=False)
+
+    # ---------- borrado ----------
+
+    def liberar(self, cursor, urls: List[str]) -> List[str]:
+        """
+        Quita una referencia por cada URL usando el cursor (y la transacción)
+        del borrado. Devuelve las URLs a eliminar físicamente tras el commit:
+        las que llegaron a cero y las que no pertenecen al almacén.
+        """
+        self._asegurar_tabla(cursor)
+        a_eliminar = []
+        for url in urls:
+            cursor.execute("""
+                SELECT sha256, carpeta, ref_count FROM media_blob
+                WHERE url = %s
+                FOR UPDATE
+            """, (url,))
+            blob = cursor.fetchone()
+            if not blob:
+                a_eliminar.append(url)
+            elif blob['ref_count'] <= 1:
+                cursor.execute(
+                    "DELETE FROM media_blob WHERE sha256 = %s AND carpeta = %s",
+                    (blob['sha256'], blob['carpeta'])
+                )
+                a_eliminar.append(url)
+            else:
+                cursor.execute("""
+                    UPDATE media_blob SET ref_count = ref_count - 1
+                    WHERE sha256 = %s AND carpeta = %s
+                """, (blob['sha256'], blob['carpeta']))
+        return a_eliminar
+
+    def descartar(self, url: str, carpeta: str):
+        """
+        Devuelve la referencia que tomó `almacenar` para una URL que no se
+        llegó a guardar en ningún registro, en una transacción corta, y borra
+        el archivo si nadie más lo usa.
+        """
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                a_eliminar = self.liberar(cursor, [url])
+                conn.commit()
+        self.eliminar_blobs(a_eliminar, carpeta)
+
+    def _sigue_registrado(self, url: str) -> bool:
+        # Una subida del mismo contenido pudo registrarlo de nuevo tras el commit
+        conn = get_connection()
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM media_blob WHERE url = %s", (url,))
+                return cursor.fetchone() is not None
+
+    def eliminar_blobs(self, urls: List[str], carpeta: str):
+        """Borra de Cloudinary o del disco las URLs devueltas por `liberar`"""
+        for url in urls:
+            try:
+                if self._sigue_registrado(url):
+                    continue
+            except Exception as e:
+                print(f"⚠️ No se pudo verificar {url}, se conserva: {e}")
+                continue
+
+            if USE_CLOUDINARY and 'cloudinary.com' in url:
+                try:
+                    parts = url.split('/')
+                    if carpeta in parts:
+                        idx = parts.index(carpeta)
+                        if idx + 1 < len(parts):
+                            filename = parts[idx + 1].split('.')[0]
+                            public_id = f"{carpeta}/{filename}"
+                            cloudinary.uploader.destroy(public_id)
+                            print(f"🗑️ Eliminado de Cloudinary: {public_id}")
+                except Exception as e:
+                    print(f"⚠️ Error eliminando de Cloudinary: {e}")
+
+            elif url.startswith('/uploads/'):
+                file_path = url[1:]  # Remover '/' inicial
+                if os.path.exists(file_path):
+                    try:
+                        os.remove(file_path)
+                        print(f"🗑️ Eliminado archivo local: {file_path}")
+                    except Exception as e:
+                        print(f"⚠️ Error eliminando archivo local: {e}")
+                eliminar_derivados(file_path)
+
+media_store = MediaStore()
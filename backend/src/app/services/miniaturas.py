@@ -0,0 +1,136 @@
+"""
+Derivados redimensionados (miniatura y vista media) de las fotos clínicas.
+
+Las galerías mostraban cada foto a resolución completa. Aquí se generan con
+Pillow versiones reducidas en WebP o JPEG, cacheadas en disco junto a los
+originales:
+
+    uploads/historias/<nombre>.jpg
+    uploads/historias/_derivados/<nombre>_thumb.webp
+    uploads/historias/_derivados/<nombre>_medium.webp
+
+La generación corre en un worker en segundo plano justo después de subir
+(`programar_derivados`) y, si el derivado todavía no existe cuando se pide,
+se genera bajo demanda (`obtener_derivado`). Para archivos en Cloudinary se
+usan sus transformaciones por URL en lugar de generar nada localmente.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+
+TAMANOS = {
+    "thumb": 256,
+    "medium": 1024,
+}
+FORMATOS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+CARPETAS = {"historias", "planes"}
+EXTENSIONES_IMAGEN = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+SUBDIRECTORIO = "_derivados"
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.MINIATURAS_WORKERS,
+    thread_name_prefix="miniaturas"
+)
+# Candados repartidos por hash de la ruta: cantidad fija, no crece con las fotos.
+# Dos derivados distintos que caen en el mismo sólo se generan uno tras otro
+_locks = tuple(threading.Lock() for _ in range(64))
+
+def es_imagen(nombre: str) -> bool:
+    return os.path.splitext(nombre)[1].lower() in EXTENSIONES_IMAGEN
+
+def ruta_derivado(ruta_original: str, tamano: str, formato: str) -> str:
+    carpeta, nombre = os.path.split(ruta_original)
+    base = os.path.splitext(nombre)[0]
+    extension = "jpg" if formato == "jpeg" else formato
+    return os.path.join(carpeta, SUBDIRECTORIO, f"{base}_{tamano}.{extension}")
+
+def _lock_para(ruta: str) -> threading.Lock:
+    return _locks[hash(ruta) % len(_locks)]
+
+def _generar(ruta_original: str, tamano: str, formato: str) -> str:
+    destino = ruta_derivado(ruta_original, tamano, formato)
+    with _lock_para(destino):
+        if os.path.exists(destino):
+            return destino
+
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        lado = TAMANOS[tamano]
+        formato_pil, _ = FORMATOS[formato]
+
+        with Image.open(ruta_original) as imagen:
+            imagen.draft("RGB", (lado, lado))  # JPEG: decodifica ya reducido
+            imagen = ImageOps.exif_transpose(imagen)
+            imagen.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+            if formato_pil == "JPEG" or imagen.mode not in ("RGB", "RGBA"):
+                imagen = imagen.convert("RGB")
+
+            # Escritura atómica: nunca se sirve un derivado a medio escribir
+            temporal = f"{destino}.{threading.get_ident()}.tmp"
+            try:
+                imagen.save(temporal, formato_pil, quality=settings.MINIATURAS_CALIDAD, optimize=True)
+                os.replace(temporal, destino)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+        return destino
+
+def _generar_todos(ruta_original: str):
+    for tamano in TAMANOS:
+        try:
+            _generar(ruta_original, tamano, "webp")
+        except Exception as e:
+            print(f"⚠️ No se pudo generar el derivado {tamano} de {ruta_original}: {e}")
+            return
+
+def programar_derivados(ruta_original: str):
+    """Encola la generación de todos los tamaños WebP sin esperar el resultado"""
+    if es_imagen(ruta_original):
+        _executor.submit(_generar_todos, ruta_original)
+
+def obtener_derivado(ruta_original: str, tamano: str, formato: str) -> str:
+    """Ruta del derivado, generándolo si aún no existe (bloqueante: llamar en un hilo)"""
+    destino = ruta_derivado(ruta_original, tamano, formato)
+    if os.path.exists(destino):
+        return destino
+    return _generar(ruta_original, tamano, formato)
+
+def eliminar_derivados(ruta_original: str):
+    for tamano in TAMANOS:
+        for formato in FORMATOS:
+            destino = ruta_derivado(ruta_original, tamano, formato)
+            if os.path.exists(destino):
+                try:
+                    os.remove(destino)
+                except Exception as e:
+                    print(f"⚠️ Error eliminando derivado {destino}: {e}")
+
+def urls_derivados(url: str) -> Optional[Dict[str, str]]:
+    """
+    URLs de cada tamaño para una foto ya almacenada, o None si no es una imagen.
+    Cloudinary: transformación en la URL. Local: endpoint /api/upload/miniatura.
+    """
+    if not url or not es_imagen(url.split("?")[0]):
+        return None
+
+    if 'cloudinary.com' in url and '/upload/' in url:
+        prefijo, resto = url.split('/upload/', 1)
+        return {
+            tamano: f"{prefijo}/upload/c_limit,w_{lado},h_{lado},f_auto,q_auto/{resto}"
+            for tamano, lado in TAMANOS.items()
+        }
+
+    partes = url.lstrip('/').split('/')
+    if len(partes) != 3 or partes[0] != "uploads" or partes[1] not in CARPETAS:
+        return None
+    return {
+        tamano: f"{settings.API_V1_STR}/upload/miniatura/{partes[1]}/{partes[2]}?tamano={tamano}"
+        for tamano in TAMANOS
+    }
@@ -0,0 +1,227 @@
+"""
+PDF de cotizaciones generados en el servidor y cacheados en disco.
+
+- El dibujo (`pdf_render.renderizar`) corre en un pool de procesos de
+  `PDF_WORKERS` workers: reportlab es CPU puro y no debe ocupar ni el event
+  loop ni los hilos de los requests. Cada worker prepara fuentes, estilos y
+  logo una sola vez (`pdf_render.inicializar`).
+- El resultado se guarda en `PDF_CACHE_DIR` como
+  `cotizacion_<id>_<huella>.pdf`, donde la huella es un SHA-256 de los datos
+  que se imprimen más `VERSION_PLANTILLA`. Una reimpresión sin cambios se
+  sirve directo del disco; si cambió cualquier dato impreso (también el
+  nombre o teléfono del paciente) la huella es otra y se vuelve a generar.
+- `update_cotizacion` y `delete_cotizacion` llaman a `invalidar`, que borra
+  los PDF de esa cotización para no acumular versiones viejas. Un render
+  nuevo borra las demás versiones pero nunca la suya.
+- `obtener` devuelve el contenido, no la ruta: el archivo puede borrarse
+  (por una edición simultánea) entre que se encuentra y que se envía. Si
+  desaparece antes de leerlo simplemente se vuelve a generar.
+- Dos pedidos simultáneos de la misma cotización comparten un solo render.
+
+El directorio de cache no debe estar dentro de `UPLOAD_DIR`, que se publica
+como estático en `/uploads`.
+"""
+import asyncio
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services import pdf_render
+from app.services.archivos import en_hilo
+
+# Subir cuando cambie el diseño de pdf_render para no servir PDFs viejos
+VERSION_PLANTILLA = 1
+
+def _basico(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M")
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+def datos_pdf(cotizacion: dict) -> dict:
+    """
+    Arma el diccionario que recibe `pdf_render.renderizar` a partir de la
+    cotización de `leer_cotizacion` (sólo tipos básicos, para enviarlo al
+    proceso y calcular la huella).
+    """
+    subtotales = {
+        campo: float(cotizacion.get(campo) or 0)
+        for campo in ("subtotal_procedimientos", "subtotal_adicionales", "subtotal_otros_adicionales")
+    }
+    total = cotizacion.get("total")
+    return {
+        "id": cotizacion["id"],
+        "fecha_creacion": _basico(cotizacion.get("fecha_emision")) or "",
+        "fecha_vencimiento": _basico(cotizacion.get("fecha_vencimiento")) or "",
+        "estado": cotizacion.get("estado_nombre"),
+        "observaciones": cotizacion.get("observaciones") or "",
+        "paciente": {
+            "nombre": f"{cotizacion.get('paciente_nombre') or ''} {cotizacion.get('paciente_apellido') or ''}".strip(),
+            "documento": cotizacion.get("paciente_documento"),
+            "telefono": cotizacion.get("paciente_telefono"),
+            "email": cotizacion.get("paciente_email"),
+        },
+        "items": [
+            {
+                "tipo": item.get("tipo"),
+                "nombre": item.get("nombre"),
+                "cantidad": item.get("cantidad") or 1,
+                "precio_unitario": float(item.get("precio_unitario") or 0),
+                "subtotal": float(item.get("subtotal") or 0),
+            }
+            for item in cotizacion.get("items", [])
+        ],
+        "servicios_incluidos": [
+            {"servicio_nombre": s.get("servicio_nombre"), "requiere": bool(s.get("requiere"))}
+            for s in cotizacion.get("servicios_incluidos", [])
+        ],
+        **subtotales,
+        "total": float(total) if total is not None else sum(subtotales.values()),
+    }
+
+def huella_datos(datos: dict) -> str:
+    contenido = json.dumps(datos, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{VERSION_PLANTILLA}:{contenido}".encode()).hexdigest()
+
+def _leer(ruta: str) -> Optional[bytes]:
+    try:
+        with open(ruta, "rb") as archivo:
+            return archivo.read()
+    except FileNotFoundError:
+        return None
+
+def _escribir_atomico(destino: str, contenido: bytes):
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = f"{destino}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporal, "wb") as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+class PdfCotizaciones:
+
+    def __init__(self, directorio: str, workers: int = 1, logo_path: Optional[str] = None):
+        self.directorio = directorio
+        self.workers = max(1, workers)
+        self.logo_path = logo_path
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # ruta destino -> render en curso (sólo se usa desde el event loop)
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self.aciertos = 0
+        self.renders = 0
+        self.errores = 0
+        self.invalidaciones = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: los workers no heredan el pool de MySQL ni los hilos del proceso
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=pdf_render.inicializar,
+                    initargs=(self.logo_path,),
+                )
+            return self._pool
+
+    def ruta(self, cotizacion_id: int, huella: str) -> str:
+        return os.path.join(self.directorio, f"cotizacion_{cotizacion_id}_{huella[:32]}.pdf")
+
+    async def obtener(self, datos: dict) -> Tuple[bytes, str]:
+        """Contenido del PDF de `datos` (generándolo si no está en disco) y su huella"""
+        huella = huella_datos(datos)
+        destino = self.ruta(datos["id"], huella)
+        contenido = await en_hilo(_leer, destino)
+        if contenido is not None:
+            self.aciertos += 1
+            return contenido, huella
+
+        en_curso = self._en_curso.get(destino)
+        if en_curso is None:
+            en_curso = self._en_curso[destino] = asyncio.ensure_future(self._generar(datos, destino))
+            en_curso.add_done_callback(lambda _: self._en_curso.pop(destino, None))
+        return await asyncio.shield(en_curso), huella
+
+    async def _generar(self, datos: dict, destino: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            contenido = await loop.run_in_executor(self._executor(), pdf_render.renderizar, datos)
+        except BrokenProcessPool:
+            # Un worker murió: se descarta el pool y el próximo pedido crea otro
+            with self._pool_lock:
+                self._pool = None
+            self.errores += 1
+            raise
+        except Exception:
+            self.errores += 1
+            raise
+        # Borrar las versiones anteriores, no la que se está por escribir: otro
+        # pedido puede estar leyéndola
+        await en_hilo(self.invalidar, datos["id"], False, destino)
+        await en_hilo(_escribir_atomico, destino, contenido)
+        self.renders += 1
+        return contenido
+
+    def invalidar(self, cotizacion_id: int, contar: bool = True, conservar: Optional[str] = None):
+        """Borra los PDF cacheados de una cotización (tras editarla o eliminarla), salvo `conservar`"""
+        for ruta in glob.glob(os.path.join(self.directorio, f"cotizacion_{cotizacion_id}_*.pdf")):
+            if ruta == conservar:
+                continue
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ No se pudo borrar el PDF cacheado {ruta}: {e}")
+        if contar:
+            self.invalidaciones += 1
+
+    def limpiar(self):
+        for ruta in glob.glob(os.path.join(self.directorio, "cotizacion_*.pdf")):
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+    def cerrar(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        archivos = glob.glob(os.path.join(self.directorio, "cotizacion_*.pdf"))
+        return {
+            "directorio": self.directorio,
+            "workers": self.workers,
+            "pool_activo": self._pool is not None,
+            "archivos": len(archivos),
+            "bytes": sum(os.path.getsize(a) for a in archivos if os.path.exists(a)),
+            "aciertos": self.aciertos,
+            "renders": self.renders,
+            "errores": self.errores,
+            "invalidaciones": self.invalidaciones,
+            "en_curso": len(self._en_curso),
+        }
+
+pdf_cotizaciones = PdfCotizaciones(
+    directorio=settings.PDF_CACHE_DIR,
+    workers=settings.PDF_WORKERS,
+    logo_path=settings.PDF_LOGO_PATH or None,
+)
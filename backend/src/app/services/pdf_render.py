@@ -0,0 +1,336 @@
+"""
+Dibujo del PDF de una cotización con reportlab.
+
+Este módulo corre dentro de los procesos del pool de `pdf_cotizaciones`, por
+eso no importa nada de la app (ni configuración ni base de datos): recibe un
+diccionario ya armado y devuelve los bytes del PDF.
+
+Lo que no depende de la cotización (métricas de las fuentes, estilos,
+logo) se prepara una vez por proceso en `inicializar` y se reutiliza en
+cada render. El diseño sigue al que generaba el frontend con jsPDF:
+encabezado con número y fechas, datos del paciente, servicios incluidos,
+procedimientos, adicionales, resumen de valores, valor en letras,
+observaciones, términos, firmas y "Página X de Y".
+"""
+import io
+import os
+from typing import List, Optional
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas as rl_canvas
+from reportlab.platypus import (
+    KeepTogether, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+)
+
+VERDE = colors.HexColor("#1a6b32")
+VERDE_CLARO = colors.HexColor("#669933")
+CELESTE = colors.HexColor("#99d6e8")
+GRIS = colors.HexColor("#666666")
+FONDO_PACIENTE = colors.HexColor("#f0f8ff")
+FONDO_TOTALES = colors.HexColor("#f5f8f6")
+
+MARGEN = 20 * mm
+ALTO_ENCABEZADO = 42 * mm
+
+TERMINOS = [
+    "Esta cotización es válida por el período indicado",
+    "Los precios están sujetos a cambios sin previo aviso",
+    "El pago debe realizarse según los términos acordados",
+    "Para procedimientos programados se requiere depósito",
+    "Consulte por métodos de pago y financiación",
+    "La cotización incluye únicamente los servicios marcados",
+    "Cualquier servicio adicional será cotizado por separado",
+]
+
+class _Plantilla:
+    """Recursos compartidos entre renders del mismo proceso"""
+
+    def __init__(self, logo_path: Optional[str]):
+        # Cargar las métricas de las fuentes una sola vez por proceso
+        for fuente in ("Helvetica", "Helvetica-Bold"):
+            pdfmetrics.getFont(fuente)
+
+        self.logo = None
+        if logo_path and os.path.exists(logo_path):
+            try:
+                self.logo = ImageReader(logo_path)
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el logo del PDF: {e}")
+
+        base = dict(fontName="Helvetica", fontSize=9, leading=12)
+        self.normal = ParagraphStyle("normal", **base)
+        self.titulo = ParagraphStyle(
+            "titulo", fontName="Helvetica-Bold", fontSize=13, leading=16,
+            textColor=VERDE, spaceBefore=8, spaceAfter=6
+        )
+        self.subtitulo = ParagraphStyle(
+            "subtitulo", parent=self.titulo, fontSize=11, leading=14
+        )
+        self.derecha = ParagraphStyle("derecha", parent=self.normal, alignment=TA_RIGHT)
+        self.termino = ParagraphStyle(
+            "termino", parent=self.normal, fontSize=8, leading=10,
+            textColor=colors.HexColor("#505050"), leftIndent=5 * mm, bulletIndent=2 * mm
+        )
+        self.check = ParagraphStyle(
+            "check", parent=self.normal, leftIndent=6 * mm, bulletIndent=1 * mm,
+            bulletFontName="Helvetica-Bold", bulletColor=VERDE
+        )
+
+_plantilla: Optional[_Plantilla] = None
+
+def inicializar(logo_path: Optional[str] = None):
+    """Initializer del pool de procesos (también se llama perezosamente)"""
+    global _plantilla
+    _plantilla = _Plantilla(logo_path)
+
+def _obtener_plantilla() -> _Plantilla:
+    if _plantilla is None:
+        inicializar()
+    return _plantilla
+
+# ---------- formato ----------
+
+def moneda(valor) -> str:
+    """$1.234.567 (formato es-CO)"""
+    valor = float(valor or 0)
+    if valor == int(valor):
+        texto = f"{valor:,.0f}"
+    else:
+        texto = f"{valor:,.2f}"
+    return "$" + texto.replace(",", "_").replace(".", ",").replace("_", ".")
+
+_UNIDADES = ["", "UN", "DOS", "TRES", "CUATRO", "CINCO", "SEIS", "SIETE", "OCHO", "NUEVE"]
+_ESPECIALES = ["DIEZ", "ONCE", "DOCE", "TRECE", "CATORCE", "QUINCE", "DIECISÉIS",
+               "DIECISIETE", "DIECIOCHO", "DIECINUEVE"]
+_VEINTES = ["VEINTE", "VEINTIUN", "VEINTIDÓS", "VEINTITRÉS", "VEINTICUATRO", "VEINTICINCO",
+            "VEINTISÉIS", "VEINTISIETE", "VEINTIOCHO", "VEINTINUEVE"]
+_DECENAS = ["", "", "", "TREINTA", "CUARENTA", "CINCUENTA", "SESENTA", "SETENTA", "OCHENTA", "NOVENTA"]
+_CENTENAS = ["", "CIENTO", "DOSCIENTOS", "TRESCIENTOS", "CUATROCIENTOS", "QUINIENTOS",
+             "SEISCIENTOS", "SETECIENTOS", "OCHOCIENTOS", "NOVECIENTOS"]
+
+def _hasta_mil(n: int) -> str:
+    if n == 100:
+        return "CIEN"
+    partes = []
+    if n >= 100:
+        partes.append(_CENTENAS[n // 100])
+    resto = n % 100
+    if 10 <= resto < 20:
+        partes.append(_ESPECIALES[resto - 10])
+    elif 20 <= resto < 30:
+        partes.append(_VEINTES[resto - 20])
+    elif resto >= 30:
+        partes.append(_DECENAS[resto // 10] + (f" Y {_UNIDADES[resto % 10]}" if resto % 10 else ""))
+    elif resto > 0:
+        partes.append(_UNIDADES[resto])
+    return " ".join(partes)
+
+def _entero_a_letras(n: int) -> str:
+    partes = []
+    millones, resto = divmod(n, 1_000_000)
+    if millones:
+        partes.append("UN MILLÓN" if millones == 1 else f"{_entero_a_letras(millones)} MILLONES")
+    miles, unidades = divmod(resto, 1000)
+    if miles:
+        partes.append("MIL" if miles == 1 else f"{_hasta_mil(miles)} MIL")
+    if unidades:
+        partes.append(_hasta_mil(unidades))
+    return " ".join(partes)
+
+def numero_a_letras(numero) -> str:
+    """Parte entera en letras: 1.250.000 -> UN MILLÓN DOSCIENTOS CINCUENTA MIL PESOS COLOMBIANOS"""
+    n = int(float(numero or 0))
+    if n == 0:
+        return "CERO PESOS COLOMBIANOS"
+    texto = _entero_a_letras(n)
+    # "dos millones de pesos", pero "dos millones cien mil pesos"
+    if n % 1_000_000 == 0:
+        texto += " DE"
+    return f"{texto} PESOS COLOMBIANOS"
+
+# ---------- dibujo ----------
+
+class _CanvasNumerado(rl_canvas.Canvas):
+    """Guarda las páginas para dibujar "Página X de Y" al final"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._paginas = []
+
+    def showPage(self):
+        self._paginas.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        total = len(self._paginas)
+        for estado in self._paginas:
+            self.__dict__.update(estado)
+            self._pie(total)
+            super().showPage()
+        super().save()
+
+    def _pie(self, total: int):
+        ancho, _ = self._pagesize
+        self.setFont("Helvetica", 8)
+        self.setFillColor(colors.HexColor("#779e4d"))
+        self.drawCentredString(ancho / 2, 15 * mm, "Dr. Hernán Ignacio Córdoba - Especialistas en Cirugía Plástica")
+        self.setFillColor(colors.HexColor("#8c8c8c"))
+        self.drawCentredString(ancho / 2, 10 * mm, f"Página {self._pageNumber} de {total}")
+
+def _encabezado(datos: dict, plantilla: _Plantilla):
+    def dibujar(canvas, doc):
+        ancho, alto = doc.pagesize
+        y = alto - 15 * mm
+        canvas.saveState()
+
+        canvas.setFont("Helvetica-Bold", 10)
+        canvas.setFillColor(colors.black)
+        canvas.drawString(MARGEN, y - 8 * mm, f"COTIZACIÓN CZ-{datos['id']}")
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(GRIS)
+        canvas.drawString(MARGEN, y - 15 * mm, f"Creado: {datos['fecha_creacion']}")
+        canvas.drawString(MARGEN, y - 20 * mm, f"Válido hasta: {datos['fecha_vencimiento']}")
+
+        x_texto = ancho - MARGEN
+        if plantilla.logo is not None:
+            ancho_logo, alto_logo = 60 * mm, 30 * mm
+            canvas.drawImage(plantilla.logo, ancho - MARGEN - ancho_logo, y - alto_logo,
+                             ancho_logo, alto_logo, preserveAspectRatio=True, mask="auto")
+            x_texto = ancho - MARGEN - ancho_logo - 3 * mm
+        canvas.setFont("Helvetica-Bold", 10)
+        canvas.setFillColor(VERDE)
+        canvas.drawRightString(x_texto, y - 8 * mm, "Dr. Hernán Ignacio Córdoba")
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(VERDE_CLARO)
+        canvas.drawRightString(x_texto, y - 13 * mm, "CIRUGÍA PLÁSTICA")
+
+        canvas.setStrokeColor(CELESTE)
+        canvas.line(MARGEN, y - 25 * mm, ancho - MARGEN, y - 25 * mm)
+        canvas.restoreState()
+    return dibujar
+
+def _texto(valor) -> str:
+    return escape(str(valor)) if valor not in (None, "") else "-"
+
+def _tabla_items(items: List[dict], plantilla: _Plantilla, ancho: float) -> Table:
+    filas = [[
+        Paragraph(f"{_texto(item['nombre'])}" + (f" (x{item['cantidad']})" if (item.get('cantidad') or 1) > 1 else ""),
+                  plantilla.normal),
+        Paragraph(moneda(item.get('subtotal') or item.get('precio_unitario')), plantilla.derecha),
+    ] for item in items]
+    tabla = Table(filas, colWidths=[ancho - 45 * mm, 45 * mm])
+    tabla.setStyle(TableStyle([
+        ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#e0e0e0")),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("TOPPADDING", (0, 0), (-1, -1), 2),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+    ]))
+    return tabla
+
+def renderizar(datos: dict) -> bytes:
+    """
+    Dibuja la cotización y devuelve el PDF.
+
+    `datos` es el diccionario de `pdf_cotizaciones.datos_pdf`: sólo tipos
+    básicos (str, int, float, bool, listas, dicts) para poder enviarlo al
+    proceso del pool.
+    """
+    plantilla = _obtener_plantilla()
+    salida = io.BytesIO()
+    doc = SimpleDocTemplate(
+        salida, pagesize=A4,
+        leftMargin=MARGEN, rightMargin=MARGEN,
+        topMargin=ALTO_ENCABEZADO, bottomMargin=25 * mm,
+        title=f"Cotización CZ-{datos['id']}",
+        author="Dr. Hernán Ignacio Córdoba",
+    )
+    ancho = doc.width
+    paciente = datos["paciente"]
+    historia = []
+
+    historia.append(Paragraph("INFORMACIÓN DEL PACIENTE", plantilla.titulo))
+    info = Table([
+        [Paragraph(f"<b>Nombre:</b> {_texto(paciente['nombre'])}", plantilla.normal),
+         Paragraph(f"<b>Teléfono:</b> {_texto(paciente['telefono'])}", plantilla.normal)],
+        [Paragraph(f"<b>Documento:</b> {_texto(paciente['documento'])}", plantilla.normal),
+         Paragraph(f"<b>Email:</b> {_texto(paciente['email'])}", plantilla.normal)],
+    ], colWidths=[ancho * 0.55, ancho * 0.45])
+    info.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), FONDO_PACIENTE),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+        ("LEFTPADDING", (0, 0), (-1, -1), 8),
+    ]))
+    historia.append(info)
+
+    servicios = [s for s in datos["servicios_incluidos"] if s.get("requiere")]
+    if servicios:
+        historia.append(Paragraph("SERVICIOS INCLUIDOS", plantilla.titulo))
+        for servicio in servicios:
+            historia.append(Paragraph(_texto(servicio["servicio_nombre"]), plantilla.check, bulletText="•"))
+
+    for titulo, tipo in (("PROCEDIMIENTOS", "procedimiento"), ("ADICIONALES", "adicional"),
+                         ("OTROS ADICIONALES", "otro_adicional")):
+        items = [i for i in datos["items"] if i.get("tipo") == tipo]
+        if items:
+            historia.append(Paragraph(titulo, plantilla.subtitulo))
+            historia.append(_tabla_items(items, plantilla, ancho))
+
+    totales = Table([
+        ["Subtotal Procedimientos:", moneda(datos["subtotal_procedimientos"])],
+        ["Subtotal Adicionales:", moneda(datos["subtotal_adicionales"])],
+        ["Subtotal Otros Adicionales:", moneda(datos["subtotal_otros_adicionales"])],
+        ["TOTAL GENERAL:", moneda(datos["total"])],
+    ], colWidths=[ancho * 0.6, ancho * 0.4])
+    totales.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), FONDO_TOTALES),
+        ("FONTNAME", (0, 0), (-1, -2), "Helvetica"),
+        ("FONTSIZE", (0, 0), (-1, -2), 11),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, -1), (-1, -1), 14),
+        ("TEXTCOLOR", (0, -1), (-1, -1), VERDE),
+        ("LINEABOVE", (0, -1), (-1, -1), 0.75, CELESTE),
+        ("ALIGN", (1, 0), (1, -1), "RIGHT"),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+        ("LEFTPADDING", (0, 0), (-1, -1), 12),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 12),
+    ]))
+    letras = Table([[Paragraph(escape(numero_a_letras(datos["total"])), plantilla.normal)]], colWidths=[ancho])
+    letras.setStyle(TableStyle([("BOX", (0, 0), (-1, -1), 0.75, CELESTE), ("TOPPADDING", (0, 0), (-1, -1), 6),
+                                ("BOTTOMPADDING", (0, 0), (-1, -1), 6)]))
+    historia.append(KeepTogether([
+        Paragraph("RESUMEN DE VALORES", plantilla.titulo), totales,
+        Paragraph("VALOR EN LETRAS:", plantilla.subtitulo), letras,
+    ]))
+
+    if datos.get("observaciones"):
+        historia.append(Paragraph("OBSERVACIONES", plantilla.subtitulo))
+        historia.append(Paragraph(escape(datos["observaciones"]).replace("\n", "<br/>"), plantilla.normal))
+
+    historia.append(Paragraph("TÉRMINOS Y CONDICIONES", plantilla.subtitulo))
+    for termino in TERMINOS:
+        historia.append(Paragraph(termino, plantilla.termino, bulletText="•"))
+
+    firmas = Table([
+        ["Dr. Hernán Ignacio Córdoba", "Paciente/Acompañante"],
+        ["Cirujano Plástico", "Aceptación de cotización"],
+    ], colWidths=[ancho / 2, ancho / 2])
+    firmas.setStyle(TableStyle([
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#646464")),
+        ("ALIGN", (1, 0), (1, -1), "RIGHT"),
+        ("LINEBELOW", (0, -1), (-1, -1), 0.5, colors.HexColor("#c8c8c8")),
+    ]))
+    historia.append(KeepTogether([Spacer(1, 18 * mm), firmas]))
+
+    encabezado = _encabezado(datos, plantilla)
+    doc.build(historia, onFirstPage=encabezado, onLaterPages=encabezado, canvasmaker=_CanvasNumerado)
+    return salida.getvalue()
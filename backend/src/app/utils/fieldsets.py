@@ -0,0 +1,80 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+_columnas: Dict[str, tuple] = {}
+_lock = threading.Lock()
+
+def columnas_tabla(cursor, tabla: str) -> tuple:
+    """
+    Columnas reales de `tabla` según information_schema (se consulta una vez
+    por proceso). Es la lista blanca para `fields=`: nunca se interpola en el
+    SQL un nombre que no venga de aquí.
+    """
+    columnas = _columnas.get(tabla)
+    if columnas is None:
+        cursor.execute("""
+            SELECT COLUMN_NAME as columna
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+            ORDER BY ORDINAL_POSITION
+        """, (tabla,))
+        columnas = tuple(fila['columna'] for fila in cursor.fetchall())
+        with _lock:
+            _columnas[tabla] = columnas
+    return columnas
+
+def resolver_campos(
+    fields: Optional[str],
+    columnas: Sequence[str],
+    presets: Dict[str, Iterable[str]],
+    calculados: Iterable[str] = (),
+    obligatorios: Iterable[str] = ("id",),
+) -> Optional[List[str]]:
+    """
+    Interpreta `fields=` ("campo1,campo2", un preset como "compacto", o una
+    mezcla). Devuelve None si se piden todos los campos (parámetro vacío o "*").
+    Los presets se recortan a las columnas que existen; un campo explícito que
+    no esté en la lista blanca lanza ValueError.
+    """
+    if not fields or fields.strip() == "*":
+        return None
+
+    disponibles = set(columnas) | set(calculados)
+    elegidos = list(dict.fromkeys(obligatorios))
+    desconocidos = []
+    for campo in (f.strip() for f in fields.split(",")):
+        if not campo:
+            continue
+        if campo in presets:
+            elegidos.extend(c for c in presets[campo] if c in disponibles)
+        elif campo in disponibles:
+            elegidos.append(campo)
+        else:
+            desconocidos.append(campo)
+
+    if desconocidos:
+        raise ValueError(
+            f"Campos no permitidos: {', '.join(desconocidos)}. "
+            f"Disponibles: {', '.join(sorted(disponibles))} o presets: {', '.join(presets)}"
+        )
+    return list(dict.fromkeys(elegidos))
+
+def proyeccion(campos: Optional[List[str]], alias: str = "", calculados: Dict[str, str] = None) -> str:
+    """
+    Lista SELECT para `campos` (None = `alias.*` más los calculados).
+    `calculados` mapea nombre -> expresión SQL fija definida en el código.
+    """
+    calculados = calculados or {}
+    prefijo = f"{alias}." if alias else ""
+    if campos is None:
+        partes = [f"{prefijo}*"]
+        partes.extend(f"{expr} as {nombre}" for nombre, expr in calculados.items())
+        return ",\n".join(partes)
+
+    partes = []
+    for campo in campos:
+        if campo in calculados:
+            partes.append(f"{calculados[campo]} as {campo}")
+        else:
+            partes.append(f"{prefijo}`{campo}`")
+    return ",\n".join(partes)
@@ -1,5 +1,6 @@
 import re
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
 
 def parse_int_safe(value) -> Optional[int]:
     """Parsea un valor a entero de forma segura"""
@@ -20,4 +21,16 @@ def parse_int_safe(value) -> Optional[int]:
                     return int(numbers[0])
                 except:
                     pass
-    raise ValueError(f"No se pudo convertir a entero: {value}")
\ No newline at end of file
+    raise ValueError(f"No se pudo convertir a entero: {value}")
+
+def rango_dia(dia: Optional[date] = None) -> Tuple[datetime, datetime]:
+    """
+    Límites [inicio, fin) de un día para filtrar columnas DATETIME con
+    `col >= inicio AND col < fin` (usa índices, a diferencia de `DATE(col) = dia`)
+    """
+    if dia is None:
+        dia = date.today()
+    elif isinstance(dia, datetime):
+        dia = dia.date()
+    inicio = datetime.combine(dia, datetime.min.time())
+    return inicio, inicio + timedelta(days=1)
@@ -0,0 +1,41 @@
+"""
+Codificación/decodificación JSON con `orjson` si está instalado.
+
+`orjson` es opcional: si no está disponible se usa el módulo estándar `json`
+con un resultado equivalente (UTF-8 sin escapar, salida compacta).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+JSON_RAPIDO = orjson is not None
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    def dumpb(obj, default=None) -> bytes:
+        """Como `dumps` pero en bytes; `default` resuelve los tipos no nativos"""
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def dumpb(obj, default=None) -> bytes:
+        """Como `dumps` pero en bytes; `default` resuelve los tipos no nativos"""
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=default
+        ).encode("utf-8")
@@ -0,0 +1,71 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Codifica los valores de la llave de orden en un cursor opaco (base64 url-safe)"""
+    payload = []
+    for value in values:
+        if isinstance(value, datetime):
+            payload.append({"dt": value.isoformat()})
+        elif isinstance(value, date):
+            payload.append({"d": value.isoformat()})
+        else:
+            payload.append(value)
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token: str, size: int) -> List[Any]:
+    """Decodifica un cursor generado por `encode_cursor`. Lanza ValueError si es inválido"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+    if not isinstance(payload, list) or len(payload) != size:
+        raise ValueError("Cursor inválido")
+
+    values = []
+    for value in payload:
+        if isinstance(value, dict) and "dt" in value:
+            values.append(datetime.fromisoformat(value["dt"]))
+        elif isinstance(value, dict) and "d" in value:
+            values.append(date.fromisoformat(value["d"]))
+        elif value is None or isinstance(value, (int, float, str)):
+            values.append(value)
+        else:
+            raise ValueError("Cursor inválido")
+    return values
+
+def keyset_condition(columns: Sequence[str], values: Sequence[Any]) -> Tuple[str, list]:
+    """
+    Condición de búsqueda por llave para orden descendente:
+    `(col1, col2) < (%s, %s)`, que MySQL resuelve como rango sobre el índice.
+    """
+    placeholders = ", ".join(["%s"] * len(columns))
+    return f"({', '.join(columns)}) < ({placeholders})", list(values)
+
+def paginate_keyset(rows: list, keys: Sequence[str], limit: int) -> Tuple[list, Optional[str]]:
+    """
+    Recorta las filas obtenidas con `LIMIT limit + 1` y arma el siguiente cursor
+    a partir de la última fila devuelta. `next_cursor` es None en la última página.
+    """
+    if limit <= 0:
+        return [], None
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([last[key] for key in keys])
+
+def approximate_count(cursor, table: str) -> Optional[int]:
+    """Total aproximado de filas según las estadísticas de InnoDB (sin escanear la tabla)"""
+    cursor.execute("""
+        SELECT TABLE_ROWS as total
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    row = cursor.fetchone()
+    return row['total'] if row else None
@@ -0,0 +1,126 @@
+"""
+Codec de filas de `plan_quirurgico`.
+
+Centraliza la conversión entre las columnas de texto y los valores JSON que
+devuelve la API, que antes se repetía (con `try/except` por fila) en cada
+endpoint:
+
+- `decodificar_plan(fila)`: decodifica en el lugar los campos JSON y
+  `imagen_procedimiento` de una fila.
+- `decodificar_archivos(valor)`: lista de URLs de `imagen_procedimiento`,
+  aceptando el formato JSON actual y el formato heredado separado por comas.
+- `codificar_json(valor)`: inverso para INSERT/UPDATE.
+- `migrar_imagen_procedimiento()`: convierte una sola vez las filas heredadas
+  separadas por comas a arrays JSON.
+"""
+from typing import Any, List, Optional
+
+from app.core.database import get_connection
+from app.utils import json_codec
+
+CAMPOS_JSON = (
+    "enfermedad_actual",
+    "antecedentes",
+    "notas_corporales",
+    "esquema_mejorado",
+)
+
+_VACIOS = frozenset(("", "null"))
+
+def decodificar_json(valor) -> Any:
+    """Texto JSON -> dict/list; None para vacío, 'null', JSON inválido o valores vacíos"""
+    if valor is None:
+        return None
+    if not isinstance(valor, (str, bytes)):
+        return valor
+    if valor in _VACIOS:
+        return None
+    try:
+        parsed = json_codec.loads(valor)
+    except (json_codec.JSONDecodeError, ValueError):
+        return None
+    return parsed if parsed else None
+
+def codificar_json(valor) -> Optional[str]:
+    """dict/list -> texto JSON; None para None o colecciones vacías"""
+    if valor is None:
+        return None
+    if isinstance(valor, (dict, list)):
+        if not valor:
+            return None
+        return json_codec.dumps(valor)
+    return valor
+
+def decodificar_archivos(valor) -> List[str]:
+    """
+    `imagen_procedimiento` -> lista de URLs. El formato actual es un array JSON;
+    las filas antiguas guardaban URLs separadas por comas. Se decide por el
+    primer carácter en vez de intentar `json.loads` y capturar la excepción.
+    """
+    if not valor:
+        return []
+    if isinstance(valor, list):
+        return valor
+    texto = valor.strip()
+    if texto.startswith("["):
+        try:
+            archivos = json_codec.loads(texto)
+            if isinstance(archivos, list):
+                return archivos
+        except (json_codec.JSONDecodeError, ValueError):
+            pass
+    return [img.strip() for img in texto.split(",") if img.strip()]
+
+def decodificar_plan(plan: dict) -> dict:
+    """
+    Decodifica en el lugar los campos JSON de una fila de plan_quirurgico.
+    Sólo toca los campos presentes (las filas de `fields=` traen un subconjunto).
+    """
+    for campo in CAMPOS_JSON:
+        if campo in plan:
+            plan[campo] = decodificar_json(plan[campo])
+    if plan.get("imagen_procedimiento"):
+        plan["imagen_procedimiento"] = decodificar_archivos(plan["imagen_procedimiento"])
+    return plan
+
+def migrar_imagen_procedimiento() -> int:
+    """
+    Convierte `imagen_procedimiento` heredado (URLs separadas por comas) a
+    arrays JSON. Es idempotente: una vez migradas, la consulta no devuelve
+    filas. Devuelve la cantidad de filas convertidas.
+    """
+    conn = get_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT CHARACTER_MAXIMUM_LENGTH as max_len
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                  AND TABLE_NAME = 'plan_quirurgico'
+                  AND COLUMN_NAME = 'imagen_procedimiento'
+            """)
+            columna = cursor.fetchone()
+            max_len = columna['max_len'] if columna else None
+
+            cursor.execute("""
+                SELECT id, imagen_procedimiento FROM plan_quirurgico
+                WHERE imagen_procedimiento IS NOT NULL
+                  AND imagen_procedimiento <> ''
+                  AND TRIM(imagen_procedimiento) NOT LIKE '[%'
+            """)
+            cambios = []
+            for fila in cursor.fetchall():
+                nuevo = json_codec.dumps(decodificar_archivos(fila['imagen_procedimiento']))
+                if max_len and len(nuevo) > max_len:
+                    print(f"⚠️ Plan {fila['id']}: imagen_procedimiento no cabe como JSON, se deja sin migrar")
+                    continue
+                cambios.append((nuevo, fila['id']))
+
+            if cambios:
+                cursor.executemany(
+                    "UPDATE plan_quirurgico SET imagen_procedimiento = %s WHERE id = %s",
+                    cambios
+                )
+                conn.commit()
+                print(f"🧹 imagen_procedimiento migrado a JSON en {len(cambios)} planes")
+            return len(cambios)
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,6 +9,16 @@ if os.getenv("ENV") != "production":
     load_dotenv()
 
 from app.core.config import settings
+from app.core.database import get_pool
+from app.core.middleware import (
+    CompresionMiddleware, InstrumentacionSQLMiddleware, LimiteUploadMiddleware, TiemposMiddleware
+)
+from app.core.respuestas import RespuestaJSON
+from app.core.migraciones import aplicar_migraciones
+from app.services.busqueda_pacientes import indice_pacientes
+from app.services.contadores import contadores_dashboard
+from app.services.pdf_cotizaciones import pdf_cotizaciones
+from app.utils.plan_codec import migrar_imagen_procedimiento
 from app.api import api_router
 
 USE_CLOUDINARY = all([
@@ -25,14 +36,64 @@ if not USE_CLOUDINARY:
 else:
     print(f"☁️ Usando CLOUDINARY para almacenamiento")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.DB_POOL_ENABLED:
+        try:
+            get_pool().warm()
+            print(f"🔌 Pool de conexiones listo (min={settings.DB_POOL_MIN_SIZE}, max={settings.DB_POOL_MAX_SIZE})")
+        except Exception as e:
+            print(f"⚠️ No se pudo precalentar el pool de conexiones: {e}")
+    if settings.DB_MIGRACIONES_AUTO:
+        try:
+            aplicar_migraciones()
+        except Exception as e:
+            print(f"⚠️ No se pudieron aplicar las migraciones de índices: {e}")
+    try:
+        migrar_imagen_procedimiento()
+    except Exception as e:
+        print(f"⚠️ No se pudo migrar imagen_procedimiento a JSON: {e}")
+    try:
+        indice_pacientes.construir()
+    except Exception as e:
+        print(f"⚠️ No se pudo construir el índice de pacientes (se reintentará al buscar): {e}")
+    try:
+        contadores_dashboard.reconciliar()
+    except Exception as e:
+        print(f"⚠️ No se pudieron calcular los contadores del dashboard (se reintentará al consultar): {e}")
+    yield
+    pdf_cotizaciones.cerrar()
+    if settings.DB_POOL_ENABLED:
+        get_pool().close_all()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     openapi_url="/openapi.json",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=RespuestaJSON,
+    lifespan=lifespan
 )
 
+# La más interna: sólo envuelve el ruteo y los handlers
+app.add_middleware(InstrumentacionSQLMiddleware)
+# Dentro de TiemposMiddleware para que el tiempo de comprimir cuente en el total
+if settings.COMPRESION_ACTIVA:
+    app.add_middleware(
+        CompresionMiddleware,
+        min_bytes=settings.COMPRESION_MIN_BYTES,
+        tipos=settings.COMPRESION_TIPOS,
+        nivel_gzip=settings.COMPRESION_NIVEL_GZIP,
+        nivel_brotli=settings.COMPRESION_NIVEL_BROTLI,
+        hilo_bytes=settings.COMPRESION_HILO_BYTES,
+    )
+# Lee el acumulador SQL de la anterior para separar el tiempo de DB
+app.add_middleware(TiemposMiddleware, server_timing=settings.SERVER_TIMING)
+
+# Se registra antes que CORS para que sus 413 también lleven cabeceras CORS
+app.add_middleware(LimiteUploadMiddleware, max_bytes=settings.UPLOAD_MAX_REQUEST_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,